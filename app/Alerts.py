@@ -0,0 +1,404 @@
+import itertools
+import threading
+import json
+import time
+import os
+import yagmail
+from .Attachments import AttachmentOptimizer
+
+
+class AlertDispatcher(object):
+
+    '''
+        Dedicated worker delivering email alerts off the stream loop. A single SMTP session is held open and reused between
+            alerts, being re-established only after a failure. Queued alerts are persisted to disk until delivered, so they
+            survive restarts, and failed deliveries are retried with exponential backoff rather than sleeping inline.
+    '''
+
+    def __init__(
+            self,
+            queue_directory : str,
+            app_email : str | None,
+            app_password : str | None,
+            target_email : str | None,
+            frequency : float = 600,
+            smtp_host : str = 'smtp.gmail.com',
+            smtp_port : int | None = None,
+            smtp_ssl : bool = True,
+            max_attempts : int = 5,
+            base_delay : float = 10,
+            maximum_delay : float = 900,
+            attachment_optimizer : AttachmentOptimizer | None = None
+        ) -> None:
+
+        '''
+            Initialise the alert dispatcher.
+
+            Paramaters:
+                * queue_directory (str) : Directory pending alerts are persisted within until delivered.
+                * app_email (str | None) : Account alerts are sent from.
+                * app_password (str | None) : App password for that account, login is skipped when empty (e.g. a local relay).
+                * target_email (str | None) : Recipient of the alerts.
+                * frequency (float) : Minimum number of seconds between accepted alerts.
+                * smtp_host (str) : SMTP server alerts are sent through.
+                * smtp_port (int | None) : Port of the SMTP server, None for yagmails default.
+                * smtp_ssl (bool) : Whether to connect over SSL.
+                * max_attempts (int) : Delivery attempts made before an alert is set aside as failed.
+                * base_delay (float) : Seconds before the first retry, doubling with each further attempt.
+                * maximum_delay (float) : Upper bound on the delay between retries.
+                * attachment_optimizer (AttachmentOptimizer | None) : Replaces captures with size budgeted variants, None to attach them as is.
+        '''
+
+        self.queue_directory = queue_directory
+        self.max_attempts = max(int(max_attempts), 1)
+        self.base_delay = base_delay
+        self.maximum_delay = maximum_delay
+        self.attachment_optimizer = attachment_optimizer
+
+        self.configure(app_email, app_password, target_email, frequency, smtp_host, smtp_port, smtp_ssl)
+
+        # Pending alerts ordered by submission, {'ID', 'subject', 'contents', 'attachments', 'created_at', 'attempts', 'next_attempt_at'}.
+        self.alerts : list[dict] = []
+
+        # Persistent SMTP session, None until first use or after a failure.
+        self.client = None
+
+        # Wall clock time the last alert was accepted, used to rate limit alerts.
+        self.last_accepted : float = 0
+
+        # Guards the pending alerts, wakes the worker when alerts arrive or the configuration changes.
+        self.condition = threading.Condition()
+
+        self.alert_IDs = itertools.count(int(time.time() * 1000))
+        self.running = False
+        self.worker = None
+
+        # Delivery outcomes.
+        self.sent : int = 0
+        self.failed : int = 0
+        self.suppressed : int = 0
+
+        self.load_pending()
+
+
+    def configure(
+            self,
+            app_email : str | None,
+            app_password : str | None,
+            target_email : str | None,
+            frequency : float = 600,
+            smtp_host : str = 'smtp.gmail.com',
+            smtp_port : int | None = None,
+            smtp_ssl : bool = True
+        ) -> None:
+
+        ''' Apply new credentials, recipient, rate limit or server, the session is re-established on the next delivery. '''
+
+        self.app_email = app_email
+        self.app_password = app_password
+        self.target_email = target_email
+        self.frequency = float(frequency)
+        self.smtp_host = smtp_host
+        self.smtp_port = int(smtp_port) if smtp_port else None
+        self.smtp_ssl = bool(smtp_ssl)
+
+        self.disconnect()
+
+
+    def start(self) -> None:
+
+        ''' Start the worker thread if it is not already running. '''
+
+        if self.worker is not None and self.worker.is_alive():
+            return
+
+        self.running = True
+        self.worker = threading.Thread(target=self.process_alerts, name='alert-dispatcher', daemon=True)
+        self.worker.start()
+
+
+    def stop(self, timeout : float = 10.0) -> None:
+
+        ''' Stop the worker thread, undelivered alerts remain on disk for the next run. '''
+
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+
+        if self.worker is not None:
+            self.worker.join(timeout=timeout)
+            self.worker = None
+
+        self.disconnect()
+
+
+    def alert_path(self, alert : dict) -> str:
+
+        ''' File a pending alert is persisted to. '''
+
+        return os.path.join(self.queue_directory, f'alert_{alert["ID"]}.json')
+
+
+    def persist(self, alert : dict) -> None:
+
+        ''' Write an alert to disk, via a temporary file so a crash never leaves it truncated. '''
+
+        if not os.path.exists(self.queue_directory):
+            os.makedirs(self.queue_directory, exist_ok=True)
+
+        path = self.alert_path(alert)
+        temporary_path = f'{path}.tmp'
+
+        with open(temporary_path, 'w') as alert_file:
+            json.dump(alert, alert_file)
+
+        os.replace(temporary_path, path)
+
+
+    def load_pending(self) -> None:
+
+        ''' Restore alerts left undelivered by a previous run. '''
+
+        if not os.path.isdir(self.queue_directory):
+            return
+
+        for file in sorted(os.listdir(self.queue_directory)):
+
+            if not (file.startswith('alert_') and file.endswith('.json')):
+                continue
+
+            try:
+                with open(os.path.join(self.queue_directory, file), 'r') as alert_file:
+                    self.alerts.append(json.load(alert_file))
+
+            except (IOError, ValueError) as e:
+                print(f'Failed to restore queued alert {file}!\n{e}')
+
+        if self.alerts:
+            print(f'Restored {len(self.alerts)} undelivered alert(s).')
+            self.start()
+
+
+    def send_alert(
+            self,
+            attachments : list[str] | None = None,
+            subject : str = 'Security Alert: Threat detected',
+            contents : str | None = None,
+            metadata : dict | None = None,
+            force : bool = False
+        ) -> dict | None:
+
+        '''
+            Queue an alert for delivery, returning immediately.
+
+            Paramaters:
+                * attachments (list[str] | None) : Paths of the captures attached to the alert.
+                * subject (str) : Email subject.
+                * contents (str | None) : Email body, defaults to a timestamped detection notice.
+                * metadata (dict | None) : Event metadata, e.g. the tracks trajectories used when optimising attachments.
+                * force (bool) : Bypass the rate limit, e.g. for test alerts.
+
+            Returns:
+                * (dict | None) : The queued alert, None if it was suppressed by the rate limit.
+        '''
+
+        now = time.time()
+
+        with self.condition:
+
+            # Drop alerts arriving within the configured frequency of the last one.
+            if not force and now - self.last_accepted < self.frequency:
+                self.suppressed += 1
+                return None
+
+            self.last_accepted = now
+
+            alert = {
+                'ID' : next(self.alert_IDs),
+                'subject' : subject,
+                'contents' : contents or f'Your Raspberry Pi has detected a threat at {time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(now))}',
+                'attachments' : list(attachments or []),
+                'metadata' : metadata or {},
+                'created_at' : now,
+                'attempts' : 0,
+                'next_attempt_at' : now
+            }
+
+        # Persisted before the worker can pick it up, so a crash before delivery does not lose it and a delivery finishing
+        # first never leaves its file behind to be sent again on the next start.
+        try:
+            self.persist(alert)
+        except OSError as e:
+            print(f'Failed to persist queued alert {alert["ID"]}, it will not survive a restart!\n{e}')
+
+        with self.condition:
+            self.alerts.append(alert)
+            self.condition.notify()
+
+        self.start()
+
+        return alert
+
+
+    def connect(self):
+
+        ''' Fetch the persistent SMTP session, establishing it if required. '''
+
+        if self.client is None:
+            self.client = yagmail.SMTP(
+                user=self.app_email,
+                password=self.app_password or '',
+                host=self.smtp_host,
+                port=self.smtp_port,
+                smtp_ssl=self.smtp_ssl,
+                # Unauthenticated local relays are spoken to in plain text, otherwise yagmails default of upgrading via STARTTLS.
+                smtp_starttls=None if self.app_password else False,
+                smtp_skip_login=not self.app_password
+            )
+
+        return self.client
+
+
+    def disconnect(self) -> None:
+
+        ''' Close the SMTP session should one be open. '''
+
+        client, self.client = getattr(self, 'client', None), None
+
+        if client is not None:
+            try:
+                client.close()
+            except Exception:
+                pass
+
+
+    def deliver(self, alert : dict) -> None:
+
+        ''' Send a single alert over the persistent session, raising should delivery fail. '''
+
+        if not all([self.app_email, self.target_email]):
+            raise ValueError('Missing essential email configurations, an app email and target email are required.')
+
+        # Attachments may have been removed by storage management whilst the alert was pending.
+        attachments = [path for path in alert['attachments'] if os.path.exists(path)]
+
+        # Swap the captures for their size budgeted variants, generated here on the first attempt and cached for retries.
+        if self.attachment_optimizer is not None and attachments:
+            attachments = self.attachment_optimizer.prepare(attachments, alert.get('metadata'))
+
+        self.connect().send(
+            to=self.target_email,
+            subject=alert['subject'],
+            contents=alert['contents'],
+            attachments=attachments or None
+        )
+
+
+    def process_alerts(self) -> None:
+
+        ''' Worker loop, delivers each alert once due, rescheduling failures with exponential backoff. '''
+
+        while True:
+
+            with self.condition:
+
+                while self.running:
+
+                    due = min((alert['next_attempt_at'] for alert in self.alerts), default=None)
+
+                    if due is not None and due <= time.time():
+                        break
+
+                    # Sleep until the earliest retry is due or a new alert arrives.
+                    self.condition.wait(timeout=None if due is None else due - time.time())
+
+                if not self.running:
+                    break
+
+                alert = min(self.alerts, key=lambda alert : alert['next_attempt_at'])
+
+            try:
+                self.deliver(alert)
+
+            except Exception as e:
+
+                # Transport failures and anything else, e.g. an attachment that could not be prepared, are retried with
+                # backoff rather than ending the worker and stranding the queue. The session may be broken, re-establish it.
+                self.disconnect()
+                self.retry(alert, e)
+                continue
+
+            with self.condition:
+                self.alerts.remove(alert)
+                self.sent += 1
+
+            self.discard(alert)
+
+
+    def retry(self, alert : dict, error : Exception) -> None:
+
+        ''' Reschedule a failed alert, setting it aside once it has exhausted its attempts. '''
+
+        alert['attempts'] += 1
+
+        if alert['attempts'] >= self.max_attempts:
+
+            with self.condition:
+                self.alerts.remove(alert)
+                self.failed += 1
+
+            print(f'Error : Failed to send email alert after {alert["attempts"]} attempts!\n{error}')
+
+            # Keep the alert on disk for inspection rather than retrying it forever.
+            try:
+                os.replace(self.alert_path(alert), f'{self.alert_path(alert)}.failed')
+            except FileNotFoundError:
+                pass
+
+            return
+
+        delay = min(self.base_delay * (2 ** (alert['attempts'] - 1)), self.maximum_delay)
+
+        with self.condition:
+            alert['next_attempt_at'] = time.time() + delay
+
+        print(f'Email alert {alert["ID"]} failed, retrying in {delay} seconds.\n{error}')
+
+        # The alert remains queued in memory should its file fail to update.
+        try:
+            self.persist(alert)
+        except OSError as e:
+            print(f'Failed to persist queued alert {alert["ID"]}!\n{e}')
+
+
+    def discard(self, alert : dict) -> None:
+
+        ''' Remove a delivered alert from disk. '''
+
+        try:
+            os.remove(self.alert_path(alert))
+        except FileNotFoundError:
+            pass
+
+
+    @property
+    def backlog(self) -> int:
+
+        ''' Number of alerts awaiting delivery. '''
+
+        with self.condition:
+            return len(self.alerts)
+
+
+    def statistics(self) -> dict:
+
+        ''' Report the backlog and delivery outcomes. '''
+
+        with self.condition:
+            return {
+                'backlog' : len(self.alerts),
+                'sent' : self.sent,
+                'failed' : self.failed,
+                'suppressed' : self.suppressed,
+                'connected' : self.client is not None
+            }
@@ -13,6 +13,11 @@ import os
 BASE_DIR = Path(__file__).resolve().parent.parent 
 STATIC_DIR = './app/static/'
 CAPTURE_UPLOADS_DIR = './app/upload_folder/'
+SEGMENT_UPLOADS_DIR = './app/upload_folder/segments/'
+ALERT_QUEUE_DIR = './app/alert_queue/'
+INCIDENTS_PATH = './app/upload_folder/incidents.jsonl'
+CAPTURE_INDEX_PATH = './app/upload_folder/captures.db'
+THUMBNAIL_CACHE_DIR = './app/upload_folder/.thumbnails/'
 TEST_DIR = './app/static/stream_test_imgs/'
 APP_DIR = os.path.join(BASE_DIR, './app')
 
@@ -33,6 +38,16 @@ INDEX = 0
 CAMER_CONFIG = 'camera_settings.json'
 CAMERA_CONFIG_PATH = os.path.join(APP_DIR, CAMER_CONFIG)
 
+''' JPEG quality used by each consumer of the encoded frame cache. '''
+
+JPEG_QUALITY_PROFILES : dict = {
+    'stream' : 70,
+    'remote' : 50,
+    'snapshot' : 85,
+    'alert' : 80,
+    'evidence' : 95
+}
+
 ''' Default values for the device camera to act as a fallback should the JSON retrieval fail. '''
 
 DEFAULT_CAMERA_CONFIG_DICT = {
@@ -40,10 +55,13 @@ DEFAULT_CAMERA_CONFIG_DICT = {
         'sensitivity' : 50,
         'threat_escalation_timer' : 10,
         'maximum_threat_threshold' : 5,
+        'engine' : 'frame_difference',
+        'tracking_prediction' : True,
         'regions_of_interest' : []
     },
     'stream_quality' : {
         'preferred_quality' : 'performance',
+        'analysis_scale' : 0.25,
         'performance' : {
             'framerate' : 60,
             'resolution' : [1280, 720]
@@ -58,11 +76,19 @@ DEFAULT_CAMERA_CONFIG_DICT = {
         'frequency' : 600,
         'recipient_email' : os.getenv('RECIPIENT_EMAIL', 'example@email.com'),
         'app_email' : os.getenv('APP_EMAIL','example@email.com'),
-        'app_password' : os.getenv('APP_PASSWORD', 'password')
+        'app_password' : os.getenv('APP_PASSWORD', 'password'),
+        'smtp_host' : os.getenv('SMTP_HOST', 'smtp.gmail.com'),
+        'smtp_port' : int(os.getenv('SMTP_PORT', 465)),
+        'smtp_ssl' : os.getenv('SMTP_SSL', 'True').lower() == 'true',
+        'digest_interval' : 0
     },
     'storage_settings' : {
         'auto_resource_management' : True,
-        'content_type' : 'video'
+        'content_type' : 'video',
+        'storage_budget_mb' : 4096,
+        'minimum_free_mb' : 512,
+        'keep_high_threat' : True,
+        'protected_threat' : 6
     }
 }
 
@@ -70,6 +96,21 @@ DEFAULT_CAMERA_CONFIG_DICT = {
     Device Storage Configuration Settings.
 '''
 
-FORMATTED_FILENAME_DATE : str = '%a-%b-%Y_%I-%M-%S%p',
-FORMATTED_DISPLAY_DATE : str = '%I:%M:%S%p',
-MAXIMUM_FILES_STORED : int = 60
+FORMATTED_FILENAME_DATE : str = '%a-%d-%b-%Y_%I-%M-%S%p'
+FORMATTED_DISPLAY_DATE : str = '%I:%M:%S%p'
+
+''' storage_settings.content_type values that record video clips rather than stills. '''
+
+CLIP_CONTENT_TYPES : tuple = ('clips', 'video')
+
+''' Length in seconds of each segment recorded whilst storage_settings.content_type is continuous. '''
+
+SEGMENT_LENGTH : int = 10
+
+''' Seconds without a threat being observed before an incident is closed, threats within it are grouped under one alert. '''
+
+INCIDENT_GAP : int = 60
+
+''' Size cap of the captures gallery thumbnail cache. '''
+
+THUMBNAIL_CACHE_BYTES : int = 64 * 1024 * 1024
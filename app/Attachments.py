@@ -0,0 +1,318 @@
+import numpy as np
+import cv2
+import os
+
+
+class AttachmentOptimizer(object):
+
+    '''
+        Produces size budgeted variants of a capture to attach to alerts in place of the capture itself: a downscaled JPEG
+            keyframe, a contact sheet of frames spanning the event and optionally a short, low framerate preview clip. Variants
+            are generated once, on the alert dispatchers worker, and cached beside the capture so retries and repeat alerts
+            reuse them.
+    '''
+
+    # File extensions treated as video clips, anything else is read as a still.
+    CLIP_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv')
+
+    def __init__(
+            self,
+            max_bytes : int = 20 * 1024 * 1024,
+            image_budget : int = 500 * 1024,
+            keyframe_size : tuple[int, int] = (960, 540),
+            sheet_frames : int = 6,
+            sheet_columns : int = 3,
+            sheet_tile_width : int = 320,
+            preview_clip : bool = False,
+            preview_width : int = 320,
+            preview_fps : float = 5,
+            preview_seconds : float = 10,
+            cache_folder : str = '.attachments'
+        ) -> None:
+
+        '''
+            Initialise the attachment optimizer.
+
+            Paramaters:
+                * max_bytes (int) : Budget for all of an alerts attachments combined, kept below typical mail size limits.
+                * image_budget (int) : Budget for each JPEG variant.
+                * keyframe_size (tuple[int, int]) : Maximum (width, height) of the keyframe.
+                * sheet_frames (int) : Number of frames tiled into the contact sheet.
+                * sheet_columns (int) : Number of tiles per row of the contact sheet.
+                * sheet_tile_width (int) : Width of each tile of the contact sheet.
+                * preview_clip (bool) : Whether to produce a preview clip of video captures.
+                * preview_width (int) : Width of the preview clip.
+                * preview_fps (float) : Framerate of the preview clip.
+                * preview_seconds (float) : Maximum length of the preview clip.
+                * cache_folder (str) : Folder beside each capture the variants are cached within.
+        '''
+
+        self.max_bytes = max_bytes
+        self.image_budget = image_budget
+        self.keyframe_size = tuple(keyframe_size)
+        self.sheet_frames = max(int(sheet_frames), 1)
+        self.sheet_columns = max(int(sheet_columns), 1)
+        self.sheet_tile_width = sheet_tile_width
+        self.preview_clip = preview_clip
+        self.preview_width = preview_width
+        self.preview_fps = preview_fps
+        self.preview_seconds = preview_seconds
+        self.cache_folder = cache_folder
+
+
+    def variant_path(self, capture_path : str, variant : str, extension : str) -> str:
+
+        ''' Cached location of a captures variant. '''
+
+        directory, file = os.path.split(capture_path)
+
+        return os.path.join(directory, self.cache_folder, f'{os.path.splitext(file)[0]}_{variant}.{extension}')
+
+
+    def is_cached(self, variant_path : str, capture_path : str) -> bool:
+
+        ''' Whether the variant exists and is no older than its capture. '''
+
+        return os.path.exists(variant_path) and os.path.getmtime(variant_path) >= os.path.getmtime(capture_path)
+
+
+    def prepare(self, capture_paths : list[str], metadata : dict | None = None) -> list[str]:
+
+        '''
+            Fetch the optimised attachments of the given captures, generating any that are not already cached.
+
+            Paramaters:
+                * capture_paths (list[str]) : Captures to be attached.
+                * metadata (dict | None) : Event metadata, its 'trajectories' are drawn onto the keyframe.
+
+            Returns:
+                * (list[str]) : Paths of the variants to attach, in priority order and within the combined budget.
+        '''
+
+        trajectories = list((metadata or {}).get('trajectories', {}).values())
+
+        attachments, total_bytes = [], 0
+
+        for capture_path in capture_paths:
+
+            if not os.path.exists(capture_path):
+                continue
+
+            try:
+                variant_paths = self.variants(capture_path, trajectories)
+                sizes = [os.path.getsize(variant_path) for variant_path in variant_paths]
+
+                # Nothing could be produced, e.g. cv2 returning no frame for a truncated JPEG or a clip without readable frames.
+                if not variant_paths:
+                    raise IOError('no variants could be produced')
+
+            except Exception as e:
+
+                # Unreadable or partly written capture. Fall back to the capture as is (budget permitting) rather than
+                # sending the alert without it.
+                print(f'Failed to optimise attachment {capture_path}, attaching it unoptimised.\n{e}')
+
+                try:
+                    variant_paths, sizes = [capture_path], [os.path.getsize(capture_path)]
+                except OSError:
+                    continue
+
+            for variant_path, size in zip(variant_paths, sizes):
+
+                # Lower priority variants are left out once the budget is spent.
+                if total_bytes + size > self.max_bytes:
+                    continue
+
+                attachments.append(variant_path)
+                total_bytes += size
+
+        return attachments
+
+
+    def variants(self, capture_path : str, trajectories : list) -> list[str]:
+
+        ''' Generate (or reuse) each variant of a single capture, returning those produced. '''
+
+        is_clip = os.path.splitext(capture_path)[1].lower() in self.CLIP_EXTENSIONS
+
+        variants = []
+
+        keyframe_path = self.variant_path(capture_path, 'keyframe', 'jpg')
+
+        if self.is_cached(keyframe_path, capture_path) or self.create_keyframe(capture_path, keyframe_path, is_clip, trajectories):
+            variants.append(keyframe_path)
+
+        # Stills are a single frame, a contact sheet or preview adds nothing.
+        if not is_clip:
+            return variants
+
+        sheet_path = self.variant_path(capture_path, 'sheet', 'jpg')
+
+        if self.is_cached(sheet_path, capture_path) or self.create_contact_sheet(capture_path, sheet_path):
+            variants.append(sheet_path)
+
+        if self.preview_clip:
+
+            preview_path = self.variant_path(capture_path, 'preview', 'mp4')
+
+            if self.is_cached(preview_path, capture_path) or self.create_preview(capture_path, preview_path):
+                variants.append(preview_path)
+
+        return variants
+
+
+    def read_frames(self, clip_path : str, count : int) -> list[np.ndarray]:
+
+        ''' Read the given number of frames evenly spaced across a clip. '''
+
+        capture = cv2.VideoCapture(clip_path)
+        frame_count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        frames = []
+
+        if frame_count > 0:
+            for index in np.linspace(0, frame_count - 1, num=min(count, frame_count)).astype(int):
+                capture.set(cv2.CAP_PROP_POS_FRAMES, int(index))
+                success, frame = capture.read()
+
+                if success:
+                    frames.append(frame)
+
+        capture.release()
+
+        return frames
+
+
+    def fit(self, frame : np.ndarray, max_size : tuple[int, int]) -> np.ndarray:
+
+        ''' Downscale a frame to fit within the maximum size, preserving its aspect ratio. '''
+
+        scale = min(max_size[0] / frame.shape[1], max_size[1] / frame.shape[0], 1.0)
+
+        if scale >= 1.0:
+            return frame
+
+        return cv2.resize(frame, (max(1, int(frame.shape[1] * scale)), max(1, int(frame.shape[0] * scale))), interpolation=cv2.INTER_AREA)
+
+
+    def write_within_budget(self, frame : np.ndarray, path : str) -> bool:
+
+        '''
+            Write a frame as a JPEG within the image budget, lowering the quality first and then the resolution until it fits.
+
+            Returns:
+                * (bool) : Whether the frame was written.
+        '''
+
+        while True:
+
+            for quality in (85, 75, 65, 55, 45, 35):
+
+                success, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+
+                if success and buffer.nbytes <= self.image_budget:
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+                    with open(path, 'wb') as variant_file:
+                        variant_file.write(buffer.tobytes())
+
+                    return True
+
+            # Give up rather than attach an unrecognisable thumbnail.
+            if min(frame.shape[:2]) < 120:
+                return False
+
+            frame = cv2.resize(frame, (frame.shape[1] * 3 // 4, frame.shape[0] * 3 // 4), interpolation=cv2.INTER_AREA)
+
+
+    def create_keyframe(self, capture_path : str, keyframe_path : str, is_clip : bool, trajectories : list) -> bool:
+
+        ''' Downscaled keyframe, the middle frame of a clip, with the events trajectories drawn on. '''
+
+        if is_clip:
+            frames = self.read_frames(capture_path, 3)
+            frame = frames[len(frames) // 2] if frames else None
+        else:
+            frame = cv2.imread(capture_path, cv2.IMREAD_COLOR)
+
+        if frame is None:
+            return False
+
+        frame = frame.copy()
+
+        # Trajectories are recorded in capture pixels, draw them before downscaling.
+        for trajectory in trajectories:
+            if len(trajectory) > 1:
+                cv2.polylines(frame, [np.asarray(trajectory, dtype=np.int32).reshape(-1, 1, 2)], False, (0, 255, 255), 2)
+
+        return self.write_within_budget(self.fit(frame, self.keyframe_size), keyframe_path)
+
+
+    def create_contact_sheet(self, clip_path : str, sheet_path : str) -> bool:
+
+        ''' Grid of frames sampled evenly across the clip, following the event from start to finish. '''
+
+        frames = self.read_frames(clip_path, self.sheet_frames)
+
+        if not frames:
+            return False
+
+        tile_width = self.sheet_tile_width
+        tile_height = max(1, int(frames[0].shape[0] * tile_width / frames[0].shape[1]))
+        rows = -(-len(frames) // self.sheet_columns)
+
+        sheet = np.zeros((rows * tile_height, self.sheet_columns * tile_width, 3), dtype=np.uint8)
+
+        for index, frame in enumerate(frames):
+            row, column = divmod(index, self.sheet_columns)
+            sheet[row * tile_height:(row + 1) * tile_height, column * tile_width:(column + 1) * tile_width] = \
+                cv2.resize(frame, (tile_width, tile_height), interpolation=cv2.INTER_AREA)
+
+        return self.write_within_budget(sheet, sheet_path)
+
+
+    def create_preview(self, clip_path : str, preview_path : str) -> bool:
+
+        ''' Short preview of the clip at a reduced resolution and framerate. '''
+
+        capture = cv2.VideoCapture(clip_path)
+        source_fps = capture.get(cv2.CAP_PROP_FPS) or self.preview_fps
+
+        # Keep every Nth frame to reach the preview framerate.
+        step = max(int(round(source_fps / self.preview_fps)), 1)
+        maximum_frames = int(self.preview_seconds * self.preview_fps)
+
+        writer, index, written = None, 0, 0
+
+        while written < maximum_frames:
+
+            success, frame = capture.read()
+
+            if not success:
+                break
+
+            if index % step == 0:
+
+                frame = self.fit(frame, (self.preview_width, self.preview_width))
+
+                if writer is None:
+                    os.makedirs(os.path.dirname(preview_path), exist_ok=True)
+                    writer = cv2.VideoWriter(preview_path, cv2.VideoWriter_fourcc(*'mp4v'), self.preview_fps, (frame.shape[1], frame.shape[0]))
+
+                writer.write(frame)
+                written += 1
+
+            index += 1
+
+        capture.release()
+
+        if writer is None:
+            return False
+
+        writer.release()
+
+        # A preview larger than the overall budget can never be attached.
+        if os.path.getsize(preview_path) > self.max_bytes:
+            os.remove(preview_path)
+            return False
+
+        return True
@@ -1,43 +1,238 @@
 from .AppConfig import *
+from .ConfigManager import ConfigManager
+from collections.abc import Mapping
+import threading
+import time
+import numpy as np
 import cv2
-from ConfigManager import ConfigManager
 
 
 class Camera(object):
 
     '''
-        Functionality pertaining to the devices (Raspberry Pi) onboard camera. 
+        Functionality pertaining to the devices (Raspberry Pi) onboard camera.
+
+        Frames are read from the sensor on a dedicated background thread into a small ring of preallocated buffers, each stamped
+            with a sequence number. Consumers fetch the latest frame (or the next one after a sequence they have already seen)
+            without ever blocking on the sensor, stale frames are simply overwritten rather than queued.
     '''
 
-    def __init__(self, INDEX : int, config_manager : ConfigManager):
+    # Resolution assumed whilst the device reports none, e.g. when no camera is attached, so the application can still start.
+    PLACEHOLDER_RESOLUTION : tuple[int, int] = (640, 480)
+
+    def __init__(
+            self,
+            INDEX : int,
+            config_manager : ConfigManager,
+            ring_size : int = 4,
+            fourcc : str | None = 'MJPG',
+            device_buffer_size : int = 1,
+            reopen_after : int = 10,
+            maximum_backoff : float = 1.0
+        ):
 
         '''
             Initialise an instance of the camera class.
 
             Paramaters:
                 * INDEX (int) : index where device can be accessed, set to 0 by default in the AppConfig.py file.
-                * config_manager (ConfigManager) : Instace of the ConfigManager class handling the settings. 
+                * config_manager (ConfigManager) : Instace of the ConfigManager class handling the settings.
+                * ring_size (int) : Number of preallocated frame buffers the capture thread cycles through.
+                * fourcc (str | None) : Pixel format requested from the device, None to keep the devices default.
+                * device_buffer_size (int) : Frames the driver may queue ahead of us, where the backend supports it.
+                * reopen_after (int) : Consecutive failed reads after which the device is released and reopened.
+                * maximum_backoff (float) : Longest delay in seconds between retries whilst reads keep failing.
         '''
 
+        # Capture thread state, set before anything that may fail so a partly built camera can still be cleaned up.
+        self.capturing = False
+        self.capture_thread = None
+
+        # Condition used to publish new frames and wake consumers waiting on them.
+        self.frame_condition = threading.Condition()
+
+        # Device index, kept to reopen the device should it stop responding.
+        self.index = INDEX
+
+        # Failure handling whilst reading from the device.
+        self.reopen_after = max(int(reopen_after), 1)
+        self.maximum_backoff = maximum_backoff
+
+        # Config file accessed from parsed dir.
+        self.config_manager = config_manager
+
+        # Fetch device settings.
+        self.settings = self.config_manager.load_settings()
+
         # Camera location index.
-        self.capture = cv2.VideoCapture(INDEX) 
+        self.capture = cv2.VideoCapture(INDEX)
+
+        # Pixel format and driver queue depth requested alongside every profile.
+        self.fourcc = fourcc
+        self.device_buffer_size = device_buffer_size
+
+        # What the device actually granted for the applied profile, filled in by configure_device.
+        self.granted_profile : dict = {}
+
+        # Request the selected stream_quality profiles resolution and frame rate before the first frame is read.
+        self.profile_name, profile = self.select_profile(self.settings)
+        self.configure_device(profile)
 
         # Implement small delay to warm up the camera.
         self.warmup_camera()
 
-        # Fetch properties of the camera capture.
-        self.fps = self.capture.get(cv2.CAP_PROP_FPS) if self.capture.get(cv2.CAP_PROP_FPS) > 0 else 30
+        ''' Capture ring buffer. '''
+
+        # Number of slots the capture thread cycles through, at least two so a slot being read is never the one being written.
+        self.ring_size = max(int(ring_size), 2)
+
+        # Preallocated frame buffers sized to the granted resolution.
+        self.allocate_ring()
+
+        # Sequence number of the most recently published frame.
+        self.latest_sequence = -1
+
+        # Highest sequence number handed to a consumer so far.
+        self.consumed_sequence = -1
+
+        # Count of frames overwritten before any consumer fetched them.
+        self.frames_dropped = 0
+
+        # Begin reading from the sensor in the background.
+        self.start_capture()
+
+
+    def select_profile(self, settings) -> tuple[str, dict]:
+
+        ''' Name and values of the stream_quality profile selected by preferred_quality, values are empty should it not exist. '''
+
+        stream_settings = settings.get('stream_quality', {})
+        name = str(stream_settings.get('preferred_quality', 'performance'))
+        profile = stream_settings.get(name)
+
+        return name, profile if isinstance(profile, Mapping) else {}
+
+
+    def configure_device(self, profile) -> dict:
+
+        '''
+            Request a profiles pixel format, resolution and frame rate from the device then read back what it granted, drivers
+                silently substitute the nearest mode they support so the granted values are what everything downstream is
+                sized from.
+
+            Paramaters:
+                * profile (Mapping) : stream_quality profile holding framerate and resolution, e.g. {'framerate' : 30, 'resolution' : [1280, 720]}.
+
+            Returns:
+                * (dict) : Granted width, height, fps and fourcc.
+        '''
+
+        fourcc = profile.get('fourcc', self.fourcc)
+        resolution = profile.get('resolution')
+        framerate = profile.get('framerate')
+
+        if not self.capture.isOpened():
+            print('Camera could not be opened, continuing with the requested profile until it becomes available.')
+
+        # Ask for the format first, V4L2 devices only list their higher resolution and frame rate modes under compressed formats.
+        if fourcc:
+            self.capture.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*str(fourcc)[:4].ljust(4)))
+
+        if isinstance(resolution, (list, tuple)) and len(resolution) == 2:
+            self.capture.set(cv2.CAP_PROP_FRAME_WIDTH, int(resolution[0]))
+            self.capture.set(cv2.CAP_PROP_FRAME_HEIGHT, int(resolution[1]))
+
+        if framerate:
+            self.capture.set(cv2.CAP_PROP_FPS, float(framerate))
+
+        # Our ring already holds recent frames, a deeper driver queue would only hand us stale ones.
+        if self.device_buffer_size:
+            self.capture.set(cv2.CAP_PROP_BUFFERSIZE, int(self.device_buffer_size))
+
+        # Fetch properties of the camera capture, some backends report no frame rate so fall back to the requested one.
+        granted_fps = self.capture.get(cv2.CAP_PROP_FPS)
+        self.fps = granted_fps if granted_fps > 0 else float(framerate or 30)
         self.frame_width = int(self.capture.get(cv2.CAP_PROP_FRAME_WIDTH))
         self.frame_height = int(self.capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+        # Missing or unopened devices report no size, fall back to the requested resolution (or a placeholder).
+        if self.frame_width <= 0 or self.frame_height <= 0:
+            fallback = resolution if isinstance(resolution, (list, tuple)) and len(resolution) == 2 else self.PLACEHOLDER_RESOLUTION
+            self.frame_width, self.frame_height = max(int(fallback[0]), 1), max(int(fallback[1]), 1)
+
         self.frame_size = (self.frame_width, self.frame_height)
-    
-        # Config file accessed from parsed dir.
-        self.config_manager = config_manager
 
-        # Fetch device settings.
-        self.settings = self.config_manager.load_settings()
+        granted_fourcc = int(self.capture.get(cv2.CAP_PROP_FOURCC))
+
+        self.granted_profile = {
+            'width' : self.frame_width,
+            'height' : self.frame_height,
+            'fps' : self.fps,
+            'fourcc' : ''.join(chr((granted_fourcc >> (8 * i)) & 0xFF) for i in range(4)).strip('\x00') or None
+        }
+
+        if self.capture.isOpened() and isinstance(resolution, (list, tuple)) and len(resolution) == 2 and tuple(map(int, resolution)) != self.frame_size:
+            print(f'Camera granted {self.frame_width}x{self.frame_height} rather than the requested {resolution[0]}x{resolution[1]}.')
+
+        if self.capture.isOpened() and framerate and abs(self.fps - float(framerate)) >= 1:
+            print(f'Camera granted {self.fps:g} fps rather than the requested {float(framerate):g} fps.')
+
+        return self.granted_profile
+
+
+    def apply_profile(self, settings=None) -> dict:
+
+        '''
+            Switch the device to the profile selected within the given settings at runtime. The capture thread is paused
+                whilst the device is reconfigured and the ring reallocated for the granted resolution, sequence numbers carry
+                on from where they were so consumers keep their place.
+
+            Paramaters:
+                * settings (Mapping | None) : Settings to select the profile from, the cameras current settings when None.
+
+            Returns:
+                * (dict | None) : Granted width, height, fps and fourcc, None should the capture thread not have stopped in time.
+        '''
+
+        name, profile = self.select_profile(settings if settings is not None else self.settings)
+
+        resume = self.capturing
+
+        # Never reconfigure the device or reallocate the ring whilst a read may still be writing into it.
+        if not self.stop_capture():
+
+            print(f'Failed to switch to the {name} capture profile, the capture thread is still reading from the device.')
+
+            # The reader only exits at the top of its loop, let it carry on as it was.
+            self.capturing = resume
+
+            return None
+
+        self.configure_device(profile)
+        self.profile_name = name
+        self.allocate_ring()
+
+        if resume:
+            self.start_capture()
+
+        print(f'Applied {name} capture profile: {self.granted_profile}')
+
+        return self.granted_profile
+
+
+    def allocate_ring(self) -> None:
+
+        ''' (Re)allocate the ring of frame buffers for the current resolution. '''
+
+        with self.frame_condition:
+
+            # Preallocated frame buffers the sensor is read directly into.
+            self.frame_buffers = [np.zeros((self.frame_height, self.frame_width, 3), dtype=np.uint8) for _ in range(self.ring_size)]
+
+            # Sequence number of the frame currently held within each slot, -1 whilst empty.
+            self.buffer_sequences = [-1] * self.ring_size
+
 
-    
     def warmup_camera(self, delay=2):
 
         ''' Iterate seconds to set delay, allowing camera to warmup. '''
@@ -45,35 +240,206 @@ class Camera(object):
         for _ in range(delay):
             self.capture.read()
 
-    
-    def capture_frame(self):
+
+    def start_capture(self) -> None:
+
+        ''' Start the background thread responsible for reading frames from the sensor if it is not already running. '''
+
+        if self.capture_thread is not None and self.capture_thread.is_alive():
+            return
+
+        self.capturing = True
+        self.capture_thread = threading.Thread(target=self.capture_loop, name='camera-capture', daemon=True)
+        self.capture_thread.start()
+
+
+    def stop_capture(self, timeout : float = 2.0) -> bool:
+
+        '''
+            Signal the capture thread to finish and wait for it to exit.
+
+            Returns:
+                * (bool) : Whether the capture thread has exited, False should it still be blocked within a read.
+        '''
+
+        self.capturing = False
+
+        # Wake any consumers waiting on a frame that will no longer arrive.
+        with self.frame_condition:
+            self.frame_condition.notify_all()
+
+        capture_thread = getattr(self, 'capture_thread', None)
+
+        if capture_thread is None or capture_thread is threading.current_thread():
+            return True
+
+        capture_thread.join(timeout=timeout)
+
+        # Keep hold of a thread that is still running so a second reader is never started alongside it.
+        if capture_thread.is_alive():
+            return False
+
+        self.capture_thread = None
+
+        return True
+
+
+    def reopen_device(self) -> None:
+
+        ''' Release and reopen the device, reapplying the current profile, after it has stopped responding. '''
+
+        print('Reopening camera after repeated failed reads.')
+
+        self.capture.release()
+        self.capture = cv2.VideoCapture(self.index)
+
+        self.configure_device(self.select_profile(self.settings)[1])
+
+
+    def capture_loop(self) -> None:
+
+        '''
+            Continuously read frames from the sensor into the next free slot of the ring buffer, publishing each one with
+                an incrementing sequence number. Runs on the capture thread until stop_capture is called.
+        '''
+
+        # Consecutive failed reads, reset by the next successful one.
+        failures = 0
+
+        while self.capturing:
+
+            # Back off whilst reads keep failing rather than spinning on the device, reopening it after too many failures.
+            if failures:
+
+                time.sleep(min(0.05 * 2 ** (failures - 1), self.maximum_backoff))
+
+                if failures % self.reopen_after == 0:
+                    try:
+                        self.reopen_device()
+                    except cv2.error as e:
+                        print(f'Hardware error: {e}')
+
+            # Slot following the most recently published frame, never the one consumers are currently reading.
+            next_sequence = self.latest_sequence + 1
+            slot = next_sequence % self.ring_size
+
+            try:
+                # Read directly into the preallocated buffer to avoid allocating a new frame per read.
+                ret, frame = self.capture.read(self.frame_buffers[slot])
+
+            except cv2.error as e:
+                # Inform user of a cv2 error, once per streak of failures.
+                if not failures:
+                    print(f'Hardware error: {e}')
+                failures += 1
+                continue
+
+            # If unccessful, let user know once per streak of failures.
+            if not ret or frame is None:
+                if not failures:
+                    print('Camera could not be accessed')
+                failures += 1
+                continue
+
+            if failures:
+                print(f'Camera recovered after {failures} failed reads.')
+                failures = 0
+
+            # Should the device hand back a differently sized frame, adopt it as that slots buffer.
+            if frame is not self.frame_buffers[slot]:
+                self.frame_buffers[slot] = frame
+
+            with self.frame_condition:
+
+                # The frame previously held in this slot was never consumed, record it as dropped.
+                if self.buffer_sequences[slot] > self.consumed_sequence:
+                    self.frames_dropped += 1
+
+                # Publish the new frame and notify waiting consumers.
+                self.buffer_sequences[slot] = next_sequence
+                self.latest_sequence = next_sequence
+                self.frame_condition.notify_all()
+
+
+    def read_latest(self) -> tuple[int, np.ndarray | None]:
 
         '''
-           Capture a frame from supplied hardware leveraging opencv.
+            Fetch the most recent frame without waiting on the sensor.
+
+            Returns:
+                * (tuple[int, np.ndarray | None]) : Sequence number and a copy of the latest frame, (-1, None) if nothing has been captured yet.
+        '''
+
+        with self.frame_condition:
+            return self._copy_latest()
+
+
+    def read_next(self, after_sequence : int, timeout : float | None = 1.0) -> tuple[int, np.ndarray | None]:
+
+        '''
+            Fetch the newest frame captured after the given sequence number, waiting for one to arrive if necessary. Any
+                intermediate frames the consumer has fallen behind on are skipped rather than replayed.
+
+            Paramaters:
+                * after_sequence (int) : Sequence number of the last frame the consumer processed.
+                * timeout (float | None) : Maximum number of seconds to wait for a new frame.
+
+            Returns:
+                * (tuple[int, np.ndarray | None]) : Sequence number and frame copy, frame is None if the wait timed out.
         '''
 
-        try:
-            
-            # Fetch status and frame from video capture object. 
-            ret, frame = self.capture.read()
+        with self.frame_condition:
 
-            # If unccessful, let user know.
-            if not ret:
-                print('Camera could not be accessed') 
+            # Wait until a newer frame has been published or capture has stopped.
+            self.frame_condition.wait_for(
+                lambda: self.latest_sequence > after_sequence or not self.capturing,
+                timeout=timeout
+            )
 
-            # Return frame for access. 
-            return frame 
+            if self.latest_sequence <= after_sequence:
+                return after_sequence, None
+
+            return self._copy_latest()
+
+
+    def _copy_latest(self) -> tuple[int, np.ndarray | None]:
+
+        ''' Copy the latest frame out of the ring, must be called whilst holding the frame condition. '''
+
+        if self.latest_sequence < 0:
+            return -1, None
+
+        # The ring was reallocated since the latest frame was published, nothing to hand out until the next one.
+        if self.buffer_sequences[self.latest_sequence % self.ring_size] != self.latest_sequence:
+            return self.latest_sequence, None
+
+        # Record the frame as consumed for drop accounting.
+        self.consumed_sequence = self.latest_sequence
+
+        # Copy so the caller owns the frame once the slot is eventually reused.
+        return self.latest_sequence, self.frame_buffers[self.latest_sequence % self.ring_size].copy()
+
+
+    def capture_frame(self):
+
+        '''
+           Return the latest frame captured by the background capture thread.
+        '''
+
+        _, frame = self.read_latest()
+
+        # Return frame for access.
+        return frame
 
-        except cv2.error as e:
-            # Inform user of a cv2 error.
-            print(f'Hardware error: {e}')
 
-        
     def __del__(self):
 
         '''
             Automatically invoked once camera object no longer in use for resource cleanup.
         '''
 
-        self.capture.release()
-        
\ No newline at end of file
+        self.stop_capture()
+
+        if getattr(self, 'capture', None) is not None:
+            self.capture.release()
+
@@ -0,0 +1,379 @@
+import threading
+import sqlite3
+import base64
+import json
+import time
+import os
+from .AppConfig import FORMATTED_FILENAME_DATE, FORMATTED_DISPLAY_DATE
+
+
+class CaptureIndex(object):
+
+    '''
+        SQLite backed index of the captures stored on the device, kept up to date as captures are written and deleted rather
+            than rescanning the captures directory on every request. Filtered, paginated queries are answered from indexed
+            columns, so the captures page stays quick however many files are stored.
+    '''
+
+    # File extensions indexed along with the kind of capture they hold.
+    CAPTURE_KINDS = {'.jpg' : 'still', '.jpeg' : 'still', '.png' : 'still', '.mp4' : 'clip', '.avi' : 'clip'}
+
+    # Bumped whenever previously indexed rows need recomputing, tracked by SQLite's user_version.
+    #   1 : Capture times were parsed from filenames lacking the day of the month, every file is re-dated.
+    SCHEMA_VERSION = 1
+
+    # Columns results may be ordered by.
+    ORDER_COLUMNS = ('captured_at', 'size', 'max_threat')
+
+    SCHEMA = (
+        '''
+        CREATE TABLE IF NOT EXISTS captures (
+            path TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            filename TEXT NOT NULL,
+            file_ext TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            captured_at REAL NOT NULL,
+            size INTEGER NOT NULL DEFAULT 0,
+            incident_ID INTEGER,
+            max_threat INTEGER NOT NULL DEFAULT 0,
+            thumbnail TEXT
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS captures_captured_at ON captures (captured_at)',
+        'CREATE INDEX IF NOT EXISTS captures_kind ON captures (kind, captured_at)',
+        'CREATE INDEX IF NOT EXISTS captures_incident ON captures (incident_ID)',
+        'CREATE INDEX IF NOT EXISTS captures_threat ON captures (max_threat)',
+        'CREATE INDEX IF NOT EXISTS captures_size ON captures (size)'
+    )
+
+    def __init__(self, database_path : str) -> None:
+
+        '''
+            Initialise the capture index, creating its database if it does not already exist.
+
+            Paramaters:
+                * database_path (str) : SQLite database file the index is stored in.
+        '''
+
+        self.database_path = database_path
+
+        directory = os.path.dirname(database_path)
+
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+
+        # One connection shared between the request handlers and capture writer, serialised by the lock.
+        self.connection = sqlite3.connect(database_path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.lock = threading.Lock()
+
+        with self.lock, self.connection:
+            # Write ahead logging lets readers proceed whilst a capture is being indexed.
+            self.connection.execute('PRAGMA journal_mode=WAL')
+
+            for statement in self.SCHEMA:
+                self.connection.execute(statement)
+
+            # Indexes created before thumbnails were cached lack their column.
+            columns = {row['name'] for row in self.connection.execute('PRAGMA table_info(captures)')}
+
+            if 'thumbnail' not in columns:
+                self.connection.execute('ALTER TABLE captures ADD COLUMN thumbnail TEXT')
+
+            # Nor the stored name captures are served by, filled in from the filename and its extension.
+            if 'name' not in columns:
+                self.connection.execute("ALTER TABLE captures ADD COLUMN name TEXT NOT NULL DEFAULT ''")
+                self.connection.execute('UPDATE captures SET name = filename || file_ext')
+                self.connection.execute('DELETE FROM captures WHERE rowid NOT IN (SELECT MIN(rowid) FROM captures GROUP BY name)')
+
+            # Stills and clips taken within the same second share a filename, only the stored name tells them apart.
+            self.connection.execute('CREATE UNIQUE INDEX IF NOT EXISTS captures_name ON captures (name)')
+
+            # Rows indexed by an older version are recomputed on the next reconcile.
+            self.schema_version = self.connection.execute('PRAGMA user_version').fetchone()[0]
+
+
+    def close(self) -> None:
+
+        ''' Close the database connection. '''
+
+        with self.lock:
+            self.connection.close()
+
+
+    def parse_captured_at(self, path : str) -> float:
+
+        '''
+            Capture time encoded in the filename, falling back to the files modification time. Filenames written before the
+                day of the month was included do not match the format, so are dated by modification time rather than to
+                the first of their month.
+        '''
+
+        filename = os.path.splitext(os.path.basename(path))[0]
+
+        try:
+            return time.mktime(time.strptime(filename, FORMATTED_FILENAME_DATE))
+        except ValueError:
+            return os.stat(path).st_mtime
+
+
+    def add(self, path : str, captured_at : float | None = None, incident_ID : int | None = None, max_threat : int = 0) -> bool:
+
+        '''
+            Index (or re-index) a capture once it has been written.
+
+            Paramaters:
+                * path (str) : Path of the capture.
+                * captured_at (float | None) : Time of capture, parsed from the filename when not given.
+                * incident_ID (int | None) : Incident the capture belongs to.
+                * max_threat (int) : Highest threat level of the tracks captured.
+
+            Returns:
+                * (bool) : Whether the capture was indexed, False for unrecognised file types or missing files.
+        '''
+
+        filename, file_ext = os.path.splitext(os.path.basename(path))
+        kind = self.CAPTURE_KINDS.get(file_ext.lower())
+
+        if kind is None or not os.path.exists(path):
+            return False
+
+        with self.lock, self.connection:
+            self.connection.execute(
+                '''
+                INSERT OR REPLACE INTO captures (path, name, filename, file_ext, kind, captured_at, size, incident_ID, max_threat)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''',
+                (path, filename + file_ext, filename, file_ext, kind, captured_at or self.parse_captured_at(path), os.path.getsize(path), incident_ID, int(max_threat))
+            )
+
+        return True
+
+
+    def set_thumbnail(self, path : str, key : str) -> None:
+
+        ''' Record the content key a captures thumbnail is cached under. '''
+
+        with self.lock, self.connection:
+            self.connection.execute('UPDATE captures SET thumbnail = ? WHERE path = ?', (key, path))
+
+
+    def remove(self, path : str) -> None:
+
+        ''' Drop a capture from the index once it has been deleted. '''
+
+        with self.lock, self.connection:
+            self.connection.execute('DELETE FROM captures WHERE path = ?', (path,))
+
+
+    def build_filters(
+            self,
+            kind : str | None = None,
+            incident_ID : int | None = None,
+            min_threat : int | None = None,
+            threat_below : int | None = None,
+            since : float | None = None,
+            until : float | None = None,
+            search : str | None = None
+        ) -> tuple[str, list]:
+
+        ''' Build the WHERE clause and its parameters for the given filters. '''
+
+        clauses, parameters = [], []
+
+        for clause, value in (
+            ('kind = ?', kind),
+            ('incident_ID = ?', incident_ID),
+            ('max_threat >= ?', min_threat),
+            ('max_threat < ?', threat_below),
+            ('captured_at >= ?', since),
+            ('captured_at <= ?', until),
+            ('filename LIKE ?', f'%{search}%' if search else None)
+        ):
+            if value is not None:
+                clauses.append(clause)
+                parameters.append(value)
+
+        return (' WHERE ' + ' AND '.join(clauses)) if clauses else '', parameters
+
+
+    def query(self, limit : int = 50, offset : int = 0, order_by : str = 'captured_at', descending : bool = True, **filters) -> list[dict]:
+
+        '''
+            Fetch a page of captures matching the given filters.
+
+            Paramaters:
+                * limit (int) : Maximum number of captures returned.
+                * offset (int) : Number of matching captures skipped.
+                * order_by (str) : One of ORDER_COLUMNS.
+                * descending (bool) : Newest (or largest) first.
+                * filters : kind, incident_ID, min_threat, threat_below, since, until and search (a filename substring).
+
+            Returns:
+                * (list[dict]) : Capture records.
+        '''
+
+        if order_by not in self.ORDER_COLUMNS:
+            raise ValueError(f'Cannot order captures by {order_by}!')
+
+        where, parameters = self.build_filters(**filters)
+
+        with self.lock:
+            rows = self.connection.execute(
+                f'SELECT * FROM captures{where} ORDER BY {order_by} {"DESC" if descending else "ASC"}, path LIMIT ? OFFSET ?',
+                parameters + [max(int(limit), 0), max(int(offset), 0)]
+            ).fetchall()
+
+        return [self.record(row) for row in rows]
+
+
+    def page(self, cursor : str | None = None, limit : int = 50, descending : bool = True, **filters) -> tuple[list[dict], str | None]:
+
+        '''
+            Fetch a page of captures by capture time using keyset pagination, each page costs the same however deep into
+                the captures it is, unlike an offset which has to skip every capture before it.
+
+            Paramaters:
+                * cursor (str | None) : Cursor returned alongside the previous page, None for the first page.
+                * limit (int) : Maximum number of captures returned.
+                * descending (bool) : Newest first.
+                * filters : As accepted by query.
+
+            Returns:
+                * (tuple[list[dict], str | None]) : Capture records and the cursor of the next page, None on the last page.
+        '''
+
+        where, parameters = self.build_filters(**filters)
+        limit = max(int(limit), 1)
+        direction, comparison = ('DESC', '<') if descending else ('ASC', '>')
+
+        # Resume strictly after the last capture of the previous page, ties on capture time broken by path.
+        if cursor:
+            captured_at, path = self.decode_cursor(cursor)
+            where += (' AND ' if where else ' WHERE ') + f'(captured_at {comparison} ? OR (captured_at = ? AND path {comparison} ?))'
+            parameters += [captured_at, captured_at, path]
+
+        with self.lock:
+            rows = self.connection.execute(
+                f'SELECT * FROM captures{where} ORDER BY captured_at {direction}, path {direction} LIMIT ?',
+                parameters + [limit + 1]
+            ).fetchall()
+
+        records = [self.record(row) for row in rows[:limit]]
+        next_cursor = self.encode_cursor(records[-1]) if len(rows) > limit else None
+
+        return records, next_cursor
+
+
+    def encode_cursor(self, record : dict) -> str:
+
+        ''' Opaque cursor identifying a captures position in the capture time ordering. '''
+
+        return base64.urlsafe_b64encode(json.dumps([record['captured_at'], record['path']]).encode()).decode()
+
+
+    def decode_cursor(self, cursor : str) -> tuple[float, str]:
+
+        ''' Position encoded within a cursor, raising ValueError should it be malformed. '''
+
+        try:
+            captured_at, path = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            return float(captured_at), str(path)
+
+        except (TypeError, ValueError, UnicodeDecodeError) as e:
+            raise ValueError(f'Invalid cursor {cursor}!') from e
+
+
+    def count(self, **filters) -> int:
+
+        ''' Number of captures matching the given filters. '''
+
+        where, parameters = self.build_filters(**filters)
+
+        with self.lock:
+            return self.connection.execute(f'SELECT COUNT(*) FROM captures{where}', parameters).fetchone()[0]
+
+
+    def total_size(self, **filters) -> int:
+
+        ''' Combined size in bytes of the captures matching the given filters. '''
+
+        where, parameters = self.build_filters(**filters)
+
+        with self.lock:
+            return self.connection.execute(f'SELECT COALESCE(SUM(size), 0) FROM captures{where}', parameters).fetchone()[0]
+
+
+    def get(self, name : str) -> dict | None:
+
+        ''' Fetch a single capture by its stored name (filename and extension), a lookup on its unique index. '''
+
+        with self.lock:
+            row = self.connection.execute('SELECT * FROM captures WHERE name = ?', (name,)).fetchone()
+
+        return self.record(row) if row is not None else None
+
+
+    def record(self, row : sqlite3.Row) -> dict:
+
+        ''' Turn a row into a capture record, including the date and time fields the captures page displays. '''
+
+        record = dict(row)
+        captured_at = time.localtime(record['captured_at'])
+
+        record['fullpath'] = record['path']
+        record['capture_date'] = time.strftime('%a-%d-%b-%Y', captured_at)
+        record['capture_time'] = time.strftime(FORMATTED_DISPLAY_DATE, captured_at)
+
+        return record
+
+
+    def reconcile(self, directory : str) -> tuple[int, int]:
+
+        '''
+            Bring the index in line with the captures directory in a single pass, e.g. on start up or after files were
+                changed by hand. Only files missing from the index, or whose size has changed, are (re)indexed.
+
+            Returns:
+                * (tuple[int, int]) : Number of captures added and removed.
+        '''
+
+        if not os.path.isdir(directory):
+            return 0, 0
+
+        # An index built by an older version is recomputed in full, e.g. to re-date its captures.
+        redate = self.schema_version < self.SCHEMA_VERSION
+
+        with self.lock:
+            indexed = {row['path'] : row['size'] for row in self.connection.execute('SELECT path, size FROM captures')}
+
+        present, added, redated = set(), 0, []
+
+        with os.scandir(directory) as entries:
+            for entry in entries:
+
+                if not entry.is_file() or os.path.splitext(entry.name)[1].lower() not in self.CAPTURE_KINDS:
+                    continue
+
+                path = os.path.join(directory, entry.name)
+                present.add(path)
+
+                if indexed.get(path) != entry.stat().st_size:
+                    added += int(self.add(path))
+
+                elif redate:
+                    redated.append((self.parse_captured_at(path), path))
+
+        missing = [path for path in indexed if path not in present]
+
+        with self.lock, self.connection:
+            self.connection.executemany('DELETE FROM captures WHERE path = ?', [(path,) for path in missing])
+
+            if redate:
+                self.connection.executemany('UPDATE captures SET captured_at = ? WHERE path = ?', redated)
+                self.connection.execute(f'PRAGMA user_version = {self.SCHEMA_VERSION}')
+                self.schema_version = self.SCHEMA_VERSION
+
+        return added, len(missing)
+
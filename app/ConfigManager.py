@@ -1,9 +1,126 @@
+import threading
+import tempfile
+import copy
 import json
+import time
 import os
+from types import MappingProxyType
+
+
+class SettingsSnapshot(object):
+
+    '''
+        Immutable view of the device settings as loaded at a point in time. Nested dictionaries are read-only mappings and
+            lists tuples, so a snapshot can be shared between request handlers and the processing loop without copying.
+    '''
+
+    __slots__ = ('version', 'values', 'loaded_at', 'signature')
+
+    def __init__(self, version : int, values : dict, signature : tuple | None = None) -> None:
+
+        '''
+            Initialise a settings snapshot.
+
+            Paramaters:
+                * version (int) : Incremented every time the settings are (re)loaded or saved.
+                * values (dict) : Merged settings, frozen on construction.
+                * signature (tuple | None) : (mtime, size) of the settings file the values were read from.
+        '''
+
+        object.__setattr__(self, 'version', version)
+        object.__setattr__(self, 'values', self.freeze(values))
+        object.__setattr__(self, 'loaded_at', time.time())
+        object.__setattr__(self, 'signature', signature)
+
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Settings snapshots are immutable!')
+
+
+    @staticmethod
+    def freeze(value):
+
+        ''' Recursively convert dictionaries into read-only mappings and lists into tuples. '''
+
+        if isinstance(value, dict):
+            return MappingProxyType({key : SettingsSnapshot.freeze(item) for key, item in value.items()})
+
+        if isinstance(value, (list, tuple)):
+            return tuple(SettingsSnapshot.freeze(item) for item in value)
+
+        return value
+
+
+    @staticmethod
+    def thaw(value):
+
+        ''' Recursively convert a frozen value back into plain dictionaries and lists, e.g. to be edited or saved. '''
+
+        if isinstance(value, (dict, MappingProxyType)):
+            return {key : SettingsSnapshot.thaw(item) for key, item in value.items()}
+
+        if isinstance(value, (list, tuple)):
+            return [SettingsSnapshot.thaw(item) for item in value]
+
+        return value
+
+
+    def get(self, key, default=None):
+        return self.values.get(key, default)
+
+
+    def __getitem__(self, key):
+        return self.values[key]
+
+
+    def to_dict(self) -> dict:
+
+        ''' Mutable deep copy of the settings. '''
+
+        return self.thaw(self.values)
+
+
+    def changes(self, previous : 'SettingsSnapshot | None') -> set[str]:
+
+        '''
+            Dotted paths of every setting differing from a previous snapshot, e.g. {'motion_detection.sensitivity'}.
+
+            Paramaters:
+                * previous (SettingsSnapshot | None) : Snapshot to compare against, every setting is reported when None.
+        '''
+
+        def compare(current, before, prefix : str) -> set[str]:
+
+            # A section missing from either side reports each of its settings rather than the section as a whole.
+            if current is None and isinstance(before, MappingProxyType):
+                current = MappingProxyType({})
+
+            if before is None and isinstance(current, MappingProxyType):
+                before = MappingProxyType({})
+
+            # Recurse into sections, anything else is compared as a whole.
+            if isinstance(current, MappingProxyType) and isinstance(before, MappingProxyType):
+
+                changed = set()
+
+                for key in set(current) | set(before):
+                    changed |= compare(current.get(key), before.get(key), f'{prefix}.{key}' if prefix else key)
+
+                return changed
+
+            return set() if current == before else {prefix}
+
+        return compare(self.values, previous.values if previous is not None else MappingProxyType({}), '')
 
 
 class ConfigManager(object):
 
+    '''
+        Manages the devices settings file. The settings are held in memory as an immutable snapshot which is only reloaded
+            should the files modification time or size change, so reads cost a single stat rather than a parse. Writes go
+            to a temporary file which is flushed to disk and swapped into place, a crash mid-write never leaves a partial file.
+    '''
+
     def __init__(self, config_file : str, default_values : dict):
 
         '''
@@ -18,58 +135,181 @@ class ConfigManager(object):
         # JSON containing configuration data. 
         self.config_file = config_file 
 
-        # Default values dictionary. 
+        # Default values dictionary, never mutated, merges are made into a copy. 
         self.default_values = default_values
 
-    
-    def load_settings(self):
+        # Serialises reloads and writes, reads of the current snapshot never take it.
+        self.lock = threading.RLock()
+
+        # Most recently loaded snapshot, replaced wholesale so readers always see a complete set of settings.
+        self.current : SettingsSnapshot | None = None
+
+        # Version handed to the next snapshot.
+        self.version = 0
+
+        # Signature of a settings file which failed to parse, so it is not re-read until it changes again.
+        self.failed_signature = None
+
+        # Callables notified with (previous, current) snapshots whenever new settings are published.
+        self.listeners : list = []
+
+
+    def file_signature(self) -> tuple | None:
+
+        ''' (mtime, size) of the settings file, None should it not exist. '''
+
+        try:
+            stat = os.stat(self.config_file)
+            return (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            return None
+
+
+    def publish(self, values : dict, signature : tuple | None) -> SettingsSnapshot:
+
+        ''' Replace the current snapshot with one holding the given values, notifying subscribers. '''
+
+        previous = self.current
+
+        self.version += 1
+        self.current = SettingsSnapshot(version=self.version, values=values, signature=signature)
+
+        for listener in list(self.listeners):
+            try:
+                listener(previous, self.current)
+            except Exception as e:
+                print(f'Settings listener failed: {e}')
+
+        return self.current
+
+
+    def subscribe(self, listener) -> None:
 
         '''
-            Load settings from the onboard Json file if it is in existence, else use default values. Ensure that 
-                both the JSON and default dictionary values are merged to guarantee both are up to date, mitigating
-                the chances of missing key value pairs. 
+            Register a callable notified with the (previous, current) snapshots whenever settings are saved or the settings
+                file is found to have changed. Listeners are called on the publishing thread whilst the lock is held, so
+                should only hand the snapshot over to be applied rather than applying it themselves.
         '''
 
-        # If provided path exists, leverage that configuration file. 
-        if os.path.exists(self.config_file):
-            
-            # Read configuration file. 
-            with open(self.config_file, 'r') as config_file:
+        if listener not in self.listeners:
+            self.listeners.append(listener)
 
-                print('Config file present, loading settings.')
 
-                # Load values.
-                loaded_settings = json.load(config_file)
+    def unsubscribe(self, listener) -> None:
+
+        ''' Stop notifying a previously subscribed listener. '''
+
+        if listener in self.listeners:
+            self.listeners.remove(listener)
+
+
+    def snapshot(self) -> SettingsSnapshot:
+
+        '''
+            Fetch the current settings snapshot, reloading it only should the settings file have changed on disk since it
+                was last read.
+        '''
+
+        current, signature = self.current, self.file_signature()
+
+        # Fast path, nothing has changed since the last load.
+        if current is not None and signature is not None and signature in (current.signature, self.failed_signature):
+            return current
+
+        with self.lock:
+
+            # Another thread may have reloaded whilst we waited on the lock.
+            signature = self.file_signature()
+
+            if self.current is not None and signature is not None and signature in (self.current.signature, self.failed_signature):
+                return self.current
+
+            # If provided path exists, leverage that configuration file. 
+            if signature is not None:
 
-                # Merge values from JSON with that in the default values dictionary. 
-                merged_settings = self.recursive_update(self.default_values, loaded_settings)
+                try:
+                    # Read configuration file. 
+                    with open(self.config_file, 'r') as config_file:
+                        loaded_settings = json.load(config_file)
 
-                # Return merged, updated values.
-                return merged_settings
+                except (IOError, ValueError) as e:
 
-        else:
+                    # Keep serving the last good settings rather than failing every read.
+                    print(f'Failed to read settings file, keeping previous settings.\n{e}')
+
+                    self.failed_signature = signature
+
+                    if self.current is not None:
+                        return self.current
+
+                    loaded_settings = {}
+
+                print('Config file present, loading settings.')
+
+                # Merge values from JSON into a copy of the default values dictionary. 
+                merged_settings = self.recursive_update(copy.deepcopy(self.default_values), loaded_settings)
+
+                return self.publish(merged_settings, signature)
 
             # Otherwise, if not present; load, save and return default values.
 
             print('Config file not found, loading default values!')
 
-            self.settings = self.default_values
-            self.save_settings(settings=self.settings)
+            settings = copy.deepcopy(self.default_values)
+            error = self.save_settings(settings=settings)
+
+            # Still serve the defaults should the file not be writable.
+            if error is not None:
+                print(error)
+                return self.publish(settings, None)
 
-            return self.settings
+            return self.current
+
+
+    def load_settings(self):
+
+        '''
+            Load settings from the onboard Json file if it is in existence, else use default values. Ensure that 
+                both the JSON and default dictionary values are merged to guarantee both are up to date, mitigating
+                the chances of missing key value pairs. 
+
+            Returns:
+                * (Mapping) : Read-only settings of the current snapshot, use snapshot().to_dict() for an editable copy.
+        '''
+
+        return self.snapshot().values
     
 
     def save_settings(self, settings : dict):
 
-        ''' Save currently applied settings to a JSON file for later access and retrieval. '''
+        ''' Save currently applied settings to a JSON file for later access and retrieval, atomically replacing the old file. '''
 
-        try:
-            # Open config file and write new values.
-            with open(self.config_file, 'w') as config_file:
-                json.dump(settings, config_file, indent=4)
+        settings = SettingsSnapshot.thaw(settings)
+        directory = os.path.dirname(os.path.abspath(self.config_file))
+
+        with self.lock:
+
+            try:
+                # Write alongside the config file so the final rename stays on the same filesystem.
+                descriptor, temporary_path = tempfile.mkstemp(prefix='.settings_', suffix='.json', dir=directory)
 
-        except IOError as e:
-            return f'Failed to save updated values to settings file.\n{e}'
+                try:
+                    with os.fdopen(descriptor, 'w') as config_file:
+                        json.dump(settings, config_file, indent=4)
+                        config_file.flush()
+                        os.fsync(config_file.fileno())
+
+                    os.replace(temporary_path, self.config_file)
+
+                except BaseException:
+                    os.remove(temporary_path)
+                    raise
+
+            except IOError as e:
+                return f'Failed to save updated values to settings file.\n{e}'
+
+            # What was written is what the next read would load, publish it straight away.
+            self.publish(self.recursive_update(copy.deepcopy(self.default_values), settings), self.file_signature())
         
 
     def recursive_update(self, settings : dict, updated_values : dict):
@@ -83,7 +323,7 @@ class ConfigManager(object):
         for key, value in updated_values.items():
 
             # If nested key value pair exists.
-            if isinstance(value, dict) and key in settings:
+            if isinstance(value, dict) and isinstance(settings.get(key), dict):
                 # Get that setting, its key and update it, use recursion for nested key value pairs.
                 settings[key] = self.recursive_update(settings=settings[key], updated_values=value)
             else:
@@ -110,7 +350,7 @@ class ConfigManager(object):
         return { key : self.build_dictionary(keys=keys[1:], value=value)}
 
 
-    def type_cast_values(value : str | bool | int | list):
+    def type_cast_values(self, value : str | bool | int | list):
 
         ''' Helper function to enforce type checking when updating values. '''
 
@@ -134,16 +374,22 @@ class ConfigManager(object):
         return value
 
 
-    def update_settings(self, updated_values):
+    def update_settings(self, updated_values : dict):
 
-        ''' Update settings with new values set by the user, save to the config file. '''
+        '''
+            Update settings with new values set by the user, save to the config file.
+
+            Returns:
+                * (str | None) : Error message should the settings fail to save, None otherwise.
+        '''
 
-        self.recursive_update(self.settings, updated_values)
-        self.save_settings(self.settings)
+        with self.lock:
+            settings = self.recursive_update(self.snapshot().to_dict(), updated_values)
+            return self.save_settings(settings)
 
 
     def fetch_current_settings(self):
 
         ''' Helper function to return current settings stored within the JSON file. '''
 
-        return self.settings
+        return self.snapshot().values
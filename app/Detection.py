@@ -1,10 +1,349 @@
 import cv2 
-import os
 import numpy as np
-import yagmail
-import yagmail.error
-from AppConfig import *
-from time import time
+from abc import ABC, abstractmethod
+from .AppConfig import *
+import time
+
+
+class MotionDetector(ABC):
+
+    '''
+        Interface shared by the interchangeable motion detection engines. Each engine consumes preprocessed (greyscale, blurred,
+            downsampled) frames, keeps whatever state it needs between frames and returns a binary foreground mask where motion
+            has been observed. The time taken to produce each mask is recorded so engines can be compared on the Pi.
+    '''
+
+    # Name the engine is selected by within the settings file.
+    name : str = 'base'
+
+    def __init__(self, cost_smoothing : float = 0.1) -> None:
+
+        '''
+            Initialise shared engine state.
+
+            Paramaters:
+                * cost_smoothing (float) : Weight given to the newest measurement within the rolling average cost.
+        '''
+
+        # Weight of the newest sample within the exponential moving average.
+        self.cost_smoothing = cost_smoothing
+
+        # Cost in milliseconds of the most recent frame, alongside a smoothed average.
+        self.last_cost_ms : float = 0.0
+        self.average_cost_ms : float = 0.0
+
+        # Number of frames processed by the engine.
+        self.frames_processed : int = 0
+
+
+    def apply(self, frame : np.ndarray, binarisation_threshold : int = 25) -> np.ndarray | None:
+
+        '''
+            Produce a foreground mask for the given frame, recording the time it took.
+
+            Paramaters:
+                * frame (np.ndarray) : Preprocessed greyscale frame.
+                * binarisation_threshold (int) : Pixel intensity difference required to register as change.
+
+            Returns:
+                * (np.ndarray | None) : Binary foreground mask, None whilst the engine is still gathering history.
+        '''
+
+        started_at = time.perf_counter()
+
+        mask = self.foreground_mask(frame, binarisation_threshold)
+
+        # Record the per frame cost alongside its rolling average.
+        self.last_cost_ms = (time.perf_counter() - started_at) * 1000
+        self.average_cost_ms = self.last_cost_ms if self.frames_processed == 0 else \
+            (1 - self.cost_smoothing) * self.average_cost_ms + self.cost_smoothing * self.last_cost_ms
+        self.frames_processed += 1
+
+        return mask
+
+
+    @abstractmethod
+    def foreground_mask(self, frame : np.ndarray, binarisation_threshold : int) -> np.ndarray | None:
+
+        ''' Engine specific foreground extraction, implemented by each engine. '''
+
+
+    def reset(self) -> None:
+
+        ''' Discard any state accumulated from previous frames. '''
+
+        pass
+
+
+    def statistics(self) -> dict:
+
+        ''' Report the engines name and measured per frame cost. '''
+
+        return {
+            'engine' : self.name,
+            'last_cost_ms' : round(self.last_cost_ms, 3),
+            'average_cost_ms' : round(self.average_cost_ms, 3),
+            'frames_processed' : self.frames_processed
+        }
+
+
+class FrameDifferenceDetector(MotionDetector):
+
+    '''
+        Original engine, differences each frame against the one before it. Cheapest of the engines but only sensitive to
+            change between consecutive frames, so slow movement produces small differences.
+    '''
+
+    name = 'frame_difference'
+
+    def __init__(self, **kwargs) -> None:
+
+        super().__init__(**kwargs)
+
+        # Previous preprocessed frame.
+        self.prev_frame = None
+
+
+    def foreground_mask(self, frame : np.ndarray, binarisation_threshold : int) -> np.ndarray | None:
+
+        # Nothing to compare against on the first frame or after a change in resolution.
+        if self.prev_frame is None or self.prev_frame.shape != frame.shape:
+            self.prev_frame = frame
+            return None
+
+        # Compute absolute difference between current and previous frames.
+        frame_difference = cv2.absdiff(self.prev_frame, frame)
+        self.prev_frame = frame
+
+        # Apply a binary threshold to fetch regions with significant change within the frame.
+        _, frame_thresholded = cv2.threshold(frame_difference, binarisation_threshold, 255, cv2.THRESH_BINARY)
+
+        return frame_thresholded
+
+
+    def reset(self) -> None:
+        self.prev_frame = None
+
+
+class RunningAverageDetector(MotionDetector):
+
+    '''
+        Maintains an incrementally updated background model with cv2.accumulateWeighted and differences each frame against it.
+            Slow movers accumulate difference against the background rather than the previous frame and single noisy frames are
+            averaged out.
+    '''
+
+    name = 'running_average'
+
+    def __init__(self, learning_rate : float = 0.05, **kwargs) -> None:
+
+        '''
+            Paramaters:
+                * learning_rate (float) : Weight of each new frame within the background model.
+        '''
+
+        super().__init__(**kwargs)
+
+        # Speed the background adapts to scene changes.
+        self.learning_rate = learning_rate
+
+        # Floating point background model.
+        self.background = None
+
+
+    def foreground_mask(self, frame : np.ndarray, binarisation_threshold : int) -> np.ndarray | None:
+
+        # Seed the background model from the first frame.
+        if self.background is None or self.background.shape != frame.shape:
+            self.background = frame.astype(np.float32)
+            return None
+
+        # Difference against the current background before folding the frame into it.
+        frame_difference = cv2.absdiff(frame, cv2.convertScaleAbs(self.background))
+        cv2.accumulateWeighted(frame, self.background, self.learning_rate)
+
+        # Apply a binary threshold to fetch regions with significant change within the frame.
+        _, frame_thresholded = cv2.threshold(frame_difference, binarisation_threshold, 255, cv2.THRESH_BINARY)
+
+        return frame_thresholded
+
+
+    def reset(self) -> None:
+        self.background = None
+
+
+class MOG2Detector(MotionDetector):
+
+    '''
+        Gaussian mixture background subtractor (cv2.createBackgroundSubtractorMOG2). Most robust to lighting flicker and
+            repetitive motion such as foliage, and the most expensive of the engines.
+    '''
+
+    name = 'mog2'
+
+    def __init__(self, history : int = 300, var_threshold : float = 16, **kwargs) -> None:
+
+        '''
+            Paramaters:
+                * history (int) : Number of frames the background model is built from.
+                * var_threshold (float) : Squared Mahalanobis distance for a pixel to be classed as foreground.
+        '''
+
+        super().__init__(**kwargs)
+
+        self.history = history
+        self.var_threshold = var_threshold
+        self.frame_shape = None
+        self.subtractor = None
+
+
+    def foreground_mask(self, frame : np.ndarray, binarisation_threshold : int) -> np.ndarray | None:
+
+        # (Re)build the model for the first frame or after a change in resolution.
+        if self.subtractor is None or self.frame_shape != frame.shape:
+            self.subtractor = cv2.createBackgroundSubtractorMOG2(history=self.history, varThreshold=self.var_threshold, detectShadows=False)
+            self.frame_shape = frame.shape
+
+        return self.subtractor.apply(frame)
+
+
+    def reset(self) -> None:
+        self.subtractor = None
+
+
+# Engines selectable through motion_detection.engine in the settings file.
+MOTION_DETECTORS : dict[str, type[MotionDetector]] = {
+    FrameDifferenceDetector.name : FrameDifferenceDetector,
+    RunningAverageDetector.name : RunningAverageDetector,
+    MOG2Detector.name : MOG2Detector
+}
+
+
+def create_motion_detector(engine : str, **kwargs) -> MotionDetector:
+
+    '''
+        Instantiate a motion detection engine by name, falling back to frame differencing for unknown names.
+
+        Paramaters:
+            * engine (str) : Engine name, one of MOTION_DETECTORS.
+            * kwargs : Engine specific keyword arguments.
+    '''
+
+    if engine not in MOTION_DETECTORS:
+        print(f'Unknown motion detection engine {engine}, defaulting to {FrameDifferenceDetector.name}.')
+        engine = FrameDifferenceDetector.name
+
+    return MOTION_DETECTORS[engine](**kwargs)
+
+
+class RegionOfInterestMask(object):
+
+    '''
+        Compiles the user defined regions of interest into a tight bounding crop and a uint8 mask at analysis resolution.
+            Motion analysis then only runs within the crop and anything outside the regions is masked out before contours
+            are extracted. Compilation happens once per change in regions or resolution rather than every frame.
+
+        Regions are lists of [x, y] points, two points describe a rectangles opposite corners whilst three or more describe a
+            polygon. Coordinates between 0 and 1 are treated as fractions of the frame, anything larger as capture pixels.
+    '''
+
+    def __init__(self, regions : list | None = None) -> None:
+
+        '''
+            Initialise the region of interest mask.
+
+            Paramaters:
+                * regions (list | None) : Regions of interest from motion_detection.regions_of_interest.
+        '''
+
+        # Regions as configured by the user.
+        self.regions : list = []
+
+        # Key the compiled crop and mask were built for, (frame size, analysis scale).
+        self.compiled_key = None
+
+        # Crop bounding every region as (x1, y1, x2, y2) in capture pixels, None when no regions are set.
+        self.crop : tuple[int, int, int, int] | None = None
+
+        # Mask covering the crop at analysis resolution, None when no regions are set.
+        self.mask : np.ndarray | None = None
+
+        self.set_regions(regions or [])
+
+
+    def set_regions(self, regions : list) -> None:
+
+        ''' Replace the configured regions, invalidating the compiled crop and mask should they have changed. '''
+
+        regions = [region for region in regions if isinstance(region, (list, tuple)) and len(region) >= 2]
+
+        if regions != self.regions:
+            self.regions = regions
+            self.compiled_key = None
+
+
+    def region_points(self, region : list, frame_width : int, frame_height : int) -> np.ndarray:
+
+        ''' Convert a region into an array of capture pixel coordinates, expanding rectangles into their four corners. '''
+
+        points = np.asarray(region, dtype=np.float64).reshape(-1, 2)
+
+        # Fractional coordinates are scaled up to the capture resolution.
+        if points.max() <= 1:
+            points = points * (frame_width, frame_height)
+
+        # Expand a rectangles opposite corners into a polygon.
+        if len(points) == 2:
+            (x1, y1), (x2, y2) = points.min(axis=0), points.max(axis=0)
+            points = np.array([[x1, y1], [x2, y1], [x2, y2], [x1, y2]])
+
+        return np.clip(points, 0, (frame_width, frame_height))
+
+
+    def compile(self, frame_width : int, frame_height : int, scale_x : float, scale_y : float) -> None:
+
+        '''
+            Build the crop and mask for the given capture resolution and analysis scale, reusing the previous compilation
+                where nothing has changed.
+
+            Paramaters:
+                * frame_width (int) : Capture width.
+                * frame_height (int) : Capture height.
+                * scale_x (float) : Ratio between capture and analysis width.
+                * scale_y (float) : Ratio between capture and analysis height.
+        '''
+
+        key = (frame_width, frame_height, round(scale_x, 6), round(scale_y, 6))
+
+        if key == self.compiled_key:
+            return
+
+        self.compiled_key = key
+        self.crop, self.mask = None, None
+
+        if not self.regions:
+            return
+
+        polygons = [self.region_points(region, frame_width, frame_height) for region in self.regions]
+
+        # Tight crop bounding every region.
+        all_points = np.vstack(polygons)
+        x1, y1 = np.floor(all_points.min(axis=0)).astype(int)
+        x2, y2 = np.ceil(all_points.max(axis=0)).astype(int)
+
+        if x2 - x1 < 2 or y2 - y1 < 2:
+            print('Regions of interest do not cover any of the frame, analysing the full frame instead.')
+            return
+
+        self.crop = (int(x1), int(y1), int(x2), int(y2))
+
+        # Rasterise the regions at the analysis resolution of the crop.
+        analysis_width, analysis_height = max(1, round((x2 - x1) / scale_x)), max(1, round((y2 - y1) / scale_y))
+        self.mask = np.zeros((analysis_height, analysis_width), dtype=np.uint8)
+
+        for polygon in polygons:
+            analysis_polygon = np.round((polygon - (x1, y1)) / (scale_x, scale_y)).astype(np.int32)
+            cv2.fillPoly(self.mask, [analysis_polygon], 255)
 
 
 class ObjectDetection(object):
@@ -16,8 +355,91 @@ class ObjectDetection(object):
         On top of this, helper functions pertaining to the handling of detections can also be found within this module. 
     '''
 
-    def __init__(self):
-        pass
+    def __init__(self, analysis_scale : float | list[int] = 0.25, engine : str = FrameDifferenceDetector.name, regions_of_interest : list | None = None, sensitivity : int = 50):
+
+        '''
+            Initialise the object detection utilities.
+
+            Paramaters:
+                * analysis_scale (float | list[int]) : Scale the motion pipeline runs at, either a fraction of the capture resolution
+                    such as 0.25 or an explicit [width, height] such as [320, 180].
+                * engine (str) : Name of the motion detection engine, one of MOTION_DETECTORS.
+                * regions_of_interest (list | None) : Regions motion analysis is restricted to, the whole frame when empty.
+                * sensitivity (int) : motion_detection.sensitivity between 1 and 100, higher values register fainter change.
+        '''
+
+        # Pixel intensity difference required to register as change, derived from the sensitivity.
+        self.binarisation_threshold : int = 25
+        self.set_sensitivity(sensitivity)
+
+        # Compiled crop and mask restricting analysis to the regions of interest.
+        self.regions_of_interest = RegionOfInterestMask(regions_of_interest)
+
+        # Capture pixel offset of the analysed crop within the frame.
+        self.crop_origin : tuple[int, int] = (0, 0)
+
+        # Stateful engine producing foreground masks from preprocessed frames.
+        self.motion_detector = create_motion_detector(engine)
+
+        # Scale frames are downsampled to before motion analysis.
+        self.analysis_scale = analysis_scale
+
+        # Ratio between the capture and analysis resolutions along each axis, updated as frames are processed.
+        self.scale_x : float = 1.0
+        self.scale_y : float = 1.0
+
+        # Capture resolution of the most recently processed frame, used to clamp mapped bounding boxes.
+        self.frame_size : tuple[int, int] = (0, 0)
+
+
+    def calculate_analysis_size(self, frame_width : int, frame_height : int) -> tuple[int, int]:
+
+        '''
+            Resolve the configured analysis scale into the (width, height) frames are downsampled to.
+
+            Paramaters:
+                * frame_width (int) : Capture width.
+                * frame_height (int) : Capture height.
+
+            Returns:
+                * (tuple[int, int]) : Analysis resolution, never larger than the capture resolution.
+        '''
+
+        # Explicit resolution, e.g. [320, 180].
+        if isinstance(self.analysis_scale, (list, tuple)) and len(self.analysis_scale) == 2:
+            width, height = int(self.analysis_scale[0]), int(self.analysis_scale[1])
+
+        else:
+            # Fractional scale, e.g. 0.25, falling back to full resolution for invalid values.
+            try:
+                scale = float(self.analysis_scale)
+            except (TypeError, ValueError):
+                scale = 1.0
+
+            scale = scale if 0 < scale <= 1 else 1.0
+            width, height = round(frame_width * scale), round(frame_height * scale)
+
+        return max(1, min(width, frame_width)), max(1, min(height, frame_height))
+
+
+    def set_sensitivity(self, sensitivity : int) -> None:
+
+        '''
+            Derive the binarisation threshold from the user facing sensitivity, inversely proportional so the default
+                sensitivity of 50 keeps the original threshold of 25.
+        '''
+
+        sensitivity = min(max(int(sensitivity), 1), 100)
+
+        self.binarisation_threshold = min(max(round(1250 / sensitivity), 1), 255)
+
+
+    def set_motion_engine(self, engine : str) -> None:
+
+        ''' Swap the motion detection engine, the new engine starts from a fresh background model. '''
+
+        if engine != self.motion_detector.name:
+            self.motion_detector = create_motion_detector(engine)
 
 
     def annotate_bbox_corners(
@@ -63,7 +485,7 @@ class ObjectDetection(object):
         min_thickness, max_thickness = 1, 5
 
         # Fetch detection bounding box values, typecast to full integer values. 
-        x1, y1, x2, y2, ID, threat_level = detection.get('x1'), detection.get('y1'), detection.get('x2'), detection.get('x2'), str(detection.get('ID')), str(detection.get('threat_level'))
+        x1, y1, x2, y2, ID, threat_level = detection.get('x1'), detection.get('y1'), detection.get('x2'), detection.get('y2'), str(detection.get('ID')), str(detection.get('threat_level'))
         
         # Calculate detection dimensions.
         detection_width = x2 - x1
@@ -161,39 +583,97 @@ class ObjectDetection(object):
 
     def process_frame(self, frame : np.ndarray) -> np.ndarray:
 
-        ''' preprocess frame before it is analysed further. '''
+        ''' preprocess frame before it is analysed further, cropping it to the regions of interest and downsampling it to the analysis resolution. '''
+
+        frame_height, frame_width = frame.shape[:2]
+        analysis_width, analysis_height = self.calculate_analysis_size(frame_width, frame_height)
+
+        # Record the mapping between analysis and capture coordinates.
+        self.frame_size = (frame_width, frame_height)
+        self.scale_x, self.scale_y = frame_width / analysis_width, frame_height / analysis_height
+
+        # Compile the regions of interest for this resolution, a no-op unless regions or resolution have changed.
+        self.regions_of_interest.compile(frame_width, frame_height, self.scale_x, self.scale_y)
+
+        # Restrict analysis to the crop bounding the regions of interest, slicing is a view so costs nothing.
+        if self.regions_of_interest.crop is not None:
+            x1, y1, x2, y2 = self.regions_of_interest.crop
+            frame = frame[y1:y2, x1:x2]
+            self.crop_origin = (x1, y1)
+
+            # Match the compiled masks dimensions exactly.
+            analysis_height, analysis_width = self.regions_of_interest.mask.shape
+        else:
+            self.crop_origin = (0, 0)
+
+        # Downsample first so every following operation runs on a fraction of the pixels.
+        if (analysis_width, analysis_height) != (frame.shape[1], frame.shape[0]):
+            frame = cv2.resize(frame, (analysis_width, analysis_height), interpolation=cv2.INTER_AREA)
 
         # Convert the frame to greyscale to reduce colours channels, in turn reducing processing.
         frame_greyscale = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
 
+        # Scale the 21x21 full resolution blur kernel alongside the frame, kernel sizes must remain odd.
+        kernel_size = max(3, int(round(21 / max(self.scale_x, self.scale_y))) | 1)
+
         # Apply gaussian filter to reduce noise in an attempt to mitigate false positives. 
-        return cv2.GaussianBlur(frame_greyscale, (21, 21), 0)
+        return cv2.GaussianBlur(frame_greyscale, (kernel_size, kernel_size), 0)
+
+
+    def set_regions_of_interest(self, regions : list) -> None:
 
+        ''' Update the regions of interest, recompiled on the next processed frame if they have changed. '''
 
-    def detect_motion(self, prev_frame : np.ndarray, curr_frame : np.ndarray, binarisation_threshold : int = 25, min_contour_area : int = 500) -> tuple[np.ndarray, list[np.ndarray]]:
+        self.regions_of_interest.set_regions(regions)
+
+
+    def detect_motion(self, curr_frame : np.ndarray, binarisation_threshold : int | None = None, min_contour_area : int = 500) -> tuple[np.ndarray | None, list[dict]]:
+
+        '''
+            Detect motion in frame utilising the configured motion detection engine. The frame is expected to have been
+                preprocessed by process_frame, the returned bounding boxes are mapped back to capture resolution coordinates.
 
-        ''' Detect motion in frame utilising traditional computer vision techniques. '''
+            Paramaters:
+                * curr_frame (np.ndarray) : Preprocessed current frame, prior frames are tracked by the engine itself.
+                * binarisation_threshold (int | None) : Pixel intensity difference required to register as change, derived
+                    from the configured sensitivity when None.
+                * min_contour_area (int) : Minimum contour area in capture resolution pixels to count as motion.
+        '''
 
         bboxes = []
 
-        # Check frames passed are not None Type. Raise exception if they are. 
-        if curr_frame is None or prev_frame is None:
-            return ValueError('Provided frames were returned as None!')
+        if binarisation_threshold is None:
+            binarisation_threshold = self.binarisation_threshold
 
-        # Compute absolute difference between current and previous frames. 
-        frame_difference = cv2.absdiff(prev_frame, curr_frame)
+        # Check frame passed is not None Type.
+        if curr_frame is None:
+            raise ValueError('Provided frame was returned as None!')
 
-        # Apply a binary threshold to fetch regions with significant change within the frame.
-        _, frame_thresholded = cv2.threshold(frame_difference, binarisation_threshold, 255, cv2.THRESH_BINARY)
+        # Fetch regions with significant change from the engine, nothing to report whilst it gathers history.
+        frame_thresholded = self.motion_detector.apply(curr_frame, binarisation_threshold)
 
-        # Dilate on the thresholded frame to fill in the gaps and solidify contour areas.
-        frame_dilation = cv2.dilate(frame_thresholded, None, iterations=3)
+        if frame_thresholded is None:
+            return None, bboxes
 
-        # Fetch regions in the frame where motion has been detected. 
-        contours, _ = cv2.findContours(frame_dilation.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        # Discard change outside the regions of interest before it can seed any contours.
+        if self.regions_of_interest.mask is not None and self.regions_of_interest.mask.shape == frame_thresholded.shape:
+            frame_thresholded = cv2.bitwise_and(frame_thresholded, self.regions_of_interest.mask)
+
+        # Dilate on the thresholded frame to fill in the gaps and solidify contour areas, fewer passes are needed at lower resolutions.
+        dilation_iterations = max(1, int(round(3 / max(self.scale_x, self.scale_y) ** 0.5)))
+        frame_dilation = cv2.dilate(frame_thresholded, None, iterations=dilation_iterations)
+
+        # Fetch regions in the frame where motion has been detected, findContours no longer modifies its input.
+        contours, _ = cv2.findContours(frame_dilation, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+        # Scale the capture resolution area threshold down to the analysis resolution.
+        analysis_min_area = min_contour_area / (self.scale_x * self.scale_y)
 
         # Store list of detected motion areas.
-        filtered_contours = [contour for contour in contours if cv2.contourArea(contour) > min_contour_area]
+        filtered_contours = [contour for contour in contours if cv2.contourArea(contour) > analysis_min_area]
+
+        frame_width, frame_height = self.frame_size
+        origin_x, origin_y = self.crop_origin
 
         # Iterate over the filtrated detections.
         for contour in filtered_contours:
@@ -201,8 +681,13 @@ class ObjectDetection(object):
             # Use opencv to draw a bounding box around the detected contour, unpack its values. 
             x1, y1, w, h = cv2.boundingRect(contour)
 
-            # Append these values to a dictionary for each detection. Convert to x1, y1, x2, y2 format.
-            detection = {'x1' : int(x1), 'y1' : int(y1), 'x2' : int(x1 + w), 'y2' : int(y1 + h)}
+            # Map back to capture resolution coordinates offset by the crop, clamped to the frame. Convert to x1, y1, x2, y2 format.
+            detection = {
+                'x1' : origin_x + int(x1 * self.scale_x),
+                'y1' : origin_y + int(y1 * self.scale_y),
+                'x2' : min(origin_x + int(round((x1 + w) * self.scale_x)), frame_width),
+                'y2' : min(origin_y + int(round((y1 + h) * self.scale_y)), frame_height)
+            }
 
             # Add to bboxes list.
             bboxes.append(detection)
@@ -227,157 +712,6 @@ class ObjectDetection(object):
         return annotated_frame
 
     
-    def send_email_alert(self, media, max_retries : int = 3, secs_delay : int = 10) -> None:
-
-        ''' 
-            Uses envinronment variables to send an email from a given gmail account to the users recipient address with an alert
-                encapsulating data about the detection and the media where it has been captured.
-
-            Paramaters:
-                * media (np.ndarray | mp4 video) : Parsed media wether it is a single frame acting as a still image 
-                    or a processed mp4 video of the event. 
-                * max_retries (int) : Number of tries before operation is terminated. 
-                * secs_delay (int) : Number of seconds until an attempt to resend the email if unsuccessful is made. 
-
-            Returns:
-                * None : Returns early if operation successful. 
-        '''
-
-        # Fetch environment variables.
-        app_email = os.getenv('APP_EMAIL')
-        app_password = os.getenv('APP_PASSWORD')
-        target_email = os.getenv('TARGET_EMAIL')
-
-        # If not all environment variables are present, raise this issue with user. 
-        if not all([app_email, app_email, target_email]):
-            raise ValueError('Missing essential email configurations from environment variables file.')
-
-        # Make an attempt until max retries threshold met.
-        for attempt in range(max_retries + 1):
-
-            try:
-                
-                # Create a yagmail SMTP client.
-                yag_client = yagmail.SMTP(app_email, app_password)
-
-                # Email subject. 
-                subject = f'Security Alert: Threat detected'
-
-                # Email contents.
-                contents = f'Your Raspberry Pi has detected a threat at {time.strftime("%Y-%m-%d %H:%M:%S")}'
-
-                # Email object.
-                yag_client.send(
-                    to=target_email,
-                    subject=subject, 
-                    contents=contents,
-                    attachments=media
-                )
-
-                # Return early if successful.
-                return
-
-            except (yagmail.YagConnectionClosed, yagmail.YagAddressError):
-                
-                # If max tries met, raise error with user.
-                if attempt == max_retries:
-                    raise RuntimeError(f'Failed to send email alert after {max_retries} attempts.')
-                
-                # Delay next attempt.
-                time.sleep(secs_delay)
-
-
-    def capture_video(
-            pre_buffer : list,
-            post_buffer : list,
-            directory : str,
-            frame_rate : int,
-            frame_width : int,
-            frame_height : int,
-            captured_at : str,
-            codec : str = 'mp4v'
-        ) -> bool:
-
-        '''
-            Combines both pre and post detection buffers if content type set to video captures. That way, the combined frames can form 
-                a full list of frames which can then be processed and written out into an mp4 video for the users convenience.
-
-            Paramaters:
-                * pre_buffer (deque) : Deck limited to specified length, always capturing set amount of frames for when an
-                    event will eventually occur, storing the events leading to it. 
-                * post_buffer (list) : Initialised and parsed once event has taken place, later to be appended to the pre_buffer, 
-                    forming a whole video.
-                * directory (str) : Directory where video clip will be stored. 
-                * frame_rate (int) : Frame rate parsed from the capture object. 
-                * frame_width (int) : Frame width parsed from the capture object. 
-                * frame_height (int) : Frame height parsed from the capture object. 
-                * captured_at (str) : Time event was captured at.
-                * codec (str) : Chosen video format type. 
-
-            Returns:
-                * (bool) : Boolean to confirm status of the operation and its success status.
-        '''
-
-        # Create directory if it does not exist. 
-        if not os.path.exists(directory):
-            os.makedirs(directory)
-
-        # Join the desired directory and the filename to save capture.
-        filename = os.path.join(directory, f'{captured_at}')
-
-        # Ensure both buffers are appropriately type casted as lists. 
-        frames = list(pre_buffer) + list(post_buffer)
-
-        # Initialise fourcc object with the desired codec setting.
-        fourcc = cv2.VideoWriter_fourcc(*codec)
-
-        # Ouput object where frames will be written to. 
-        output = cv2.VideoWriter(filename, fourcc, frame_rate, (frame_width, frame_height))
-
-        try:
-            
-            # Iterate over each frame in frames list representing video.
-            for frame in frames:
-
-                # If frame is valid.
-                if frame is not None:
-                    # Write that to output.
-                    output.write(frame)
-            
-            # Return true when operation completed successfully. 
-            return True
-
-        except Exception as e:
-            print(f'Error : Failed to write frames to video!\n{e}')
-            return False
-        finally:
-            # Always cleanup resources. 
-            output.release()
-            print(f'Clip captured and saved to {directory}')
-
-
-    def capture_still(self, frame : np.ndarray, directory : str, formatted_date : str) -> None:
-
-        '''
-            Save captured frames to the devices local storage. Simultaneouly checking for resource exhaustion, removing oldest files that exceed the set limit. 
-
-            :param: frame - Desired frame to be saved, capturing perpetrators.
-            :param: directory - Specified directory where the captured frame can be written to.
-            :param: formatted_date - Format of the date to be appended to the filename.
-            :return: N/A
-        '''
-
-        # Create directory if it does not exist. 
-        if not os.path.exists(directory):
-            os.makedirs(directory)
-
-        # Join the desired directory and the filename to save capture.
-        filename = os.path.join(directory, f'{formatted_date}.jpg')
-
-        # Write capture to directory with native filename.
-        cv2.imwrite(f'{os.path.join(directory, filename)}.jpg', frame)
-        
-
     def trigger_capture(self, last_captured : float, delay : float, max_threat : int, detections : list[dict]) -> bool:
 
         '''
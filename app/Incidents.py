@@ -0,0 +1,362 @@
+import threading
+import json
+import time
+import os
+from .Alerts import AlertDispatcher
+
+
+class Incident(object):
+
+    '''
+        A single incident, the tracks and captures grouped under one alert.
+    '''
+
+    __slots__ = ('ID', 'track_IDs', 'first_seen', 'last_seen', 'max_threat', 'captures', 'alerted')
+
+    def __init__(self, ID : int, first_seen : float) -> None:
+
+        self.ID = ID
+        self.track_IDs : set[int] = set()
+        self.first_seen = first_seen
+        self.last_seen = first_seen
+        self.max_threat : int = 0
+        self.captures : list[str] = []
+        self.alerted : bool = False
+
+
+    def summary(self) -> dict:
+
+        ''' Plain dictionary summary of the incident, e.g. for storage. '''
+
+        return {
+            'ID' : self.ID,
+            'track_IDs' : sorted(self.track_IDs),
+            'first_seen' : self.first_seen,
+            'last_seen' : self.last_seen,
+            'max_threat' : self.max_threat,
+            'captures' : list(self.captures)
+        }
+
+
+    def __repr__(self) -> str:
+        return f'Incident(ID={self.ID}, track_IDs={sorted(self.track_IDs)}, max_threat={self.max_threat}, captures={len(self.captures)})'
+
+
+class IncidentAggregator(object):
+
+    '''
+        Groups threat observations into incidents by track ID and time window, so a prolonged event produces a single
+            incident, and a single alert, rather than a capture and alert every frequency window. Incidents close once
+            nothing has been observed for the incident gap, their summaries are then stored and optionally batched into a
+            periodic digest.
+    '''
+
+    def __init__(self, alert_dispatcher : AlertDispatcher, store_path : str, incident_gap : float = 60, digest_interval : float = 0, threat_step : int = 5) -> None:
+
+        '''
+            Initialise the incident aggregator.
+
+            Paramaters:
+                * alert_dispatcher (AlertDispatcher) : Dispatcher the incident alerts and digests are sent through.
+                * store_path (str) : JSON lines file closed incident summaries are appended to.
+                * incident_gap (float) : Seconds without observations before an incident is closed.
+                * digest_interval (float) : Seconds between digests of closed incidents, 0 to disable digests.
+                * threat_step (int) : Width of the first threat band, typically the maximum threat level. Track threat levels
+                    rise by one on every frame past the escalation time, so an incident only escalates on reaching the next
+                    band and each band is twice as wide as the last.
+        '''
+
+        self.alert_dispatcher = alert_dispatcher
+        self.store_path = store_path
+        self.incident_gap = incident_gap
+        self.digest_interval = digest_interval
+        self.threat_step = max(int(threat_step), 1)
+
+        # Incidents still receiving observations, keyed by ID.
+        self.open_incidents : dict[int, Incident] = {}
+
+        # Closed incidents awaiting the next digest.
+        self.undigested : list[dict] = []
+        self.last_digest : float = time.time()
+
+        # Guards the incidents, updated from the stream loop, the capture writer and the housekeeping thread.
+        self.condition = threading.Condition()
+
+        self.running = False
+        self.worker = None
+
+
+    def configure(self, incident_gap : float | None = None, digest_interval : float | None = None, threat_step : int | None = None) -> None:
+
+        ''' Apply a new incident gap, digest interval or threat band width. '''
+
+        with self.condition:
+
+            if incident_gap is not None:
+                self.incident_gap = incident_gap
+
+            if digest_interval is not None:
+                self.digest_interval = digest_interval
+
+            if threat_step is not None:
+                self.threat_step = max(int(threat_step), 1)
+
+            self.condition.notify()
+
+
+    def start(self) -> None:
+
+        ''' Start the housekeeping thread if it is not already running. '''
+
+        if self.worker is not None and self.worker.is_alive():
+            return
+
+        self.running = True
+        self.worker = threading.Thread(target=self.housekeeping, name='incident-aggregator', daemon=True)
+        self.worker.start()
+
+
+    def stop(self, timeout : float = 5.0) -> None:
+
+        ''' Stop the housekeeping thread, closing and storing every open incident. '''
+
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+
+        if self.worker is not None:
+            self.worker.join(timeout=timeout)
+            self.worker = None
+
+        self.close_incidents(force=True)
+
+
+    def observe(self, threats : list, observed_at : float | None = None) -> tuple[Incident | None, str | None]:
+
+        '''
+            Fold tracked threats into the incident they belong to. Only updates memory, cheap enough for the stream loop.
+
+            Paramaters:
+                * threats (list) : Tracks considered threats, e.g. TrackRecords above the maximum threat level.
+                * observed_at (float | None) : Wall clock time of the observation, defaults to now.
+
+            Returns:
+                * (tuple[Incident | None, str | None]) : The incident alongside whether it is 'new', 'escalated' (new tracks
+                    joined or its peak threat reached the next threat band) or 'ongoing'. (None, None) when there are no threats.
+        '''
+
+        if not threats:
+            return None, None
+
+        observed_at = observed_at or time.time()
+        track_IDs = {int(threat.get('ID')) for threat in threats}
+        threat_level = max(int(threat.get('threat_level', 0)) for threat in threats)
+
+        with self.condition:
+
+            incident = self.find_incident(track_IDs, observed_at)
+
+            if incident is None:
+                incident = Incident(int(observed_at * 1000), observed_at)
+                self.open_incidents[incident.ID] = incident
+                decision = 'new'
+
+            elif not track_IDs <= incident.track_IDs or self.threat_band(threat_level) > self.threat_band(incident.max_threat):
+                decision = 'escalated'
+
+            else:
+                decision = 'ongoing'
+
+            incident.track_IDs |= track_IDs
+            incident.last_seen = max(incident.last_seen, observed_at)
+            incident.max_threat = max(incident.max_threat, threat_level)
+
+        self.start()
+
+        return incident, decision
+
+
+    def threat_band(self, threat_level : int) -> int:
+
+        ''' Band a threat level falls within, bands start at 1, 2, 4, 8... times the threat step. '''
+
+        return (max(int(threat_level), 0) // self.threat_step).bit_length()
+
+
+    def find_incident(self, track_IDs : set[int], observed_at : float) -> Incident | None:
+
+        ''' Open incident sharing a track, otherwise the latest seen within the incident gap. '''
+
+        for incident in self.open_incidents.values():
+            if incident.track_IDs & track_IDs:
+                return incident
+
+        recent = [incident for incident in self.open_incidents.values() if observed_at - incident.last_seen <= self.incident_gap]
+
+        return max(recent, key=lambda incident : incident.last_seen, default=None)
+
+
+    def add_capture(self, incident_ID : int | None, path : str, metadata : dict | None = None, alert : bool = True) -> None:
+
+        '''
+            Record a capture written for an incident, alerting with it attached should the incident not have alerted yet.
+
+            Paramaters:
+                * incident_ID (int | None) : Incident the capture was taken for.
+                * path (str) : Path of the written capture.
+                * metadata (dict | None) : Event metadata handed to the alert.
+                * alert (bool) : Whether alerts are enabled.
+        '''
+
+        with self.condition:
+
+            incident = self.open_incidents.get(incident_ID)
+
+            # Incident already closed (or unknown), alert for the capture on its own.
+            if incident is None:
+                should_alert = alert
+
+            else:
+                incident.captures.append(path)
+                should_alert = alert and not incident.alerted
+
+        if should_alert:
+            self.dispatch(incident, attachments=[path], metadata=metadata)
+
+
+    def alert(self, incident : Incident, contents : str | None = None) -> None:
+
+        ''' Alert for an incident without a capture, e.g. whilst recording continuously, once per incident. '''
+
+        with self.condition:
+
+            if incident.alerted:
+                return
+
+        self.dispatch(incident, contents=contents)
+
+
+    def dispatch(self, incident : Incident | None, **alert) -> bool:
+
+        '''
+            Queue an alert for an incident, only marking the incident alerted once the dispatcher has accepted it. An alert
+                suppressed by the dispatchers rate limit leaves the incident to alert again with its next capture (or
+                escalation) rather than never alerting at all.
+
+            Returns:
+                * (bool) : Whether the alert was queued.
+        '''
+
+        queued = self.alert_dispatcher.send_alert(**alert) is not None
+
+        if not queued:
+            print(f'Alert for incident {incident.ID if incident is not None else "(closed)"} suppressed by the alert frequency, retrying on its next capture.')
+
+        elif incident is not None:
+            with self.condition:
+                incident.alerted = True
+
+        return queued
+
+
+    def housekeeping(self) -> None:
+
+        ''' Housekeeping loop, closes stale incidents and sends digests as they fall due. '''
+
+        while True:
+
+            with self.condition:
+
+                if not self.running:
+                    break
+
+                self.condition.wait(timeout=max(min(self.incident_gap, self.digest_interval or self.incident_gap) / 2, 1.0))
+
+            self.close_incidents()
+
+            if self.digest_interval and time.time() - self.last_digest >= self.digest_interval:
+                self.send_digest()
+
+
+    def close_incidents(self, force : bool = False) -> list[dict]:
+
+        ''' Close incidents without observations for the incident gap (or all of them), storing their summaries. '''
+
+        now = time.time()
+
+        with self.condition:
+
+            closed = [
+                incident for incident in self.open_incidents.values()
+                if force or now - incident.last_seen > self.incident_gap
+            ]
+
+            for incident in closed:
+                del self.open_incidents[incident.ID]
+
+            summaries = [incident.summary() for incident in closed]
+
+            if self.digest_interval:
+                self.undigested.extend(summaries)
+
+        if summaries:
+            self.store(summaries)
+
+        return summaries
+
+
+    def store(self, summaries : list[dict]) -> None:
+
+        ''' Append incident summaries to the store. '''
+
+        directory = os.path.dirname(self.store_path)
+
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+
+        try:
+            with open(self.store_path, 'a') as store_file:
+                for summary in summaries:
+                    store_file.write(json.dumps(summary) + '\n')
+
+        except IOError as e:
+            print(f'Failed to store incident summaries!\n{e}')
+
+
+    def send_digest(self) -> None:
+
+        ''' Send a single alert summarising every incident closed since the last digest. '''
+
+        with self.condition:
+            summaries, self.undigested = self.undigested, []
+            self.last_digest = time.time()
+
+        if not summaries:
+            return
+
+        lines = [
+            f'{time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(summary["first_seen"]))} to '
+            f'{time.strftime("%H:%M:%S", time.localtime(summary["last_seen"]))} : '
+            f'{len(summary["track_IDs"])} track(s), peak threat {summary["max_threat"]}, {len(summary["captures"])} capture(s)'
+            for summary in summaries
+        ]
+
+        # Digests are explicitly requested summaries, they bypass the per alert rate limit.
+        self.alert_dispatcher.send_alert(
+            subject=f'Security Digest: {len(summaries)} incident(s)',
+            contents='Incidents detected since the last digest:\n\n' + '\n'.join(lines),
+            force=True
+        )
+
+
+    def recent_incidents(self, limit : int = 50) -> list[dict]:
+
+        ''' Most recently stored incident summaries, newest first. '''
+
+        if not os.path.exists(self.store_path):
+            return []
+
+        with open(self.store_path, 'r') as store_file:
+            lines = store_file.readlines()[-limit:]
+
+        return [json.loads(line) for line in reversed(lines) if line.strip()]
@@ -1,112 +1,678 @@
+from collections import deque, OrderedDict
+import threading
+import hashlib
+import shutil
+import time
 import os
+import numpy as np
+import cv2
+from .CaptureIndex import CaptureIndex
 
-class DeviceManagement(object):
+class RetentionManager(object):
 
     '''
-        FileHandling class to seperate multiple functions concerned with managing the captures kept within the devices local storage, bunlding them together in one location.
+        Background retention of stored captures against a byte budget and a free space floor, rather than a file count which
+            means little when clips are orders of magnitude larger than stills. Candidates come from the capture index, so no
+            directory scans are needed, and are deleted a small batch at a time on the managers own thread, never on the
+            capture path.
+
+        Policies are applied in order until enough space has been reclaimed:
+            * thin_old_stills - Stills older than the thinning age are thinned to one per incident (or per hour).
+            * oldest_first - Oldest captures first, sparing high threat captures whilst keep_high_threat is set.
+        Should the free space floor still be breached, high threat captures are removed oldest first as a last resort.
     '''
 
-    def __init__(self) -> None:
-        
-        # Initialise list that will store the images metadata.
-        self.stored_images : list = []
+    POLICIES = ('thin_old_stills', 'oldest_first')
+
+    def __init__(
+            self,
+            capture_index : CaptureIndex,
+            directory : str,
+            byte_budget : int,
+            minimum_free_bytes : int,
+            policies : tuple = POLICIES,
+            keep_high_threat : bool = True,
+            protected_threat : int = 5,
+            thin_after : float = 7 * 24 * 60 * 60,
+            interval : float = 60,
+            batch_size : int = 25,
+            thumbnail_cache : 'ThumbnailCache | None' = None
+        ) -> None:
+
+        '''
+            :param: capture_index - Index the captures and their sizes are read from.
+            :param: directory - Directory the captures are stored within, used to measure free space.
+            :param: byte_budget - Maximum number of bytes the captures may occupy.
+            :param: minimum_free_bytes - Free space always left on the storage device.
+            :param: policies - Policy names from POLICIES, applied in order.
+            :param: keep_high_threat - Spare captures at or above the protected threat level unless the floor is breached.
+            :param: protected_threat - Threat level from which captures are considered high threat.
+            :param: thin_after - Age in seconds after which stills are thinned.
+            :param: interval - Seconds between scheduled checks.
+            :param: batch_size - Captures deleted per batch, the manager yields between batches.
+            :param: thumbnail_cache - ThumbnailCache the gallery thumbnails of deleted captures are evicted from.
+        '''
+
+        unknown = [policy for policy in policies if policy not in self.POLICIES]
+
+        if unknown:
+            raise ValueError(f'Unknown retention policies {unknown}!')
+
+        self.capture_index = capture_index
+        self.directory = directory
+        self.byte_budget = int(byte_budget)
+        self.minimum_free_bytes = int(minimum_free_bytes)
+        self.policies = tuple(policies)
+        self.keep_high_threat = keep_high_threat
+        self.protected_threat = protected_threat
+        self.thin_after = thin_after
+        self.interval = interval
+        self.batch_size = max(int(batch_size), 1)
+        self.thumbnail_cache = thumbnail_cache
+
+        # Wakes the manager early, e.g. once a capture has been written.
+        self.condition = threading.Condition()
+        self.check_requested = False
+
+        self.running = False
+        self.worker = None
+
+        # Totals removed since start up.
+        self.files_removed : int = 0
+        self.bytes_removed : int = 0
+
+
+    def start(self) -> None:
+
+        ''' Start the retention thread if it is not already running. '''
+
+        if self.worker is not None and self.worker.is_alive():
+            return
+
+        self.running = True
+        self.worker = threading.Thread(target=self.run, name='retention-manager', daemon=True)
+        self.worker.start()
+
+
+    def stop(self, timeout : float = 5.0) -> None:
+
+        ''' Stop the retention thread. '''
+
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+
+        if self.worker is not None:
+            self.worker.join(timeout=timeout)
+            self.worker = None
+
+
+    def configure(
+            self,
+            byte_budget : int | None = None,
+            minimum_free_bytes : int | None = None,
+            keep_high_threat : bool | None = None,
+            protected_threat : int | None = None
+        ) -> None:
+
+        ''' Apply a new budget, free space floor or protection rules, checked against straight away. '''
+
+        with self.condition:
+
+            if byte_budget is not None:
+                self.byte_budget = int(byte_budget)
+
+            if minimum_free_bytes is not None:
+                self.minimum_free_bytes = int(minimum_free_bytes)
+
+            if keep_high_threat is not None:
+                self.keep_high_threat = keep_high_threat
+
+            if protected_threat is not None:
+                self.protected_threat = protected_threat
 
-        # Store value of the file order when displaying captures stored on screen.
-        self.file_order : bool = False
+            self.check_requested = True
+            self.condition.notify()
 
 
-    def sort_files(self, files : list[dict], reverse_order : bool = False) -> list[dict]:
+    def request_check(self) -> None:
+
+        ''' Ask for a check ahead of the next scheduled one. '''
+
+        with self.condition:
+            self.check_requested = True
+            self.condition.notify()
+
+
+    def run(self) -> None:
+
+        ''' Retention loop, checks storage on schedule or request until stopped. '''
+
+        while True:
+
+            with self.condition:
+
+                self.condition.wait_for(lambda: self.check_requested or not self.running, timeout=self.interval)
+
+                if not self.running:
+                    break
+
+                self.check_requested = False
+
+            try:
+                self.enforce()
+            except Exception as e:
+                print(f'An error has occured during retention: {e}')
+
+
+    def free_space_shortfall(self) -> int:
+
+        ''' Bytes required to restore the free space floor. '''
+
+        try:
+            return max(self.minimum_free_bytes - shutil.disk_usage(self.directory).free, 0)
+        except FileNotFoundError:
+            return 0
+
+
+    def bytes_needed(self) -> int:
+
+        ''' Bytes to be reclaimed to satisfy both the byte budget and the free space floor. '''
+
+        return max(self.capture_index.total_size() - self.byte_budget, self.free_space_shortfall(), 0)
+
+
+    def enforce(self) -> int:
 
         '''
-        Sort list containing captures from newest to oldest from the order parameterised, OS natively sorts in order due to filenames date+time structure,
-        meaning it is simple enough to reverse the list these entries are stored in. 
+            Reclaim space until the budget and floor are satisfied.
 
-        :param: files - list of files to be sorted. 
-        :param: reverse_order - Order required for files to be sorted into.
-        :return: sorted_list - Sorted list of images.
+            :return: freed - Bytes reclaimed.
         '''
 
-        # Copy list, do NOT modify directly.
-        sorted_list = files.copy()
-        
-        # If reverse order parameterised, reverse the list using .reverse() BIF.  
-        if reverse_order:
-            sorted_list.reverse()
-        else:
-            # Otherwise reutrn list in default order. 
-            sorted_list.sort(
-                key = lambda cap: cap['capture_date'] + cap['capture_time'],
-            )
+        needed = self.bytes_needed()
+        freed = 0
+
+        for policy in self.policies:
+
+            if freed >= needed:
+                return freed
+
+            freed += self.reclaim(getattr(self, policy)(), needed - freed)
+
+        # Last resort, the storage device must never fill up even if it costs high threat captures.
+        if self.keep_high_threat and self.free_space_shortfall() > 0:
+            freed += self.reclaim(self.oldest_first(spare_high_threat=False), self.free_space_shortfall())
+
+        return freed
 
-        # Return list of files in desired order. 
-        return sorted_list
-    
 
-    def access_stored_captures(self, directory: str) -> list[dict[str, str]]:
+    def reclaim(self, batches, target : int) -> int:
 
         '''
-        Access images stored locally on the device. By iterating over each file, it will accumulate the meta data associated
-        with each image, appending it to a dictionary, forming the metadata for an image which can be rendered into a html template,
-        sanitised which can provide useful output for the user. 
+            Delete captures from the given batches until the target number of bytes has been reclaimed.
 
-        :params: directory - Access the cameras capture directory attribute.
-        :return: stored_images - list consisting of dictionaries containing an images metadata for later access. 
-        (img = {'fullpath','filename','file_ext', 'capture_date'})
+            :param: batches - Iterable of capture batches produced by a policy.
+            :param: target - Bytes to reclaim.
+            :return: freed - Bytes reclaimed.
         '''
 
-        # Loop over all image files found within the captures directory. 
-        for file in os.listdir(directory):
+        freed = 0
 
-            # Check the file extensions match those desired.
-            if file.endswith(('.jpg', '.jpeg', '.png')):
+        for batch in batches:
 
-                # Append the filename to the captures directory path.
-                fullpath = os.path.join(directory, file)
-                # Get the standalone filename (date) and the file extention.
-                filename, file_ext = os.path.splitext(file)
-                # Access just the date.
-                capture_date = filename.split('_')[0]
-                # Access the time. 
-                capture_time = filename.split('_')[1]
+            for capture in batch:
 
-                # Append the images data to the images dictionary. 
-                self.stored_images.append({
-                    # Full filepath.
-                    'fullpath': fullpath,
-                    # Standalone filename.
-                    'filename': filename,
-                    # Files extension.
-                    'file_ext': file_ext,
-                    # Date it was captured.
-                    'capture_date': capture_date, 
-                    # Time the capture was taken.
-                    'capture_time' : capture_time,
-                })
+                if freed >= target:
+                    return freed
 
-        # Return dictionary containing meta data associated with images.
-        return self.stored_images
-    
+                freed += self.delete(capture)
 
-    def check_file_exhaustion(self, directory : str, file_limit : int) -> None:
+            # Yield between batches so deletions never monopolise the SD card.
+            time.sleep(0.01)
+
+        return freed
+
+
+    def thin_old_stills(self):
+
+        ''' Stills older than the thinning age beyond the first of each incident (or hour), in batches, oldest first. '''
+
+        cutoff, offset, kept = time.time() - self.thin_after, 0, set()
+
+        while True:
+
+            page = self.capture_index.query(limit=self.batch_size * 4, offset=offset, descending=False, kind='still', until=cutoff)
+
+            if not page:
+                return
+
+            batch = []
+
+            for capture in page:
+
+                # High threat stills are never thinned.
+                if self.keep_high_threat and capture['max_threat'] >= self.protected_threat:
+                    continue
+
+                group = capture['incident_ID'] if capture['incident_ID'] is not None else int(capture['captured_at'] // 3600)
+
+                if group in kept:
+                    batch.append(capture)
+                else:
+                    kept.add(group)
+
+            # Deleted captures leave the index, only advance past those kept.
+            offset += len(page) - len(batch)
+
+            yield batch
+
+
+    def oldest_first(self, spare_high_threat : bool | None = None):
+
+        ''' Captures oldest first in batches, sparing high threat captures where requested. '''
+
+        spare_high_threat = self.keep_high_threat if spare_high_threat is None else spare_high_threat
+
+        while True:
+
+            batch = self.capture_index.query(
+                limit=self.batch_size,
+                descending=False,
+                threat_below=self.protected_threat if spare_high_threat else None
+            )
+
+            if not batch:
+                return
+
+            yield batch
+
+
+    def delete(self, capture : dict) -> int:
 
         '''
-            Check stored files, remove oldest captures in order to mitigate resource exhaustion, can be set by user. 
+            Delete a capture along with its cached attachment variants and gallery thumbnails, dropping it from the index.
 
-            :param: directory - Specified directory where files are stored. 
-            :param: file_limit - Maximum number of files allowed within the devices local storage. 
-            :return: N/A.
+            :return: size - Bytes reclaimed.
         '''
 
+        path, size = capture['path'], 0
+
         try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+        # Alert attachment variants, cached beside the capture within its .attachments folder.
+        cache_directory = os.path.join(os.path.dirname(path), '.attachments')
+
+        if os.path.isdir(cache_directory):
+            with os.scandir(cache_directory) as entries:
+                for entry in entries:
+                    if entry.name.startswith(f'{capture["filename"]}_'):
+                        size += entry.stat().st_size
+                        os.remove(entry.path)
+
+        # Thumbnails live in the content addressed thumbnail cache, evicted now rather than lingering until least recently used.
+        if self.thumbnail_cache is not None and capture.get('thumbnail'):
+            size += self.thumbnail_cache.evict(capture['thumbnail'])
+
+        self.capture_index.remove(path)
+
+        self.files_removed += 1
+        self.bytes_removed += size
+
+        print(f'Storage limits exceeded!\n {path} has been deleted from the system to mitigate resource exhausiton!')
+
+        return size
+
+
+class ThumbnailCache(object):
+
+    '''
+        Content addressed cache of small gallery thumbnails, a thumbnail for each still and a poster frame alongside an
+            animated preview for each clip. Generated once per capture on the caches own worker as captures are written,
+            then served to the captures page at a few kilobytes per tile. Least recently used entries are evicted once the
+            cache exceeds its size cap.
+    '''
+
+    def __init__(
+            self,
+            directory : str,
+            max_bytes : int = 64 * 1024 * 1024,
+            thumbnail_size : tuple[int, int] = (320, 180),
+            preview_size : tuple[int, int] = (240, 135),
+            preview_frames : int = 8,
+            quality : int = 60,
+            capture_index : CaptureIndex | None = None
+        ) -> None:
+
+        '''
+            :param: directory - Directory the cache is stored within.
+            :param: max_bytes - Size cap of the cache.
+            :param: thumbnail_size - Maximum (width, height) of thumbnails and poster frames.
+            :param: preview_size - Maximum (width, height) of animated clip previews.
+            :param: preview_frames - Number of frames sampled across a clip for its preview.
+            :param: quality - Encoding quality of the thumbnails.
+            :param: capture_index - Index each captures thumbnail key is recorded in.
+        '''
+
+        self.directory = directory
+        self.max_bytes = int(max_bytes)
+        self.thumbnail_size = tuple(thumbnail_size)
+        self.preview_size = tuple(preview_size)
+        self.preview_frames = max(int(preview_frames), 1)
+        self.quality = quality
+        self.capture_index = capture_index
+
+        # WebP is considerably smaller at thumbnail sizes, fall back to JPEG where OpenCV lacks a WebP encoder.
+        self.extension = 'webp' if cv2.haveImageWriter('.webp') else 'jpg'
+        self.encode_flag = cv2.IMWRITE_WEBP_QUALITY if self.extension == 'webp' else cv2.IMWRITE_JPEG_QUALITY
+
+        # Animated previews require OpenCV's animation support, clips only get a poster frame without it.
+        self.animated_previews = self.extension == 'webp' and hasattr(cv2, 'imwriteanimation')
+
+        # Cached files and their sizes, least recently used first.
+        self.entries : OrderedDict[str, int] = OrderedDict()
+        self.total_bytes : int = 0
+
+        # Captures awaiting thumbnails, guarded by the condition which also wakes the worker.
+        self.pending : deque[str] = deque()
+        self.condition = threading.Condition()
+
+        # Guards the entries whilst generating, fetching and evicting.
+        self.lock = threading.Lock()
+
+        self.running = False
+        self.worker = None
+
+        self.load()
+
+
+    def load(self) -> None:
+
+        ''' Register the files already cached in a single scandir pass, ordered by last use. '''
+
+        os.makedirs(self.directory, exist_ok=True)
+
+        with os.scandir(self.directory) as entries:
+            files = sorted((entry for entry in entries if entry.is_file()), key=lambda entry: entry.stat().st_mtime)
+
+        for file in files:
+            self.entries[file.name] = file.stat().st_size
+            self.total_bytes += self.entries[file.name]
 
-            files = sorted(os.listdir(directory), key=os.path.getmtime)
 
-            for file in files[file_limit:]:
-                fullpath = os.path.join(directory, file)
-                os.remove(fullpath)
-                print(f'Storage limits exceeded!\n {fullpath} has been deleted from the system to mitigate resource exhausiton!')
+    def start(self) -> None:
 
+        ''' Start the worker thread if it is not already running. '''
+
+        if self.worker is not None and self.worker.is_alive():
+            return
+
+        self.running = True
+        self.worker = threading.Thread(target=self.process_requests, name='thumbnail-cache', daemon=True)
+        self.worker.start()
+
+
+    def stop(self, timeout : float = 5.0) -> None:
+
+        ''' Stop the worker thread, captures still pending are generated on demand when next requested. '''
+
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+
+        if self.worker is not None:
+            self.worker.join(timeout=timeout)
+            self.worker = None
+
+
+    def request(self, path : str) -> None:
+
+        ''' Queue thumbnail generation for a newly written capture. '''
+
+        with self.condition:
+            self.pending.append(path)
+            self.condition.notify()
+
+        self.start()
+
+
+    def process_requests(self) -> None:
+
+        ''' Worker loop, generates thumbnails for each queued capture until stopped. '''
+
+        while True:
+
+            with self.condition:
+
+                self.condition.wait_for(lambda: self.pending or not self.running)
+
+                if not self.running:
+                    break
+
+                path = self.pending.popleft()
+
+            try:
+                self.generate(path)
+            except Exception as e:
+                print(f'Failed to generate thumbnail for {path}!\n{e}')
+
+
+    def content_key(self, path : str) -> str:
+
+        ''' Key addressing a captures content, hashed from its size and leading and trailing bytes rather than the whole file. '''
+
+        size = os.path.getsize(path)
+        digest = hashlib.blake2b(str(size).encode(), digest_size=16)
+
+        with open(path, 'rb') as capture_file:
+            digest.update(capture_file.read(64 * 1024))
+
+            if size > 128 * 1024:
+                capture_file.seek(-64 * 1024, os.SEEK_END)
+                digest.update(capture_file.read())
+
+        return digest.hexdigest()
+
+
+    def filename(self, key : str, variant : str) -> str:
+
+        ''' Cached filename of a captures thumbnail or preview. '''
+
+        return f'{key}.{self.extension}' if variant == 'thumbnail' else f'{key}_{variant}.{self.extension}'
+
+
+    def generate(self, path : str) -> str | None:
+
+        '''
+            Generate the thumbnail (and preview for clips) of a capture unless already cached.
+
+            :param: path - Path of the capture.
+            :return: key - Content key of the capture, None if it could not be read.
+        '''
+
+        if not os.path.exists(path):
+            return None
+
+        key = self.content_key(path)
+
+        if self.filename(key, 'thumbnail') not in self.entries:
+
+            if os.path.splitext(path)[1].lower() in ('.mp4', '.avi'):
+                self.generate_clip(path, key)
+            else:
+                self.generate_still(path, key)
+
+        if self.capture_index is not None:
+            self.capture_index.set_thumbnail(path, key)
+
+        return key
+
+
+    def fit(self, frame : np.ndarray, max_size : tuple[int, int]) -> np.ndarray:
+
+        ''' Downscale a frame to fit within the maximum size, preserving its aspect ratio. '''
+
+        scale = min(max_size[0] / frame.shape[1], max_size[1] / frame.shape[0], 1.0)
+
+        if scale >= 1.0:
+            return frame
+
+        return cv2.resize(frame, (max(1, int(frame.shape[1] * scale)), max(1, int(frame.shape[0] * scale))), interpolation=cv2.INTER_AREA)
+
+
+    def generate_still(self, path : str, key : str) -> None:
+
+        ''' Thumbnail of a still, decoded at reduced resolution to save work on the Pi. '''
+
+        frame = cv2.imread(path, cv2.IMREAD_REDUCED_COLOR_2)
+
+        if frame is None:
+            raise IOError(f'Failed to read still {path}')
+
+        self.store(self.filename(key, 'thumbnail'), self.fit(frame, self.thumbnail_size))
+
+
+    def generate_clip(self, path : str, key : str) -> None:
+
+        ''' Poster frame and animated preview of a clip from frames sampled evenly across it. '''
+
+        capture = cv2.VideoCapture(path)
+        frame_count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        frames = []
+
+        for index in np.linspace(0, max(frame_count - 1, 0), num=min(self.preview_frames, max(frame_count, 1))).astype(int):
+            capture.set(cv2.CAP_PROP_POS_FRAMES, int(index))
+            success, frame = capture.read()
+
+            if success:
+                frames.append(frame)
+
+        capture.release()
+
+        if not frames:
+            raise IOError(f'Failed to read clip {path}')
+
+        # Middle of the clip, past the pre-roll, is most likely to show the event.
+        self.store(self.filename(key, 'thumbnail'), self.fit(frames[len(frames) // 2], self.thumbnail_size))
+
+        if self.animated_previews and len(frames) > 1:
+
+            animation = cv2.Animation()
+            animation.frames = [self.fit(frame, self.preview_size) for frame in frames]
+            animation.durations = [400] * len(frames)
+
+            preview_path = os.path.join(self.directory, self.filename(key, 'preview'))
+
+            if cv2.imwriteanimation(preview_path, animation, [cv2.IMWRITE_WEBP_QUALITY, self.quality]):
+                self.register(self.filename(key, 'preview'))
+
+
+    def store(self, filename : str, frame : np.ndarray) -> None:
+
+        ''' Encode and cache a thumbnail. '''
+
+        success, buffer = cv2.imencode(f'.{self.extension}', frame, [self.encode_flag, self.quality])
+
+        if not success:
+            raise IOError(f'Failed to encode thumbnail {filename}')
+
+        with open(os.path.join(self.directory, filename), 'wb') as thumbnail_file:
+            thumbnail_file.write(buffer.tobytes())
+
+        self.register(filename)
+
+
+    def register(self, filename : str) -> None:
+
+        ''' Record a newly cached file as most recently used, evicting the least recently used beyond the size cap. '''
+
+        size = os.path.getsize(os.path.join(self.directory, filename))
+
+        with self.lock:
+
+            self.total_bytes += size - self.entries.pop(filename, 0)
+            self.entries[filename] = size
+
+            while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+
+                evicted, evicted_size = self.entries.popitem(last=False)
+                self.total_bytes -= evicted_size
+
+                try:
+                    os.remove(os.path.join(self.directory, evicted))
+                except FileNotFoundError:
+                    pass
+
+
+    def evict(self, key : str) -> int:
+
+        '''
+            Remove the thumbnail and preview cached under a content key, e.g. once their capture has been deleted.
+
+            :param: key - Content key of the capture.
+            :return: size - Bytes removed.
+        '''
+
+        removed = 0
+
+        with self.lock:
+
+            for variant in ('thumbnail', 'preview'):
+
+                filename = self.filename(key, variant)
+
+                if filename not in self.entries:
+                    continue
+
+                size = self.entries.pop(filename)
+                self.total_bytes -= size
+
+                try:
+                    os.remove(os.path.join(self.directory, filename))
+                    removed += size
+                except FileNotFoundError:
+                    pass
+
+        return removed
+
+
+    def fetch(self, capture : dict, variant : str = 'thumbnail') -> str | None:
+
+        '''
+            Fetch the cached thumbnail or preview of an indexed capture, generating it should it be missing or evicted.
+
+            :param: capture - Capture record from the capture index.
+            :param: variant - 'thumbnail' or 'preview'.
+            :return: path - Path of the cached file, None if unavailable (e.g. previews of stills).
+        '''
+
+        key = capture.get('thumbnail')
+
+        if key is None or self.filename(key, 'thumbnail') not in self.entries:
+            key = self.generate(capture['path'])
+
+        if key is None:
+            return None
+
+        filename = self.filename(key, variant)
+
+        with self.lock:
+
+            if filename not in self.entries:
+                return None
+
+            # Mark as most recently used, persisted through the files modification time across restarts.
+            self.entries.move_to_end(filename)
+
+        path = os.path.join(self.directory, filename)
+
+        try:
+            os.utime(path)
         except FileNotFoundError:
-            print(f'Directory : {directory} not found!')
-        except Exception as e:
-            print(f'An error has occured: {e}')
+            return None
+
+        return path
@@ -3,11 +3,19 @@ from .ConfigManager import ConfigManager
 from .Camera import Camera 
 from .Detection import ObjectDetection
 from .Tracking import ObjectTracking
-from .Managment import DeviceManagement
+from .Managment import RetentionManager, ThumbnailCache
+from .CaptureIndex import CaptureIndex
+from .Recorder import ClipRecorder, SegmentRecorder
+from .Scheduler import DetectionScheduler
+from .Writer import CaptureWriter, CaptureJob
+from .Alerts import AlertDispatcher
+from .Attachments import AttachmentOptimizer
+from .Incidents import IncidentAggregator
+from .Streaming import FrameBroadcaster, EncodedFrameCache, resolve_jpeg_quality
 
-from collections import deque
-from time import time 
-import cv2
+import threading
+import os
+import time
 
 
 class VisionPipeline(object):
@@ -46,9 +54,8 @@ class VisionPipeline(object):
                 instantiations. 
         '''
         
-        if not hasattr(self, 'Initialised'):
+        if not hasattr(self, 'initialised'):
             self.initialise_pipeline()
-            self.initialised = True
 
 
     def initialise_pipeline(self):
@@ -56,26 +63,111 @@ class VisionPipeline(object):
         ''' Initialise the pipelines components. '''
 
         self.configuration_manager = ConfigManager(config_file=CAMERA_CONFIG_PATH, default_values=DEFAULT_CAMERA_CONFIG_DICT)
+
+        # Settings snapshot the running components were last configured from.
+        self.settings_snapshot = self.configuration_manager.snapshot()
+        motion_settings = self.settings_snapshot.get('motion_detection', {})
+
         self.camera = Camera(INDEX=INDEX, config_manager=self.configuration_manager)
-        self.object_detection = ObjectDetection()
-        self.object_tracking = ObjectTracking()
-        self.device_management = DeviceManagement()
+        self.object_detection = ObjectDetection(
+            analysis_scale=self.camera.settings.get('stream_quality', {}).get('analysis_scale', 0.25),
+            engine=motion_settings.get('engine', 'frame_difference'),
+            regions_of_interest=motion_settings.get('regions_of_interest', []),
+            sensitivity=int(motion_settings.get('sensitivity', 50))
+        )
+        self.object_tracking = ObjectTracking(
+            MAXIMUM_THREAT_LEVEL=int(motion_settings.get('maximum_threat_threshold', 5)),
+            ESCALATION_TIME=int(motion_settings.get('threat_escalation_timer', 10)),
+            PREDICTION=bool(motion_settings.get('tracking_prediction', True))
+        )
+
+        # Index of stored captures, brought in line with the captures directory once in the background on start up.
+        self.capture_index = CaptureIndex(CAPTURE_INDEX_PATH)
+        threading.Thread(target=self.capture_index.reconcile, args=(CAPTURE_UPLOADS_DIR,), name='capture-index', daemon=True).start()
+
+        # Gallery thumbnails and clip previews, generated once per capture in the background.
+        self.thumbnail_cache = ThumbnailCache(THUMBNAIL_CACHE_DIR, max_bytes=THUMBNAIL_CACHE_BYTES, capture_index=self.capture_index)
+
+        storage_settings = self.camera.settings.get('storage_settings', {})
+
+        # Keeps captures within their byte budget and the SD card above its free space floor, deleting in the background.
+        self.retention_manager = RetentionManager(
+            capture_index=self.capture_index,
+            directory=CAPTURE_UPLOADS_DIR,
+            byte_budget=int(storage_settings.get('storage_budget_mb', 4096)) * 1024 * 1024,
+            minimum_free_bytes=int(storage_settings.get('minimum_free_mb', 512)) * 1024 * 1024,
+            keep_high_threat=bool(storage_settings.get('keep_high_threat', True)),
+            protected_threat=int(storage_settings.get('protected_threat', 6)),
+            thumbnail_cache=self.thumbnail_cache
+        )
+
+        if storage_settings.get('auto_resource_management', True):
+            self.retention_manager.start()
 
         ''' Buffer Variables. '''
-        self.prev_frame = None
+        self.frame_sequence = -1
         self.clip_length = 5
-        self.buffer_size = self.clip_length * self.camera.fps 
-        self.pre_capture_buffer = deque(maxlen=self.buffer_size)
-        self.post_capture_buffer = []
-        self.motion_detected = False
-        self.saved_pre_buffer = []
-        self.counter = 0
+        self.buffer_size = int(self.clip_length * self.camera.fps)
 
         # Content type to discern whether device captures stills or video clips.
-        self.content_type = str(self.configuration_manager.settings.get('content_type', 'stills'))
+        self.content_type = str(self.camera.settings.get('storage_settings', {}).get('content_type', 'stills'))
 
         # User set delay in seconds for alerts ++ captures. 
-        self.frequency_delay = int(self.configuration_manager.settings.get('alert_settings').get('frequency'))
+        self.frequency_delay = int(self.camera.settings.get('alert_settings', {}).get('frequency', 600))
+
+        # Worker performing every capture related encode and disk write off the stream loop.
+        self.capture_writer = CaptureWriter(max_queue=64)
+
+        # Streams event clips to disk, holding only the pre-roll in memory.
+        self.clip_recorder = ClipRecorder(
+            capture_writer=self.capture_writer,
+            directory=CAPTURE_UPLOADS_DIR,
+            frame_rate=self.camera.fps,
+            frame_size=self.camera.frame_size,
+            pre_roll_seconds=self.clip_length,
+            post_roll_seconds=self.clip_length,
+            pre_roll_quality=resolve_jpeg_quality('stream', JPEG_QUALITY_PROFILES)
+        )
+
+        # Continuously records fixed length segments, indexing those holding tracked threats.
+        self.segment_recorder = SegmentRecorder(
+            capture_writer=self.capture_writer,
+            directory=SEGMENT_UPLOADS_DIR,
+            frame_rate=self.camera.fps,
+            frame_size=self.camera.frame_size,
+            segment_seconds=SEGMENT_LENGTH,
+            minimum_free_bytes=int(storage_settings.get('minimum_free_mb', 512)) * 1024 * 1024
+        )
+
+        # Delivers email alerts from its own worker, never costing the stream loop frame time.
+        self.alert_dispatcher = AlertDispatcher(
+            queue_directory=ALERT_QUEUE_DIR,
+            attachment_optimizer=AttachmentOptimizer(),
+            **self.alert_configuration(self.camera.settings)
+        )
+        self.alerts_enabled = bool(self.camera.settings.get('alert_settings', {}).get('toggle', False))
+
+        # Groups threats into incidents so a prolonged event yields one capture and alert rather than one per delay window.
+        self.incident_aggregator = IncidentAggregator(
+            alert_dispatcher=self.alert_dispatcher,
+            store_path=INCIDENTS_PATH,
+            incident_gap=INCIDENT_GAP,
+            digest_interval=int(self.camera.settings.get('alert_settings', {}).get('digest_interval', 0)),
+            threat_step=self.object_tracking.MAXIMUM_THREAT_LEVEL
+        )
+
+        # Alert once a capture has been written, attaching the file rather than an in memory frame.
+        self.capture_writer.add_listener(self.capture_completed)
+
+        ''' Live Settings. '''
+
+        # Newest snapshot published by the configuration manager, applied by the processing loop between frames.
+        self.pending_settings = None
+
+        # When the settings file was last checked for changes made outside of the settings page.
+        self.settings_checked_at = 0.0
+
+        self.configuration_manager.subscribe(self.settings_published)
 
         # Boolean to determine whether stream running or not. 
         self.running = True
@@ -83,146 +175,513 @@ class VisionPipeline(object):
         # Timer when algorithm last triggered.
         self.last_captured = 0
 
+        ''' Stream Broadcasting. '''
+
+        # Hub fanning each processed frame out to every connected viewer.
+        self.broadcaster = FrameBroadcaster(max_queue=2)
+
+        # Encodings of recent frames shared between the stream, snapshots, alerts and captures.
+        self.frame_cache = EncodedFrameCache(max_frames=4)
+
+        ''' Detection Scheduling. '''
+
+        # Decides which frames run the detection path based on scene activity and measured load.
+        self.scheduler = DetectionScheduler(target_fps=self.camera.fps)
+
+        # Tracks annotated onto frames, reused on frames where detection is skipped.
+        self.annotated_detections = []
+
+        # Single producer thread running detection, tracking and encoding once per frame.
+        self.producer_thread = None
+        self.producer_lock = threading.Lock()
+
+        # Mark pipeline as initialised to mitigate subsequent instantiations.
+        self.initialised = True
+
+
+    def alert_configuration(self, settings : dict) -> dict:
+
+        ''' Build the alert dispatchers configuration from the alert settings, falling back to environment variables. '''
+
+        alert_settings = settings.get('alert_settings', {})
+
+        return {
+            'app_email' : alert_settings.get('app_email') or os.getenv('APP_EMAIL'),
+            'app_password' : alert_settings.get('app_password') or os.getenv('APP_PASSWORD'),
+            'target_email' : alert_settings.get('target_email') or alert_settings.get('recipient_email') or os.getenv('TARGET_EMAIL'),
+            'frequency' : int(alert_settings.get('frequency', 600)),
+            'smtp_host' : alert_settings.get('smtp_host', 'smtp.gmail.com'),
+            'smtp_port' : alert_settings.get('smtp_port'),
+            'smtp_ssl' : bool(alert_settings.get('smtp_ssl', True))
+        }
+
+
+    def settings_published(self, previous, current) -> None:
+
+        ''' Configuration manager listener, hands the new snapshot over to the processing loop rather than applying it mid frame. '''
+
+        self.pending_settings = current
+
 
-    def generate_frames(self):
+    def apply_pending_settings(self, check_interval : float = 1.0) -> None:
 
         '''
-        Generator function concerned with handling the devices streaming capabilities.
+            Apply any settings published since the last frame, called by the processing loop between frames so every
+                component switches over at the same point. The settings file is also checked periodically so edits made by
+                hand are picked up, costing a single stat while nothing has changed.
+        '''
+
+        now = time.monotonic()
+
+        if now - self.settings_checked_at >= check_interval:
+            self.settings_checked_at = now
+            self.configuration_manager.snapshot()
+
+        pending = self.pending_settings
+
+        if pending is not None and pending.version > self.settings_snapshot.version:
+            self.apply_settings(pending)
+
+
+    def apply_settings(self, snapshot) -> None:
+
+        '''
+            Reconfigure only the components affected by the settings which changed between the applied snapshot and the
+                given one, everything else (tracks, background models, open incidents, the camera) carries on untouched.
+
+            Paramaters:
+                * snapshot (SettingsSnapshot) : Settings to apply.
+        '''
+
+        changes = snapshot.changes(self.settings_snapshot)
+
+        motion_settings = snapshot.get('motion_detection', {})
+        stream_settings = snapshot.get('stream_quality', {})
+        alert_settings = snapshot.get('alert_settings', {})
+        storage_settings = snapshot.get('storage_settings', {})
+
+        ''' Detection. '''
+
+        if 'motion_detection.engine' in changes:
+            self.object_detection.set_motion_engine(motion_settings.get('engine', 'frame_difference'))
+
+        if 'motion_detection.regions_of_interest' in changes:
+            self.object_detection.set_regions_of_interest(motion_settings.get('regions_of_interest', []))
+
+        if 'motion_detection.sensitivity' in changes:
+            self.object_detection.set_sensitivity(int(motion_settings.get('sensitivity', 50)))
+
+        if 'stream_quality.analysis_scale' in changes:
+            self.object_detection.analysis_scale = stream_settings.get('analysis_scale', 0.25)
+
+        ''' Tracking. '''
+
+        if changes & {'motion_detection.maximum_threat_threshold', 'motion_detection.threat_escalation_timer', 'motion_detection.tracking_prediction'}:
+            self.object_tracking.configure(
+                MAXIMUM_THREAT_LEVEL=int(motion_settings.get('maximum_threat_threshold', 5)),
+                ESCALATION_TIME=int(motion_settings.get('threat_escalation_timer', 10)),
+                PREDICTION=bool(motion_settings.get('tracking_prediction', True))
+            )
+            self.incident_aggregator.configure(threat_step=self.object_tracking.MAXIMUM_THREAT_LEVEL)
+
+        ''' Capture profile. '''
+
+        # Only the selected profile matters to the camera, edits to the other profile are picked up once it is selected.
+        profile_name = str(stream_settings.get('preferred_quality', 'performance'))
+
+        profile_path = f'stream_quality.{profile_name}'
+
+        if 'stream_quality.preferred_quality' in changes or any(change == profile_path or change.startswith(f'{profile_path}.') for change in changes):
+            # Nothing derived from the capture geometry changes should the camera have failed to switch.
+            if self.camera.apply_profile(snapshot) is not None:
+                self.reconfigure_capture()
+
+        ''' Recording. '''
+
+        if 'storage_settings.content_type' in changes:
+            self.set_content_type(str(storage_settings.get('content_type', 'stills')))
+
+        if changes & {'storage_settings.storage_budget_mb', 'storage_settings.minimum_free_mb', 'storage_settings.keep_high_threat', 'storage_settings.protected_threat'}:
+            self.retention_manager.configure(
+                byte_budget=int(storage_settings.get('storage_budget_mb', 4096)) * 1024 * 1024,
+                minimum_free_bytes=int(storage_settings.get('minimum_free_mb', 512)) * 1024 * 1024,
+                keep_high_threat=bool(storage_settings.get('keep_high_threat', True)),
+                protected_threat=int(storage_settings.get('protected_threat', 6))
+            )
+
+            # Segments are evicted against the same free space floor.
+            self.segment_recorder.minimum_free_bytes = int(storage_settings.get('minimum_free_mb', 512)) * 1024 * 1024
+
+        if 'storage_settings.auto_resource_management' in changes:
+            if storage_settings.get('auto_resource_management', True):
+                self.retention_manager.start()
+            else:
+                self.retention_manager.stop()
+
+        ''' Alerting. '''
+
+        if any(change.startswith('alert_settings.') for change in changes - {'alert_settings.toggle', 'alert_settings.digest_interval'}):
+            self.alert_dispatcher.configure(**self.alert_configuration(snapshot))
+            self.frequency_delay = int(alert_settings.get('frequency', 600))
+
+        if 'alert_settings.toggle' in changes:
+            self.alerts_enabled = bool(alert_settings.get('toggle', False))
+
+        if 'alert_settings.digest_interval' in changes:
+            self.incident_aggregator.configure(digest_interval=int(alert_settings.get('digest_interval', 0)))
+
+        self.camera.settings = snapshot.values
+        self.settings_snapshot = snapshot
+
+        print(f'Applied settings version {snapshot.version}: {", ".join(sorted(changes)) or "no changes"}')
+
+
+    def reconfigure_capture(self) -> None:
+
+        ''' Recompute everything derived from the cameras frame rate and resolution, e.g. after the capture profile changes. '''
+
+        self.buffer_size = int(self.clip_length * self.camera.fps)
+
+        # Tracks were measured in the previous resolutions pixels, start afresh rather than matching across scales.
+        self.object_tracking.detections.clear()
+        self.annotated_detections = []
+
+        self.clip_recorder.configure(self.camera.fps, self.camera.frame_size)
+        self.segment_recorder.configure(self.camera.fps, self.camera.frame_size)
+        self.scheduler.set_target_fps(self.camera.fps)
+
+
+    def set_content_type(self, content_type : str) -> None:
+
+        ''' Switch between stills, clips and continuous recording, closing whatever the previous mode had in progress. '''
+
+        # Nothing is held for clips outside of clip modes, the pre-roll is reallocated on entering one.
+        if self.content_type in CLIP_CONTENT_TYPES and content_type not in CLIP_CONTENT_TYPES:
+            self.clip_recorder.finish()
+            self.clip_recorder.release()
+
+        if self.content_type == 'continuous' and content_type != 'continuous':
+            self.segment_recorder.finish()
+
+        self.content_type = content_type
+
+
+    def event_metadata(self, detections : list, incident=None) -> dict:
+
+        ''' Summarise the tracks behind a capture, carried through to its alert. '''
+
+        return {
+            'incident_ID' : incident.ID if incident is not None else None,
+            'track_IDs' : [int(detection.get('ID')) for detection in detections],
+            'max_threat' : max((int(detection.get('threat_level', 0)) for detection in detections), default=0),
+            'trajectories' : {str(detection.get('ID')) : detection.get('center_point_trajectory', []) for detection in detections}
+        }
+
+
+    def statistics(self) -> dict:
+
+        '''
+            Report what the pipeline is measured to cost, served to the settings page so the motion engine can be chosen by
+                its per frame cost and the detection schedulers back off is visible.
+        '''
+
+        return {
+            'detection' : self.object_detection.motion_detector.statistics(),
+            'scheduler' : self.scheduler.statistics()
+        }
+
+
+    def capture_completed(self, job : CaptureJob) -> None:
+
+        ''' Capture writer listener, files a written still or event clip under its incident, alerting with it attached once per incident. '''
+
+        if job.status != 'done' or job.kind not in ('still', 'clip_open'):
+            return
+
+        # Continuously recorded segments are not captures in their own right, even once evicted from the segment index.
+        if job.path in self.segment_recorder.index.segments or \
+            os.path.dirname(os.path.abspath(job.path)) == os.path.abspath(SEGMENT_UPLOADS_DIR):
+            return
+
+        metadata = job.options.get('metadata') or {}
+
+        self.capture_index.add(job.path, captured_at=job.submitted_at, incident_ID=metadata.get('incident_ID'), max_threat=metadata.get('max_threat', 0))
+        self.retention_manager.request_check()
+        self.thumbnail_cache.request(job.path)
+
+        self.incident_aggregator.add_capture(metadata.get('incident_ID'), job.path, metadata, alert=self.alerts_enabled)
+
+
+    def start(self) -> None:
+
+        ''' Start the shared processing loop if it is not already running. '''
+
+        with self.producer_lock:
+
+            if self.producer_thread is not None and self.producer_thread.is_alive():
+                return
+
+            self.running = True
+            self.producer_thread = threading.Thread(target=self.process_frames, name='vision-pipeline', daemon=True)
+            self.producer_thread.start()
+
+
+    def stream_available(self, timeout : float = 5.0) -> bool:
+
+        ''' Ensure the processing loop is running and report whether it has produced a frame within the timeout. '''
+
+        self.start()
+
+        return self.broadcaster.wait_for_packet(timeout=timeout)
+
+
+    def encode_frame(self, sequence : int, quality : int | str | None = 'stream', resolution : tuple[int, int] | None = None) -> bytes | None:
+
+        '''
+            Fetch the JPEG encoding of a processed frame from the shared cache, encoding it only on first request.
+
+            Paramaters:
+                * sequence (int) : Capture sequence number of the frame.
+                * quality (int | str | None) : Named quality profile from JPEG_QUALITY_PROFILES or a raw JPEG quality.
+                * resolution (tuple[int, int] | None) : Output (width, height), None for the native resolution.
+
+            Returns:
+                * (bytes | None) : Encoded frame, None should the frame no longer be cached.
+        '''
+
+        return self.frame_cache.encode(sequence, resolve_jpeg_quality(quality, JPEG_QUALITY_PROFILES), resolution)
+
+
+    def snapshot(self, quality : int | str | None = 'snapshot', resolution : tuple[int, int] | None = None) -> bytes | None:
+
+        ''' Encode the most recently processed frame, used for single image requests. '''
+
+        if not self.stream_available():
+            return None
+
+        return self.encode_frame(self.frame_cache.latest_sequence, quality, resolution)
+
+
+    def generate_frames(self, quality : int | str | None = 'stream', resolution : tuple[int, int] | None = None):
+
+        '''
+        Generator function concerned with handling the devices streaming capabilities. Each viewer subscribes to the shared
+            broadcast rather than driving the camera itself, so detection does not scale with viewers and each frame is encoded
+            once per requested quality.
+
+        Paramaters:
+            * quality (int | str | None) : Named quality profile or raw JPEG quality for this viewer.
+            * resolution (tuple[int, int] | None) : Output (width, height) for this viewer, None for the native resolution.
 
         Yields:
             bytes: Multipart-encoded video frames suited to streaming to the web server.
         '''
 
+        # Ensure the producer is running before subscribing.
+        self.start()
+
+        subscriber = self.broadcaster.subscribe()
+
+        try:
+
+            while self.running and not subscriber.closed:
+
+                # Wait for the next processed frame, dropped frames are skipped by the subscribers queue.
+                packet = subscriber.get(timeout=1.0)
+
+                if packet is None:
+                    continue
+
+                # Fetch the shared encoding for this viewers quality, skip should the frame have been evicted already.
+                jpeg_bytes = self.encode_frame(packet[0], quality, resolution)
+
+                if jpeg_bytes is None:
+                    continue
+
+                # Yield frame in multipart format.
+                yield (
+                    b'--frame\r\n'
+                    b'Content-Type: image/jpeg\r\n\r\n' +
+                    jpeg_bytes +
+                    b'\r\n--frame\r\n')
+
+        finally:
+            # Client disconnected, release its queue.
+            self.broadcaster.unsubscribe(subscriber)
+
+
+    def process_frames(self) -> None:
+
+        '''
+        Shared processing loop run on the producer thread. Reads frames from the camera, runs detection, tracking, capture
+            handling and encoding once per frame and publishes the result to every subscriber.
+        '''
+
+        # Most recent tracker output, referenced by the capture trigger.
+        tracked_detections = []
+
         while self.running:
 
+            ''' Apply settings changed since the last frame. '''
+
+            self.apply_pending_settings()
+
             ''' Read frames from the camera. '''
 
-            # Read frame from the camera.
-            frame = self.camera.capture_frame()
+            # Fetch the newest frame captured since the last iteration, skipping any the loop fell behind on.
+            self.frame_sequence, frame = self.camera.read_next(self.frame_sequence)
+
+            # No new frame arrived within the timeout, try again.
+            if frame is None:
+                continue
 
             # Fetch inital detections time in specified format. 
             detected_at = time.strftime(FORMATTED_FILENAME_DATE)
 
-            if self.content_type == 'clips':
-                # Preserve a buffer of copied frames for when a capture of interest comes around.
-                self.pre_capture_buffer.append(frame.copy())
+            # Time the frames processing for the scheduler, excluding the wait on the camera.
+            frame_started_at = time.perf_counter()
 
             ''' Detect motion leveraging motion detection utility. '''
 
-            if self.prev_frame is not None:
+            # Whether the tracker produced fresh output for this frame.
+            detections_updated = False
+
+            # Run the full detection path only on frames the scheduler selects, every frame whilst tracks are active.
+            if self.scheduler.should_detect(self.frame_sequence, tracks_active=bool(self.object_tracking.detections)):
+
+                with self.scheduler.measure('detection'):
 
-                # Compare current and previous frames, assign first denoted var to access cv2 post processing frame.
-                _, detection_bboxes = self.object_detection.detect_motion(self.prev_frame, frame) # Returns [{'x1' : int(x1), 'y1' : int(y1), 'x2' : int(x1 + w), 'y2' : int(y1 + h)}]
+                    # Downsample, greyscale and blur the frame for analysis.
+                    processed_frame = self.object_detection.process_frame(frame)
+
+                    # Run the configured engine over the frame, assign first denoted var to access cv2 post processing frame.
+                    _, detection_bboxes = self.object_detection.detect_motion(processed_frame) # Returns [{'x1' : int(x1), 'y1' : int(y1), 'x2' : int(x1 + w), 'y2' : int(y1 + h)}]
 
                 ''' Use detection data to update tracker and provide ID values. '''
 
                 # If parsed detection data is returned. 
                 if detection_bboxes:
 
-                    ''' Object Tracking // Annotation. '''
+                    ''' Object Tracking. '''
 
-                    # Returns [{'x1', 'y1', 'x2', 'y2', 'ID', 'center_point_trajectory', 'first_seen', 'last_seen', 'threat_level'}]
-                    tracked_detections = self.object_tracking.update_tracker(detection_bboxes)
+                    with self.scheduler.measure('tracking'):
+                        # Returns [TrackRecord('x1', 'y1', 'x2', 'y2', 'ID', 'center_point_trajectory', 'first_seen', 'last_seen', 'threat_level')]
+                        tracked_detections = self.object_tracking.update_tracker(detection_bboxes)
 
-                    print(tracked_detections)
+                    detections_updated = True
 
-                    ''' Annotate detections. '''
+                else:
+                    # Still age out tracks on motionless frames, so the scheduler can drop back to its idle interval.
+                    self.object_tracking.prune_old_detections(time.time())
 
-                    # Annotate the detection metadata.
-                    annotated_frame = self.object_detection.annotate_detections(frame, tracked_detections)
+                # Retain the tracks to annotate until detection next runs, nothing to annotate when no motion was found.
+                self.annotated_detections = tracked_detections if detection_bboxes else []
 
-                    ''' Handle capture accordingly. '''
+            ''' Annotate detections, reusing the last tracker output on skipped frames. '''
 
-                    if self.content_type == 'stills' and \
-                        self.object_detection.trigger_capture(
-                            self.last_captured,
-                            self.frequency_delay, 
-                            self.object_tracking.MAXIMUM_THREAT_LEVEL,
-                            tracked_detections
-                        ):
+            with self.scheduler.measure('annotation'):
+                annotated_frame = self.object_detection.annotate_detections(frame, self.annotated_detections) if self.annotated_detections else frame
 
-                        # If content type is set to stills, capture annotated frame and store.
-                        self.object_detection.capture_still(annotated_frame, CAPTURE_UPLOADS_DIR, detected_at)
+            ''' Handle frames to be streamed to the web server. '''
 
-                    elif self.content_type == 'clips':
-                        # Otherwise, freeze pre event buffer, start appending post event frame to post event buffer.
-                        self.saved_pre_buffer = list(self.pre_capture_buffer)
-                        # Empty post event buffer for use.
-                        self.post_capture_buffer.clear()
-                        # Counter set to buffer size to decrement. 
-                        self.counter = self.buffer_size
-                        # Motion has been detected!
-                        self.motion_detected = True
+            # Register the processed frame with the shared cache once, stills and the stream encode from it on request.
+            self.frame_cache.store_frame(self.frame_sequence, annotated_frame)
+
+            ''' Handle capture accordingly. '''
+
+            if detections_updated:
+
+                # Fold the threats into their incident, only new or escalating incidents warrant a further capture.
+                threats = [
+                    detection for detection in tracked_detections
+                    if detection.get('threat_level', 0) > self.object_tracking.MAXIMUM_THREAT_LEVEL
+                ]
+
+                incident, incident_state = self.incident_aggregator.observe(threats)
+                capture_warranted = incident_state in ('new', 'escalated')
+
+                if self.content_type == 'stills' and capture_warranted and \
+                    self.object_detection.trigger_capture(
+                        self.last_captured,
+                        self.frequency_delay, 
+                        self.object_tracking.MAXIMUM_THREAT_LEVEL,
+                        tracked_detections
+                    ):
+
+                    # If content type is set to stills, queue the annotated frame to be written at evidence quality.
+                    if self.capture_writer.write_still(
+                        os.path.join(CAPTURE_UPLOADS_DIR, f'{detected_at}.jpg'),
+                        encoded=self.encode_frame(self.frame_sequence, 'evidence'),
+                        frame=annotated_frame,
+                        metadata=self.event_metadata(threats, incident)
+                    ) is None:
+                        print('Capture writer saturated, still capture dropped!')
+
+                    self.last_captured = time.time()
+
+                elif self.content_type in CLIP_CONTENT_TYPES and capture_warranted and \
+                    self.object_detection.trigger_capture(
+                        self.last_captured,
+                        self.frequency_delay,
+                        self.object_tracking.MAXIMUM_THREAT_LEVEL,
+                        tracked_detections
+                    ):
+
+                    # Otherwise, open the clip and drain the pre-roll into it, following frames are appended as they arrive.
+                    self.clip_recorder.trigger(detected_at, metadata=self.event_metadata(threats, incident))
+                    self.last_captured = time.time()
+
+                elif self.content_type == 'continuous':
+
+                    # Footage is already being recorded, mark where within it the threats appear.
+                    self.segment_recorder.mark_threats(threats)
+
+                    # No capture file to attach, the incidents alert points at the recording instead. Escalations retry an
+                    # alert suppressed by the alert frequency, the aggregator only ever alerts once per incident.
+                    if capture_warranted and self.alerts_enabled and self.segment_recorder.segment is not None:
+                        self.incident_aggregator.alert(incident, contents=(
+                            f'Your Raspberry Pi has detected a threat at {time.strftime("%Y-%m-%d %H:%M:%S")}, '
+                            f'recorded within {os.path.basename(self.segment_recorder.segment.path)}.'
+                        ))
 
-                else:
-                    # No detections, continue.
-                    annotated_frame = frame 
-            else: 
-                # No frame for comparison.
-                annotated_frame = frame
-
-            # Prepare a previous copy for next interations motion detection operations. 
-            self.prev_frame = frame.copy()
-
-            ''' Capture clip of event. '''
-
-            # If motion has been detected and content type concerned with capturing clips.
-            if self.motion_detected and \
-                self.content_type == 'clips' and \
-                        self.object_detection.trigger_capture(
-                            self.last_captured,
-                            self.frequency_delay, 
-                            self.object_tracking.MAXIMUM_THREAT_LEVEL,
-                            tracked_detections
-                        ):
-
-                self.last_captured = time.time()
-                
-                # Decrement counter.
-                self.counter -= 1
-                # Add frame copies to post event buffer.
-                self.post_capture_buffer.append(annotated_frame.copy())
-
-                # If buffer size depleted.
-                if self.counter <= 0:
-                    
-                    # Capture the video clip.
-                    self.object_detection.capture_video(
-                        self.saved_pre_buffer,
-                        self.post_capture_buffer,
-                        CAPTURE_UPLOADS_DIR,
-                        self.camera.fps,
-                        self.camera.frame_width,
-                        self.camera.frame_height,
-                        detected_at
-                    )
-
-                    # Resest motion detection operations.
-                    self.motion_detected = False 
-                    # Clear buffers. 
-                    self.post_capture_buffer.clear()
-            
             ''' Monitor system resources, manage accordingly. '''
 
-            ''' Handle frames to be streamed to the web server. '''
+            ''' Record clip of event. '''
 
-            # Encode frame for streaming.
-            success, buffer = cv2.imencode('.jpg', annotated_frame)
-            if not success:
-                continue
-            
-            # Yield frame in multipart format.
-            yield (
-                b'--frame\r\n'
-                b'Content-Type: image/jpeg\r\n\r\n' +
-                buffer.tobytes() +
-                b'\r\n--frame\r\n')
+            if self.content_type in CLIP_CONTENT_TYPES:
+                # Queued for the clip as is whilst recording, otherwise held within the pre-roll reusing the streams encoding.
+                self.clip_recorder.add_frame(
+                    annotated_frame,
+                    encoded=None if self.clip_recorder.recording else self.encode_frame(self.frame_sequence, 'stream'),
+                    sequence=self.frame_sequence
+                )
+
+            elif self.content_type == 'continuous':
+                # Every frame is recorded into the current segment, only encoded should a viewer request it.
+                self.segment_recorder.add_frame(annotated_frame)
+
+            # Notify every subscriber the frame is available.
+            self.broadcaster.publish(self.frame_sequence, None)
+
+            # Feed the frames latency back into the scheduler so it can back off or recover.
+            self.scheduler.record('frame', time.perf_counter() - frame_started_at)
+            self.scheduler.frame_processed()
 
 
     def stop_stream(self):
 
         ''' Helper function to handle the streams termination. '''
         self.running = False
+        self.broadcaster.close()
+
+        # Finalise any clip in progress and flush outstanding writes.
+        self.clip_recorder.finish()
+        self.segment_recorder.finish()
+        self.capture_writer.stop()
+        self.incident_aggregator.stop()
+        self.retention_manager.stop()
+        self.thumbnail_cache.stop()
+        self.alert_dispatcher.stop()
 
 # Instantiate single instance of this pipeline for access in routes.py
 stream_pipeline = VisionPipeline()
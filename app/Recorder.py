@@ -0,0 +1,740 @@
+from collections import deque
+import threading
+import shutil
+import json
+import time
+import numpy as np
+import cv2
+import os
+from .AppConfig import FORMATTED_FILENAME_DATE
+from .Writer import CaptureWriter, CaptureJob
+
+
+class CompressedFrameRing(object):
+
+    '''
+        Ring of JPEG compressed frames held within a single preallocated bytearray arena alongside an index of
+            (sequence, offset, length) entries. Appending copies the encoded bytes into the arena and evicts whichever of the
+            oldest frames they overwrite, frames are only decoded again when an event actually fires.
+    '''
+
+    def __init__(self, capacity_bytes : int, max_frames : int) -> None:
+
+        '''
+            Initialise the compressed frame ring.
+
+            Paramaters:
+                * capacity_bytes (int) : Size of the preallocated arena.
+                * max_frames (int) : Maximum number of frames retained regardless of remaining space.
+        '''
+
+        # Preallocated arena holding every compressed frame back to back.
+        self.arena = bytearray(max(int(capacity_bytes), 1))
+
+        # Index of held frames as (sequence, offset, length), oldest first.
+        self.index : deque[tuple[int, int, int]] = deque()
+
+        # Maximum number of frames retained.
+        self.max_frames = max(int(max_frames), 1)
+
+        # Offset the next frame will be written to.
+        self.write_offset : int = 0
+
+        # Frames discarded for being larger than the whole arena.
+        self.oversized : int = 0
+
+
+    @property
+    def capacity(self) -> int:
+        return len(self.arena)
+
+
+    def append(self, sequence : int, encoded : bytes) -> bool:
+
+        '''
+            Copy a compressed frame into the arena, evicting the oldest frames it overwrites.
+
+            Paramaters:
+                * sequence (int) : Capture sequence number of the frame.
+                * encoded (bytes) : JPEG encoded frame.
+
+            Returns:
+                * (bool) : False if the frame was too large to be held.
+        '''
+
+        length = len(encoded)
+
+        if length > self.capacity:
+            self.oversized += 1
+            return False
+
+        start = self.write_offset
+
+        # Not enough room before the end of the arena, wrap to the start. Everything stored beyond the write offset is
+        # older than the frames at the start of the arena, so it is abandoned first.
+        if start + length > self.capacity:
+            while self.index and self.index[0][1] >= start:
+                self.index.popleft()
+            start = 0
+
+        end = start + length
+
+        # Evict the oldest frames overlapping the region about to be written.
+        while self.index and self.index[0][1] < end and start < self.index[0][1] + self.index[0][2]:
+            self.index.popleft()
+
+        # Respect the frame limit.
+        while len(self.index) >= self.max_frames:
+            self.index.popleft()
+
+        self.arena[start:end] = encoded
+        self.index.append((sequence, start, length))
+        self.write_offset = end
+
+        return True
+
+
+    def frames(self):
+
+        ''' Yield (sequence, memoryview) pairs of the held frames, oldest first, without copying them out of the arena. '''
+
+        view = memoryview(self.arena)
+
+        for sequence, offset, length in self.index:
+            yield sequence, view[offset:offset + length]
+
+
+    def drain(self):
+
+        ''' Decode and yield every held frame oldest first, leaving the ring empty. '''
+
+        for _, encoded in list(self.frames()):
+
+            frame = cv2.imdecode(np.frombuffer(encoded, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+            if frame is not None:
+                yield frame
+
+        self.clear()
+
+
+    def clear(self) -> None:
+
+        ''' Discard every held frame. '''
+
+        self.index.clear()
+        self.write_offset = 0
+
+
+    @property
+    def bytes_used(self) -> int:
+
+        ''' Total size of the held frames. '''
+
+        return sum(length for _, _, length in self.index)
+
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+
+class ClipRecorder(object):
+
+    '''
+        Records event clips incrementally. A rolling pre-roll of recent frames is kept at all times, once an event fires a
+            clip is opened on the capture writer, the pre-roll is handed over in one job and every following frame is queued as
+            it arrives until the post-roll has elapsed. Peak memory is therefore bounded by the pre-roll alone rather than the
+            whole clip, the pre-roll itself is held JPEG compressed and no encoding or disk I/O happens on the calling thread.
+    '''
+
+    def __init__(
+            self,
+            capture_writer : CaptureWriter,
+            directory : str,
+            frame_rate : float,
+            frame_size : tuple[int, int],
+            pre_roll_seconds : float = 5,
+            post_roll_seconds : float = 5,
+            codec : str = 'mp4v',
+            extension : str = 'mp4',
+            pre_roll_quality : int = 70,
+            pre_roll_headroom : float = 1.25
+        ) -> None:
+
+        '''
+            Initialise the clip recorder.
+
+            Paramaters:
+                * capture_writer (CaptureWriter) : Worker performing the clips encoding and disk writes.
+                * directory (str) : Directory where video clips will be stored.
+                * frame_rate (float) : Frame rate parsed from the capture object.
+                * frame_size (tuple[int, int]) : (width, height) of the recorded frames.
+                * pre_roll_seconds (float) : Seconds of footage leading up to an event included in its clip.
+                * post_roll_seconds (float) : Seconds recorded after the most recent trigger before the clip is closed.
+                * codec (str) : Chosen video format type.
+                * extension (str) : File extension of the written clips.
+                * pre_roll_quality (int) : JPEG quality the pre-roll is held at, that of the stream encoding shared by the caller.
+                * pre_roll_headroom (float) : Multiple of the expected pre-roll size allocated, for busier scenes than expected.
+        '''
+
+        self.capture_writer = capture_writer
+        self.directory = directory
+        self.pre_roll_quality = max(1, min(int(pre_roll_quality), 100))
+        self.pre_roll_headroom = max(float(pre_roll_headroom), 1.0)
+        self.codec = codec
+        self.extension = extension
+        self.pre_roll_seconds = pre_roll_seconds
+        self.post_roll_seconds = post_roll_seconds
+
+        # Writer job of the clip currently being recorded, None whilst idle.
+        self.clip : CaptureJob | None = None
+
+        # Frames still to be written before the current clip is closed.
+        self.frames_remaining : int = 0
+
+        # Frames dropped from clips due to writer backpressure.
+        self.frames_dropped : int = 0
+
+        # Rolling buffer of the most recent frames, JPEG compressed. Allocated on the first frame recorded, so nothing is
+        # held whilst clips are not being recorded at all, e.g. in stills or continuous mode.
+        self.pre_roll : CompressedFrameRing | None = None
+
+        self.configure(frame_rate, frame_size)
+
+
+    def configure(self, frame_rate : float, frame_size : tuple[int, int]) -> None:
+
+        '''
+            Apply a new frame rate and resolution, the pre-roll is reallocated at its new size when next used. Any clip in
+                progress is finished first as its writer is bound to the previous resolution.
+        '''
+
+        if self.recording:
+            self.finish()
+
+        self.frame_rate = float(frame_rate)
+        self.frame_size = (int(frame_size[0]), int(frame_size[1]))
+
+        # Frames held within the pre-roll and appended after each trigger.
+        self.pre_roll_frames = max(int(self.pre_roll_seconds * self.frame_rate), 1)
+        self.post_roll_frames = max(int(self.post_roll_seconds * self.frame_rate), 1)
+
+        self.release()
+
+
+    def expected_frame_bytes(self) -> int:
+
+        '''
+            Expected size of a frame JPEG encoded at the pre-roll quality, from typical bits per pixel of camera footage at
+                that quality, roughly 0.5 at 50, 1 at 75, 2 at 90 and 3 at 95 rising steeply towards 100.
+        '''
+
+        bits_per_pixel = float(np.interp(self.pre_roll_quality, (1, 50, 75, 90, 95, 100), (0.25, 0.5, 1.0, 2.0, 3.0, 6.0)))
+
+        return int(self.frame_size[0] * self.frame_size[1] * bits_per_pixel / 8)
+
+
+    def allocate(self) -> CompressedFrameRing:
+
+        ''' Allocate the pre-roll should it not already be, sized for its frames at the expected encoded size. '''
+
+        if self.pre_roll is None:
+            capacity_bytes = int(self.pre_roll_frames * self.expected_frame_bytes() * self.pre_roll_headroom)
+            self.pre_roll = CompressedFrameRing(capacity_bytes=capacity_bytes, max_frames=self.pre_roll_frames)
+
+        return self.pre_roll
+
+
+    def release(self) -> None:
+
+        ''' Free the pre-roll and the frames it holds, e.g. once clips are no longer being recorded. '''
+
+        self.pre_roll = None
+
+
+    @property
+    def recording(self) -> bool:
+
+        ''' Whether a clip is currently being written. '''
+
+        return self.clip is not None
+
+
+    def encode(self, frame : np.ndarray) -> bytes | None:
+
+        ''' JPEG encode a frame the caller could not share an existing encoding for. '''
+
+        success, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, self.pre_roll_quality])
+
+        return buffer.tobytes() if success else None
+
+
+    def add_frame(self, frame : np.ndarray, encoded : bytes | None = None, sequence : int = -1) -> None:
+
+        '''
+            Feed the recorder the latest frame. Whilst recording the frame itself is queued for the clip, so the writer
+                encodes it once rather than decoding a JPEG first, otherwise it is held JPEG compressed within the pre-roll.
+
+            Paramaters:
+                * frame (np.ndarray) : Frame to be recorded, never modified afterwards by the caller.
+                * encoded (bytes | None) : JPEG encoding of the frame where the caller already has one, e.g. from the stream,
+                    only needed whilst idle.
+                * sequence (int) : Capture sequence number of the frame.
+        '''
+
+        if frame is None:
+            return
+
+        if not self.recording:
+
+            # Encode ourselves only where the caller could not share an existing encoding.
+            if encoded is None:
+                encoded = self.encode(frame)
+
+                if encoded is None:
+                    return
+
+            self.allocate().append(sequence, encoded)
+            return
+
+        # Queue the frame, dropping it should the writer be saturated rather than stalling the caller.
+        if not self.capture_writer.append_clip_frames(self.clip, [frame]):
+            self.frames_dropped += 1
+
+        self.frames_remaining -= 1
+
+        # Post-roll elapsed without a further trigger, close the clip.
+        if self.frames_remaining <= 0:
+            self.finish()
+
+
+    def trigger(self, captured_at : str, metadata : dict | None = None) -> CaptureJob | None:
+
+        '''
+            Signal an event. Starts a new clip if idle, otherwise extends the post-roll of the clip being recorded.
+
+            Paramaters:
+                * captured_at (str) : Time event was captured at, used as the clips filename.
+                * metadata (dict | None) : Event metadata carried on the clips writer job.
+
+            Returns:
+                * (CaptureJob | None) : Writer job of the newly started clip, None if a clip was already being recorded.
+        '''
+
+        self.frames_remaining = self.post_roll_frames
+
+        if self.recording:
+            return None
+
+        filename = os.path.join(self.directory, f'{captured_at}.{self.extension}')
+
+        self.clip = self.capture_writer.open_clip(filename, self.frame_rate, self.frame_size, self.codec, metadata=metadata)
+
+        pre_roll = []
+
+        # Hand the pre-roll over as a single job, copied out of the arena before it is reused.
+        if self.pre_roll is not None:
+            pre_roll = [bytes(encoded) for _, encoded in self.pre_roll.frames()]
+            self.pre_roll.clear()
+
+        if pre_roll and not self.capture_writer.append_clip_frames(self.clip, pre_roll):
+            self.frames_dropped += len(pre_roll)
+
+        return self.clip
+
+
+    def finish(self) -> CaptureJob | None:
+
+        '''
+            Close the clip being recorded.
+
+            Returns:
+                * (CaptureJob | None) : Writer job of the finished clip, None if nothing was being recorded.
+        '''
+
+        if not self.recording:
+            return None
+
+        clip = self.clip
+
+        # Always cleanup resources.
+        self.capture_writer.close_clip(clip)
+        self.clip, self.frames_remaining = None, 0
+
+        return clip
+
+
+class SegmentIndex(object):
+
+    '''
+        Lightweight index of continuously recorded segments and the offsets within them where tracked threats were present.
+            Persisted as JSON beside the segments, so locating an incident is a lookup rather than a search through footage.
+            Segments without events are evicted before those with events whenever storage runs short.
+    '''
+
+    def __init__(self, index_path : str, merge_gap : float = 2.0) -> None:
+
+        '''
+            Initialise the segment index, loading any previously persisted state.
+
+            Paramaters:
+                * index_path (str) : JSON file the index is persisted to.
+                * merge_gap (float) : Seconds between threat observations within a segment before they count as separate events.
+        '''
+
+        self.index_path = index_path
+        self.merge_gap = merge_gap
+
+        # Segments keyed by path, {'path', 'started_at', 'duration', 'frames', 'complete', 'max_threat'}.
+        self.segments : dict[str, dict] = {}
+
+        # Events, {'segment', 'start_offset', 'end_offset', 'started_at', 'track_IDs', 'max_threat'}.
+        self.events : list[dict] = []
+
+        # Guards the index, updated from the stream loop and the capture writer thread.
+        self.lock = threading.Lock()
+
+        self.load()
+
+
+    def load(self) -> None:
+
+        ''' Load persisted state, starting empty should it be missing or unreadable. '''
+
+        if not os.path.exists(self.index_path):
+            return
+
+        try:
+            with open(self.index_path, 'r') as index_file:
+                persisted = json.load(index_file)
+
+            self.segments = {segment['path'] : segment for segment in persisted.get('segments', [])}
+            self.events = persisted.get('events', [])
+
+        except (IOError, ValueError) as e:
+            print(f'Failed to load segment index, starting afresh.\n{e}')
+
+
+    def save(self) -> None:
+
+        ''' Persist the index, written to a temporary file first so a crash never leaves it truncated. '''
+
+        with self.lock:
+            persisted = {'segments' : list(self.segments.values()), 'events' : list(self.events)}
+
+        directory = os.path.dirname(self.index_path)
+
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+
+        temporary_path = f'{self.index_path}.tmp'
+
+        with open(temporary_path, 'w') as index_file:
+            json.dump(persisted, index_file)
+
+        os.replace(temporary_path, self.index_path)
+
+
+    def add_segment(self, path : str, started_at : float) -> None:
+
+        ''' Register a newly opened segment. '''
+
+        with self.lock:
+            self.segments[path] = {'path' : path, 'started_at' : started_at, 'duration' : 0.0, 'frames' : 0, 'complete' : False, 'max_threat' : 0}
+
+
+    def complete_segment(self, path : str, frames : int, frame_rate : float) -> None:
+
+        ''' Record a segments final length once it has been closed. '''
+
+        with self.lock:
+            segment = self.segments.get(path)
+
+            if segment is not None:
+                segment.update(frames=frames, duration=frames / frame_rate, complete=True)
+
+
+    def mark_event(self, path : str, offset : float, observed_at : float, track_IDs : list[int], threat_level : int) -> None:
+
+        '''
+            Record tracked threats at the given offset within a segment, extending the segments latest event where it is
+                within the merge gap.
+
+            Paramaters:
+                * path (str) : Segment the threats were recorded in.
+                * offset (float) : Seconds into the segment.
+                * observed_at (float) : Wall clock time of the observation.
+                * track_IDs (list[int]) : IDs of the tracks considered threats.
+                * threat_level (int) : Highest threat level among them.
+        '''
+
+        with self.lock:
+
+            segment = self.segments.get(path)
+
+            if segment is None:
+                return
+
+            segment['max_threat'] = max(segment['max_threat'], threat_level)
+
+            latest = self.events[-1] if self.events else None
+
+            # Extend the ongoing event rather than recording one per frame.
+            if latest is not None and latest['segment'] == path and offset - latest['end_offset'] <= self.merge_gap:
+                latest['end_offset'] = offset
+                latest['track_IDs'] = sorted(set(latest['track_IDs']) | set(track_IDs))
+                latest['max_threat'] = max(latest['max_threat'], threat_level)
+                return
+
+            self.events.append({
+                'segment' : path,
+                'start_offset' : offset,
+                'end_offset' : offset,
+                'started_at' : observed_at,
+                'track_IDs' : sorted(track_IDs),
+                'max_threat' : threat_level
+            })
+
+
+    def lookup(self, timestamp : float) -> tuple[str, float] | None:
+
+        '''
+            Locate the segment and offset holding footage of the given wall clock time.
+
+            Returns:
+                * (tuple[str, float] | None) : (segment path, offset in seconds), None if no segment covers that time.
+        '''
+
+        with self.lock:
+            for segment in self.segments.values():
+                if segment['started_at'] <= timestamp and (not segment['complete'] or timestamp <= segment['started_at'] + segment['duration']):
+                    return segment['path'], timestamp - segment['started_at']
+
+        return None
+
+
+    def find(self, filename : str) -> dict | None:
+
+        ''' Fetch a segment by its filename, e.g. as requested by the captures page. '''
+
+        with self.lock:
+            for segment in self.segments.values():
+                if os.path.basename(segment['path']) == filename:
+                    return dict(segment)
+
+        return None
+
+
+    def events_between(self, start : float, end : float) -> list[dict]:
+
+        ''' Events that began within the given wall clock window. '''
+
+        with self.lock:
+            return [dict(event) for event in self.events if start <= event['started_at'] <= end]
+
+
+    def eviction_candidates(self, exclude : tuple = ()) -> list[dict]:
+
+        '''
+            Completed segments ordered for eviction, those without events first, oldest first within each group. Segments
+                still being recorded or closed are never complete, so never candidates.
+
+            Paramaters:
+                * exclude (tuple) : Paths never offered for eviction, e.g. the segment just completed.
+        '''
+
+        with self.lock:
+            event_segments = {event['segment'] for event in self.events}
+            completed = [segment for segment in self.segments.values() if segment['complete'] and segment['path'] not in exclude]
+
+        return sorted(completed, key=lambda segment : (segment['path'] in event_segments, segment['started_at']))
+
+
+    def remove_segment(self, path : str) -> None:
+
+        ''' Forget a segment and its events once it has been deleted. '''
+
+        with self.lock:
+            self.segments.pop(path, None)
+            self.events = [event for event in self.events if event['segment'] != path]
+
+
+class SegmentRecorder(object):
+
+    '''
+        Continuous recording mode. Every frame is queued on the capture writer into fixed length segment files, a new segment
+            is started each time the current one reaches its length. Threat observations are recorded against the segment and
+            offset they occur at within a SegmentIndex, so recording cost stays constant rather than spiking on each event.
+    '''
+
+    def __init__(
+            self,
+            capture_writer : CaptureWriter,
+            directory : str,
+            frame_rate : float,
+            frame_size : tuple[int, int],
+            segment_seconds : float = 10,
+            minimum_free_bytes : int = 512 * 1024 * 1024,
+            codec : str = 'mp4v',
+            extension : str = 'mp4'
+        ) -> None:
+
+        '''
+            Initialise the segment recorder.
+
+            Paramaters:
+                * capture_writer (CaptureWriter) : Worker performing the segments encoding and disk writes.
+                * directory (str) : Directory segments and their index are stored within.
+                * frame_rate (float) : Frame rate parsed from the capture object.
+                * frame_size (tuple[int, int]) : (width, height) of the recorded frames.
+                * segment_seconds (float) : Length of each segment.
+                * minimum_free_bytes (int) : Free space maintained on the storage device by evicting segments.
+                * codec (str) : Chosen video format type.
+                * extension (str) : File extension of the written segments.
+        '''
+
+        self.capture_writer = capture_writer
+        self.directory = directory
+        self.segment_seconds = segment_seconds
+        self.minimum_free_bytes = minimum_free_bytes
+        self.codec = codec
+        self.extension = extension
+
+        # Index of recorded segments and events.
+        self.index = SegmentIndex(os.path.join(directory, 'segments_index.json'))
+
+        # Writer job of the segment being recorded alongside the frames queued to it.
+        self.segment : CaptureJob | None = None
+        self.segment_frames : int = 0
+
+        # Frames dropped due to writer backpressure.
+        self.frames_dropped : int = 0
+
+        # Finalise segments in the index and reclaim space once the writer has closed them.
+        self.capture_writer.add_listener(self.segment_completed)
+
+        self.configure(frame_rate, frame_size)
+
+
+    def configure(self, frame_rate : float, frame_size : tuple[int, int]) -> None:
+
+        ''' Apply a new frame rate and resolution, finishing the current segment as its writer is bound to the previous ones. '''
+
+        self.finish()
+
+        self.frame_rate = float(frame_rate)
+        self.frame_size = (int(frame_size[0]), int(frame_size[1]))
+        self.frames_per_segment = max(int(self.segment_seconds * self.frame_rate), 1)
+
+
+    def add_frame(self, frame : np.ndarray) -> None:
+
+        '''
+            Queue a frame for the current segment, rolling over to a new segment once it reaches its length. The frame is
+                queued as is, so the writer encodes it once rather than decoding a JPEG first.
+
+            Paramaters:
+                * frame (np.ndarray) : Frame to be recorded, never modified afterwards by the caller.
+        '''
+
+        if self.segment is None or self.segment_frames >= self.frames_per_segment:
+            self.start_segment()
+
+        if not self.capture_writer.append_clip_frames(self.segment, [frame]):
+            self.frames_dropped += 1
+            return
+
+        self.segment_frames += 1
+
+
+    def start_segment(self) -> None:
+
+        ''' Close the current segment and open the next. '''
+
+        self.finish()
+
+        started_at = time.time()
+        filename = f'segment_{time.strftime(FORMATTED_FILENAME_DATE, time.localtime(started_at))}'
+        path = os.path.join(self.directory, f'{filename}.{self.extension}')
+
+        # Filenames resolve to the second, never overwrite a segment started within the same one.
+        suffix = 1
+        while path in self.index.segments:
+            path = os.path.join(self.directory, f'{filename}-{suffix}.{self.extension}')
+            suffix += 1
+
+        self.segment = self.capture_writer.open_clip(path, self.frame_rate, self.frame_size, self.codec)
+        self.segment_frames = 0
+        self.index.add_segment(path, started_at)
+
+
+    def mark_threats(self, threats : list) -> None:
+
+        ''' Record the given tracked threats against the current segment and offset. '''
+
+        if self.segment is None or not threats:
+            return
+
+        self.index.mark_event(
+            path=self.segment.path,
+            offset=self.segment_frames / self.frame_rate,
+            observed_at=time.time(),
+            track_IDs=[int(threat.get('ID')) for threat in threats],
+            threat_level=max(int(threat.get('threat_level', 0)) for threat in threats)
+        )
+
+
+    def finish(self) -> None:
+
+        ''' Close the segment being recorded. '''
+
+        if self.segment is None:
+            return
+
+        segment, frames = self.segment, self.segment_frames
+        self.segment, self.segment_frames = None, 0
+
+        # Carried on the job so the segment is only marked complete once the writer has actually closed it.
+        segment.options['frames'] = frames
+
+        self.capture_writer.close_clip(segment)
+
+
+    def segment_completed(self, job : CaptureJob) -> None:
+
+        ''' Writer listener, marks a segment complete once the writer has closed it, then reclaims space and persists the index. '''
+
+        if job.kind != 'clip_open' or job.path not in self.index.segments:
+            return
+
+        self.index.complete_segment(job.path, job.options.get('frames', 0), job.options.get('frame_rate', self.frame_rate))
+
+        # Never evict the segment which has only just been written.
+        self.reclaim_space(exclude=(job.path,))
+        self.index.save()
+
+
+    def reclaim_space(self, exclude : tuple = ()) -> None:
+
+        ''' Evict completed segments, those without events first, until the minimum free space is restored. '''
+
+        try:
+            free_bytes = shutil.disk_usage(self.directory).free
+        except FileNotFoundError:
+            return
+
+        for segment in self.index.eviction_candidates(exclude=exclude):
+
+            if free_bytes >= self.minimum_free_bytes:
+                break
+
+            try:
+                size = os.path.getsize(segment['path'])
+                os.remove(segment['path'])
+                free_bytes += size
+                print(f'Storage running low!\n {segment["path"]} has been deleted from the system to mitigate resource exhausiton!')
+
+            except FileNotFoundError:
+                pass
+
+            self.index.remove_segment(segment['path'])
@@ -1,6 +1,10 @@
-from flask import Blueprint, Response, render_template, request, jsonify
+from flask import Blueprint, Response, render_template, request, jsonify, send_file, url_for
 from .AppConfig import *
 import re
+import os
+import time
+import hashlib
+from datetime import datetime, timezone
 from .Pipeline import stream_pipeline
 
 
@@ -8,31 +12,56 @@ from .Pipeline import stream_pipeline
 main = Blueprint('main', __name__)
 
 
+def requested_resolution() -> tuple[int, int] | None:
+
+    ''' Parse an optional output resolution from the width and height query parameters. '''
+
+    width, height = request.args.get('width', type=int), request.args.get('height', type=int)
+
+    if not width or not height or width <= 0 or height <= 0:
+        return None
+
+    return (width, height)
+
+
 @main.route('/video_stream')
 def video_stream():
 
     ''' Route leveraging a generator function to stream captured video frames to the client. '''
 
     return Response(
-        stream_pipeline.generate_frames(),
+        stream_pipeline.generate_frames(
+            quality=request.args.get('quality', 'stream'),
+            resolution=requested_resolution()
+        ),
         mimetype='multipart/x-mixed-replace; boundary=frame'
     )
 
 
+@main.route('/snapshot')
+def snapshot():
+
+    ''' Serve the most recently processed frame as a single JPEG, encoded once and shared with the stream. '''
+
+    jpeg_bytes = stream_pipeline.snapshot(
+        quality=request.args.get('quality', 'snapshot'),
+        resolution=requested_resolution()
+    )
+
+    if jpeg_bytes is None:
+        return jsonify({"status": "error", "message": "Stream is not yet available."}), 503
+
+    return Response(jpeg_bytes, mimetype='image/jpeg', headers={'Cache-Control': 'no-store'})
+
+
 @main.route('/')
 def index():
 
     ''' Render index page with stream availabilty status. '''
 
-    # Testing fake stream with test stream iteration.
-    try:
-        # Try to get the first frame
-        next(stream_pipeline.generate_frames())
-        stream_available = True  
-    except StopIteration:
-        # Otherwise camera loading?
-        stream_available = False
-  
+    # Check the shared processing loop has produced a frame rather than starting a stream of our own.
+    stream_available = stream_pipeline.stream_available()
+
     return render_template(
         'index.html',
         stream_available=stream_available
@@ -44,6 +73,7 @@ def settings():
 
     ''' Render settings paeg with current camera configuration. '''
 
+    # Served from the in-memory snapshot, the settings file is only re-read should it have changed.
     settings = stream_pipeline.configuration_manager.load_settings()
 
     return render_template(
@@ -52,6 +82,14 @@ def settings():
     )
 
 
+@main.route('/api/status')
+def api_status():
+
+    ''' Report the pipelines measured costs, the motion engines per frame cost alongside the detection schedulers latencies and interval. '''
+
+    return jsonify({"status": "success", **stream_pipeline.statistics()})
+
+
 @main.route('/settings/update', methods=['POST'])
 def update_settings():
 
@@ -59,8 +97,8 @@ def update_settings():
 
     try:
         
-        # Load current settings configuration from JSON. (if present, otherwise default dictionary loaded).
-        current_settings = stream_pipeline.camera.settings
+        # Values submitted by the user, merged into the current settings once all have been parsed.
+        updated_values = {}
 
         # Iterate over items and their values.
         for key, updated_value in request.form.items():
@@ -71,11 +109,14 @@ def update_settings():
             # Build the updated settings dictionary from users form input. 
             updated_settings = stream_pipeline.configuration_manager.build_dictionary(keys=keys, value=updated_value)
 
-            # Merge new dictionary and its updatred with the current settings.
-            current_settings = stream_pipeline.configuration_manager.recursive_update(settings=current_settings, updated_values=updated_settings)
+            # Merge new dictionary and its updatred with the other submitted values.
+            updated_values = stream_pipeline.configuration_manager.recursive_update(settings=updated_values, updated_values=updated_settings)
         
-        # Save the settings with the freshly updated values. 
-        stream_pipeline.configuration_manager.save_settings(current_settings)
+        # Save the settings with the freshly updated values, atomically replacing the settings file. 
+        error = stream_pipeline.configuration_manager.update_settings(updated_values)
+
+        if error is not None:
+            return jsonify({"status": "error", "message": error})
 
         # Return JSON success response. 
         return jsonify({"status": "success", "message": "Settings updated successfully"})
@@ -86,13 +127,229 @@ def update_settings():
         return jsonify({"status": "error", "message": f"Failed to update settings!\n{e}"})
 
 
+def parse_timestamp(value : str | None) -> float | None:
+
+    ''' Parse an optional query parameter given as epoch seconds or an ISO 8601 date / datetime. '''
+
+    if not value:
+        return None
+
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
 @main.route('/captures')
 def captures():
 
-    ''' Render captures page with a list of images stored on the device. '''
+    ''' Render the captures page, the list itself is loaded a page at a time from the captures API. '''
+
+    selected = request.args.get('capture')
+    selected_segment = request.args.get('segment')
+
+    # User selected recording, dated for display as captures are.
+    segment = stream_pipeline.segment_recorder.index.find(selected_segment) if selected_segment else None
+
+    if segment is not None:
+        segment['filename'] = os.path.basename(segment['path'])
+        segment['recorded_at'] = time.strftime(f'%a-%d-%b-%Y {FORMATTED_DISPLAY_DATE}', time.localtime(segment['started_at']))
 
     return render_template(
         'captures.html',
-        images=[], # Accumulate list of images on device
-        image=None # USer selected image.
+        image=stream_pipeline.capture_index.get(selected) if selected else None, # User selected image.
+        segment=segment,
+        offset=max(request.args.get('t', 0, type=float), 0), # Seconds into the recording to seek to.
+        order='oldest' if request.args.get('order') == 'oldest' else 'newest'
+    )
+
+
+def segment_payload(segment : dict, offset : float) -> dict:
+
+    ''' What the captures page needs to play a recorded segment from the given offset. '''
+
+    filename = os.path.basename(segment['path'])
+
+    return {
+        'segment' : filename,
+        'offset' : round(offset, 2),
+        'started_at' : segment['started_at'],
+        'duration' : segment['duration'],
+        'complete' : segment['complete'],
+        'url' : url_for('main.segment_file', filename=filename),
+        'page' : url_for('main.captures', segment=filename, t=round(offset, 2))
+    }
+
+
+@main.route('/api/segments')
+def api_segments():
+
+    '''
+        Locate continuously recorded footage from the segment index, a lookup rather than a search through the recordings.
+
+        Query parameters: at (epoch seconds or an ISO date) returns the segment and offset holding that moment, otherwise
+            the events which began between start and end (the last 24 hours by default) are returned, each alongside the
+            segment and offset it can be seeked to.
+    '''
+
+    index = stream_pipeline.segment_recorder.index
+
+    try:
+        at = parse_timestamp(request.args.get('at'))
+        end = parse_timestamp(request.args.get('end')) or time.time()
+        start = parse_timestamp(request.args.get('start')) or end - 24 * 60 * 60
+
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    if at is not None:
+
+        located = index.lookup(at)
+        segment = index.find(os.path.basename(located[0])) if located is not None else None
+
+        if segment is None:
+            return jsonify({"status": "error", "message": "No recording covers that time."}), 404
+
+        return jsonify({"status": "success", **segment_payload(segment, located[1])})
+
+    events = []
+
+    for event in index.events_between(start, end):
+
+        segment = index.find(os.path.basename(event['segment']))
+
+        # Segment evicted since the event was read.
+        if segment is None:
+            continue
+
+        events.append({
+            'started_at' : event['started_at'],
+            'end_offset' : event['end_offset'],
+            'track_IDs' : event['track_IDs'],
+            'max_threat' : event['max_threat'],
+            **segment_payload(segment, event['start_offset'])
+        })
+
+    return jsonify({"status": "success", "events": events})
+
+
+@main.route('/segments/file/<filename>')
+def segment_file(filename):
+
+    ''' Serve a completed recording segment, honouring range requests so playback can seek straight to an event. '''
+
+    segment = stream_pipeline.segment_recorder.index.find(filename)
+
+    if segment is None or not os.path.exists(segment['path']):
+        return jsonify({"status": "error", "message": "Recording not found."}), 404
+
+    # The writer has yet to finalise the file, it cannot be played until it has.
+    if not segment['complete']:
+        return jsonify({"status": "error", "message": "Recording is still in progress."}), 409
+
+    return send_file(os.path.abspath(segment['path']), mimetype='video/mp4', conditional=True, max_age=3600)
+
+
+@main.route('/api/captures')
+def api_captures():
+
+    '''
+        Page through the captures stored on the device, newest first by default, served from the capture index.
+
+        Query parameters: cursor (from the previous page), limit (max 200), order (newest / oldest), since and until (epoch
+            seconds or ISO dates), kind (still / clip), incident, min_threat and search (a filename substring).
+    '''
+
+    try:
+
+        filters = {
+            'kind' : request.args.get('kind') or None,
+            'incident_ID' : request.args.get('incident', type=int),
+            'min_threat' : request.args.get('min_threat', type=int),
+            'since' : parse_timestamp(request.args.get('since')),
+            'until' : parse_timestamp(request.args.get('until')),
+            'search' : request.args.get('search') or None
+        }
+
+        records, next_cursor = stream_pipeline.capture_index.page(
+            cursor=request.args.get('cursor') or None,
+            limit=min(max(request.args.get('limit', 50, type=int), 1), 200),
+            descending=request.args.get('order', 'newest') != 'oldest',
+            **filters
+        )
+
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    # Only what the gallery needs to render a tile.
+    captures = [
+        {
+            'name' : record['name'],
+            'filename' : record['filename'],
+            'kind' : record['kind'],
+            'captured_at' : record['captured_at'],
+            'capture_date' : record['capture_date'],
+            'capture_time' : record['capture_time'],
+            'size' : record['size'],
+            'incident_ID' : record['incident_ID'],
+            'max_threat' : record['max_threat'],
+            'thumbnail' : url_for('main.capture_thumbnail', filename=record['name']),
+            'url' : url_for('main.capture_file', filename=record['name'])
+        }
+        for record in records
+    ]
+
+    return jsonify({"status": "success", "captures": captures, "next_cursor": next_cursor})
+
+
+@main.route('/captures/thumbnail/<filename>')
+def capture_thumbnail(filename):
+
+    ''' Serve the cached thumbnail of a capture, or its animated preview should the preview variant be requested. '''
+
+    capture = stream_pipeline.capture_index.get(filename)
+
+    if capture is None:
+        return jsonify({"status": "error", "message": "Capture not found."}), 404
+
+    path = stream_pipeline.thumbnail_cache.fetch(capture, variant=request.args.get('variant', 'thumbnail'))
+
+    if path is None:
+        return jsonify({"status": "error", "message": "Thumbnail unavailable."}), 404
+
+    # Thumbnails only change should the capture itself be replaced, let the browser hold on to them.
+    return send_file(os.path.abspath(path), max_age=86400)
+
+
+@main.route('/captures/file/<filename>')
+def capture_file(filename):
+
+    '''
+        Serve a stored still or clip from the capture index. Range requests are honoured so clips can be seeked without
+            downloading them whole, validators come from the index rather than the file and, as captures never change once
+            written, browsers may cache them indefinitely. With USE_X_SENDFILE set the transfer is handed to the front end
+            server entirely, otherwise the WSGI server's file wrapper streams it (sendfile where supported).
+    '''
+
+    capture = stream_pipeline.capture_index.get(filename)
+
+    if capture is None or not os.path.exists(capture['path']):
+        return jsonify({"status": "error", "message": "Capture not found."}), 404
+
+    # Strong validator derived from the indexed capture, a replaced capture is re-indexed with a new size or time.
+    etag = hashlib.blake2b(f'{capture["path"]}:{capture["size"]}:{capture["captured_at"]}'.encode(), digest_size=16).hexdigest()
+
+    response = send_file(
+        os.path.abspath(capture['path']),
+        as_attachment=request.args.get('download', type=int) == 1,
+        download_name=capture['name'],
+        conditional=True,
+        etag=etag,
+        last_modified=datetime.fromtimestamp(capture['captured_at'], tz=timezone.utc),
+        max_age=31536000
     )
+
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+
+    return response
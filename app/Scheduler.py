@@ -0,0 +1,140 @@
+from contextlib import contextmanager
+import time
+
+
+class DetectionScheduler(object):
+
+    '''
+        Decides which frames the processing loop runs the full detection path on. Detection runs on every frame whilst tracks
+            are active, drops to every Nth frame whilst the scene is idle and backs off further whenever the measured per frame
+            latency exceeds the cameras frame budget, keeping stream latency bounded on the Pi rather than letting it grow.
+    '''
+
+    def __init__(self, target_fps : float, idle_interval : int = 5, maximum_interval : int = 10, headroom : float = 0.9, smoothing : float = 0.2) -> None:
+
+        '''
+            Initialise the detection scheduler.
+
+            Paramaters:
+                * target_fps (float) : Framerate the loop should keep pace with, typically the cameras fps.
+                * idle_interval (int) : Run detection every Nth frame whilst no tracks are active.
+                * maximum_interval (int) : Upper bound on the interval when backing off under load.
+                * headroom (float) : Fraction of the frame budget the loop may use before backing off.
+                * smoothing (float) : Weight given to the newest sample within each stages rolling average latency.
+        '''
+
+        # Seconds available to process each frame.
+        self.frame_budget = 1 / max(float(target_fps), 1.0)
+
+        self.idle_interval = max(int(idle_interval), 1)
+        self.maximum_interval = max(int(maximum_interval), self.idle_interval)
+        self.headroom = headroom
+        self.smoothing = smoothing
+
+        # Rolling average latency in seconds of each measured stage.
+        self.stage_latency : dict[str, float] = {}
+
+        # Additional interval imposed whilst the loop cannot keep up.
+        self.load_interval : int = 1
+
+        # Sequence number of the last frame detection ran on.
+        self.last_detected_sequence : int = -1
+
+        # Frames selected for and skipped by detection.
+        self.frames_detected : int = 0
+        self.frames_skipped : int = 0
+
+
+    def set_target_fps(self, target_fps : float) -> None:
+
+        ''' Update the frame budget, e.g. after the capture profile changes. '''
+
+        self.frame_budget = 1 / max(float(target_fps), 1.0)
+
+
+    def record(self, stage : str, seconds : float) -> None:
+
+        ''' Fold a stages latency sample into its rolling average. '''
+
+        previous = self.stage_latency.get(stage)
+        self.stage_latency[stage] = seconds if previous is None else (1 - self.smoothing) * previous + self.smoothing * seconds
+
+
+    @contextmanager
+    def measure(self, stage : str):
+
+        ''' Context manager timing the enclosed block as the given stage. '''
+
+        started_at = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - started_at)
+
+
+    def frame_processed(self) -> None:
+
+        '''
+            Adjust the load interval once a frame has been processed. The interval grows by one whilst the average frame
+                latency exceeds the budget and relaxes again once there is comfortable slack.
+        '''
+
+        frame_latency = self.stage_latency.get('frame')
+
+        if frame_latency is None:
+            return
+
+        if frame_latency > self.frame_budget * self.headroom:
+            self.load_interval = min(self.load_interval + 1, self.maximum_interval)
+
+        elif frame_latency < self.frame_budget * self.headroom * 0.5:
+            self.load_interval = max(self.load_interval - 1, 1)
+
+
+    @property
+    def interval(self) -> int:
+
+        ''' Interval detection currently runs at whilst tracks are active. '''
+
+        return self.load_interval
+
+
+    def should_detect(self, sequence : int, tracks_active : bool) -> bool:
+
+        '''
+            Decide whether detection should run on the given frame.
+
+            Paramaters:
+                * sequence (int) : Capture sequence number of the frame.
+                * tracks_active (bool) : Whether the tracker currently holds any tracks.
+
+            Returns:
+                * (bool) : True if the full detection path should run.
+        '''
+
+        interval = self.load_interval if tracks_active else max(self.load_interval, self.idle_interval)
+
+        # Measured in capture sequence numbers so frames dropped upstream count towards the interval.
+        if self.last_detected_sequence < 0 or sequence - self.last_detected_sequence >= interval:
+            self.last_detected_sequence = sequence
+            self.frames_detected += 1
+            return True
+
+        self.frames_skipped += 1
+
+        return False
+
+
+    def statistics(self) -> dict:
+
+        ''' Report stage latencies in milliseconds alongside the current scheduling state. '''
+
+        return {
+            'stage_latency_ms' : {stage : round(seconds * 1000, 3) for stage, seconds in self.stage_latency.items()},
+            'frame_budget_ms' : round(self.frame_budget * 1000, 3),
+            'load_interval' : self.load_interval,
+            'idle_interval' : self.idle_interval,
+            'frames_detected' : self.frames_detected,
+            'frames_skipped' : self.frames_skipped
+        }
@@ -0,0 +1,344 @@
+from collections import deque, OrderedDict
+import threading
+import numpy as np
+import cv2
+
+
+def resolve_jpeg_quality(quality : int | str | None, profiles : dict, default : str = 'stream') -> int:
+
+    '''
+        Resolve a consumers requested JPEG quality, either a named profile or an integer, into a value OpenCV accepts.
+
+        Paramaters:
+            * quality (int | str | None) : Profile name such as 'remote' or 'evidence', or a raw quality between 1 and 100.
+            * profiles (dict) : Mapping of profile names to JPEG qualities.
+            * default (str) : Profile used should the requested quality be missing or unrecognised.
+
+        Returns:
+            * (int) : JPEG quality clamped between 1 and 100.
+    '''
+
+    if isinstance(quality, str) and quality.isdigit():
+        quality = int(quality)
+
+    if isinstance(quality, str):
+        quality = profiles.get(quality)
+
+    if quality is None:
+        quality = profiles.get(default, 80)
+
+    return max(1, min(int(quality), 100))
+
+
+class StreamSubscriber(object):
+
+    '''
+        A single viewer of the broadcast stream. Each subscriber owns a small bounded queue, once full the oldest packet is
+            discarded in favour of the newest so a slow client only ever falls behind itself, never the producer or other viewers.
+    '''
+
+    def __init__(self, max_queue : int = 2) -> None:
+
+        '''
+            Initialise a stream subscriber.
+
+            Paramaters:
+                * max_queue (int) : Maximum number of packets held before the oldest is dropped.
+        '''
+
+        # Bounded queue of pending packets, deque drops from the opposite end once maxlen is reached.
+        self.queue = deque(maxlen=max(int(max_queue), 1))
+
+        # Condition used to wake the subscriber when a packet arrives.
+        self.condition = threading.Condition()
+
+        # Number of packets discarded because the subscriber was not keeping up.
+        self.dropped = 0
+
+        # Set once the subscriber has disconnected or the broadcaster has shut down.
+        self.closed = False
+
+
+    def push(self, packet : tuple) -> None:
+
+        ''' Enqueue a packet, dropping the oldest pending one when the queue is full. '''
+
+        with self.condition:
+
+            if len(self.queue) == self.queue.maxlen:
+                self.dropped += 1
+
+            self.queue.append(packet)
+            self.condition.notify()
+
+
+    def get(self, timeout : float | None = 1.0) -> tuple | None:
+
+        '''
+            Wait for the next packet.
+
+            Paramaters:
+                * timeout (float | None) : Maximum number of seconds to wait.
+
+            Returns:
+                * packet (tuple | None) : Oldest pending packet, None if the wait timed out or the subscriber was closed.
+        '''
+
+        with self.condition:
+
+            self.condition.wait_for(lambda: self.queue or self.closed, timeout=timeout)
+
+            if not self.queue:
+                return None
+
+            return self.queue.popleft()
+
+
+    def close(self) -> None:
+
+        ''' Mark the subscriber closed, waking it should it be waiting on a packet. '''
+
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+class FrameBroadcaster(object):
+
+    '''
+        Fan out hub sitting between the single processing loop and however many clients are viewing the stream. The producer
+            publishes each processed frame exactly once and every subscriber receives it through its own bounded queue.
+    '''
+
+    def __init__(self, max_queue : int = 2) -> None:
+
+        '''
+            Initialise the broadcaster.
+
+            Paramaters:
+                * max_queue (int) : Default queue length handed to new subscribers.
+        '''
+
+        # Default queue length for subscribers.
+        self.max_queue = max_queue
+
+        # Currently connected subscribers.
+        self.subscribers : set[StreamSubscriber] = set()
+
+        # Most recently published packet, handed to new subscribers so they have something to render immediately.
+        self.latest = None
+
+        # Guards the subscriber set and latest packet, condition allows waiting on the first published packet.
+        self.condition = threading.Condition()
+
+
+    def subscribe(self, max_queue : int | None = None) -> StreamSubscriber:
+
+        ''' Register a new subscriber, primed with the latest packet if one exists. '''
+
+        subscriber = StreamSubscriber(max_queue=max_queue or self.max_queue)
+
+        with self.condition:
+
+            if self.latest is not None:
+                subscriber.push(self.latest)
+
+            self.subscribers.add(subscriber)
+
+        return subscriber
+
+
+    def unsubscribe(self, subscriber : StreamSubscriber) -> None:
+
+        ''' Remove a subscriber from the broadcast. '''
+
+        with self.condition:
+            self.subscribers.discard(subscriber)
+
+        subscriber.close()
+
+
+    def publish(self, sequence : int, payload) -> None:
+
+        '''
+            Deliver a processed frame to every subscriber.
+
+            Paramaters:
+                * sequence (int) : Capture sequence number of the frame.
+                * payload : Data to be delivered to the subscribers.
+        '''
+
+        packet = (sequence, payload)
+
+        with self.condition:
+            self.latest = packet
+            subscribers = list(self.subscribers)
+            self.condition.notify_all()
+
+        for subscriber in subscribers:
+            subscriber.push(packet)
+
+
+    def wait_for_packet(self, timeout : float | None = None) -> bool:
+
+        ''' Block until at least one packet has been published, returning whether one is available. '''
+
+        with self.condition:
+            return self.condition.wait_for(lambda: self.latest is not None, timeout=timeout)
+
+
+    @property
+    def subscriber_count(self) -> int:
+
+        ''' Number of currently connected subscribers. '''
+
+        with self.condition:
+            return len(self.subscribers)
+
+
+    def close(self) -> None:
+
+        ''' Disconnect every subscriber. '''
+
+        with self.condition:
+            subscribers = list(self.subscribers)
+            self.subscribers.clear()
+
+        for subscriber in subscribers:
+            subscriber.close()
+
+
+class EncodedFrameCache(object):
+
+    '''
+        Cache of JPEG encodings for the most recently processed frames, keyed by (frame sequence number, quality, resolution).
+            The stream, snapshots, alert attachments and still captures all request their encodings from here, so any given frame
+            is only ever encoded once per quality and resolution no matter how many consumers ask for it.
+    '''
+
+    def __init__(self, max_frames : int = 4) -> None:
+
+        '''
+            Initialise the encoded frame cache.
+
+            Paramaters:
+                * max_frames (int) : Number of recent frames (and their encodings) retained before the oldest is evicted.
+        '''
+
+        # Maximum number of frames retained.
+        self.max_frames = max(int(max_frames), 1)
+
+        # Processed frames awaiting encoding, keyed by sequence number in insertion order.
+        self.frames : OrderedDict[int, np.ndarray] = OrderedDict()
+
+        # Encoded frames keyed by (sequence, quality, resolution).
+        self.encodings : dict[tuple, bytes] = {}
+
+        # Per key locks so concurrent requests for the same encoding wait on the first rather than encoding again.
+        self.key_locks : dict[tuple, threading.Lock] = {}
+
+        # Guards the dictionaries above.
+        self.lock = threading.Lock()
+
+        # Sequence number of the most recently stored frame.
+        self.latest_sequence = -1
+
+        # Count of encodes performed versus served from cache.
+        self.encodes = 0
+        self.hits = 0
+
+
+    def store_frame(self, sequence : int, frame : np.ndarray) -> None:
+
+        '''
+            Register a processed frame as available for encoding. The cache keeps a reference rather than a copy, the caller
+                must not modify the frame afterwards.
+
+            Paramaters:
+                * sequence (int) : Capture sequence number of the frame.
+                * frame (np.ndarray) : Processed (annotated) frame.
+        '''
+
+        with self.lock:
+
+            self.frames[sequence] = frame
+            self.latest_sequence = max(self.latest_sequence, sequence)
+
+            # Evict the oldest frames along with every encoding made from them.
+            while len(self.frames) > self.max_frames:
+                evicted_sequence, _ = self.frames.popitem(last=False)
+
+                for key in [key for key in self.encodings if key[0] == evicted_sequence]:
+                    del self.encodings[key]
+
+                for key in [key for key in self.key_locks if key[0] == evicted_sequence]:
+                    del self.key_locks[key]
+
+
+    def encode(self, sequence : int, quality : int = 80, resolution : tuple[int, int] | None = None) -> bytes | None:
+
+        '''
+            Fetch the JPEG encoding of a stored frame, encoding it on first request.
+
+            Paramaters:
+                * sequence (int) : Capture sequence number of the frame.
+                * quality (int) : JPEG quality between 1 and 100.
+                * resolution (tuple[int, int] | None) : Output (width, height), None to keep the frames native resolution.
+
+            Returns:
+                * (bytes | None) : Encoded JPEG, None if the frame has already been evicted or encoding failed.
+        '''
+
+        key = (sequence, int(quality), tuple(resolution) if resolution else None)
+
+        with self.lock:
+
+            # Serve straight from cache where possible.
+            if key in self.encodings:
+                self.hits += 1
+                return self.encodings[key]
+
+            frame = self.frames.get(sequence)
+
+            if frame is None:
+                return None
+
+            key_lock = self.key_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+
+            # Another consumer may have finished encoding whilst we waited on the key lock.
+            with self.lock:
+                if key in self.encodings:
+                    self.hits += 1
+                    return self.encodings[key]
+
+            # Downscale for consumers requesting a smaller resolution.
+            if key[2] is not None and key[2] != (frame.shape[1], frame.shape[0]):
+                frame = cv2.resize(frame, key[2], interpolation=cv2.INTER_AREA)
+
+            success, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, key[1]])
+
+            if not success:
+                return None
+
+            encoded = buffer.tobytes()
+
+            with self.lock:
+
+                # Only retain the encoding if its frame has not been evicted in the meantime.
+                if sequence in self.frames:
+                    self.encodings[key] = encoded
+
+                self.encodes += 1
+
+            return encoded
+
+
+    def encode_latest(self, quality : int = 80, resolution : tuple[int, int] | None = None) -> tuple[int, bytes | None]:
+
+        ''' Encode the most recently stored frame, returning its sequence number alongside the JPEG. '''
+
+        sequence = self.latest_sequence
+
+        return sequence, self.encode(sequence, quality=quality, resolution=resolution)
@@ -1,4 +1,150 @@
 import time
+import numpy as np
+
+
+class TrajectoryBuffer(object):
+
+    '''
+        Fixed capacity ring buffer of a tracks center points. Once full the oldest point is overwritten, so a detection that
+            lingers in view for hours holds no more memory than one seen for a few seconds.
+    '''
+
+    __slots__ = ('points', 'head', 'count')
+
+    def __init__(self, capacity : int = 64) -> None:
+
+        '''
+            Paramaters:
+                * capacity (int) : Maximum number of center points retained.
+        '''
+
+        # Preallocated (capacity, 2) array of center points.
+        self.points = np.zeros((max(int(capacity), 1), 2), dtype=np.int32)
+
+        # Index the next point will be written to.
+        self.head = 0
+
+        # Number of points currently held.
+        self.count = 0
+
+
+    def append(self, point : tuple[int, int]) -> None:
+
+        ''' Record a center point, overwriting the oldest once at capacity. '''
+
+        self.points[self.head] = point
+        self.head = (self.head + 1) % len(self.points)
+        self.count = min(self.count + 1, len(self.points))
+
+
+    def last(self) -> tuple[int, int]:
+
+        ''' Most recently recorded center point. '''
+
+        x, y = self.points[self.head - 1]
+
+        return int(x), int(y)
+
+
+    def to_list(self) -> list[tuple[int, int]]:
+
+        ''' Center points ordered oldest to newest. '''
+
+        ordered = np.roll(self.points, -self.head, axis=0)[len(self.points) - self.count:]
+
+        return [(int(x), int(y)) for x, y in ordered]
+
+
+    def __len__(self) -> int:
+        return self.count
+
+
+class TrackRecord(object):
+
+    '''
+        Compact record of a single tracked detection. Slots keep the per track footprint fixed, whilst dictionary style access
+            (get, []) lets the record be handed straight to annotation and capture triggers expecting detection dictionaries.
+    '''
+
+    __slots__ = ('ID', 'x1', 'y1', 'x2', 'y2', 'trajectory', 'first_seen', 'last_seen', 'threat_level', 'velocity_x', 'velocity_y')
+
+    def __init__(self, ID : int, bbox : tuple[int, int, int, int], center_point : tuple[int, int], initial_time : float, trajectory_length : int) -> None:
+
+        '''
+            Paramaters:
+                * ID (int) : Unique track ID.
+                * bbox (tuple[int, int, int, int]) : Bounding box as (x1, y1, x2, y2).
+                * center_point (tuple[int, int]) : Initial center point.
+                * initial_time (float) : Time the track was registered.
+                * trajectory_length (int) : Capacity of the tracks trajectory ring buffer.
+        '''
+
+        self.ID = ID
+        self.x1, self.y1, self.x2, self.y2 = bbox
+        self.trajectory = TrajectoryBuffer(trajectory_length)
+        self.trajectory.append(center_point)
+        self.first_seen = initial_time
+        self.last_seen = initial_time
+        self.threat_level = 0
+
+        # Smoothed center point velocity in pixels per second, unknown until the track is observed a second time.
+        self.velocity_x = 0.0
+        self.velocity_y = 0.0
+
+
+    def predict(self, at_time : float) -> tuple[float, float]:
+
+        ''' Constant velocity estimate of the tracks center point at the given time. '''
+
+        x, y = self.trajectory.last()
+        elapsed = max(at_time - self.last_seen, 0.0)
+
+        return x + self.velocity_x * elapsed, y + self.velocity_y * elapsed
+
+
+    def __getitem__(self, key : str):
+
+        ''' Dictionary style access, the trajectory is exposed under its original center_point_trajectory key. '''
+
+        if key == 'center_point_trajectory':
+            return self.trajectory.to_list()
+
+        if key not in self.__slots__:
+            raise KeyError(key)
+
+        return getattr(self, key)
+
+
+    def get(self, key : str, default=None):
+
+        ''' Dictionary style access returning a default for unknown keys. '''
+
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+
+    def as_dict(self) -> dict:
+
+        ''' Plain dictionary copy of the record, e.g. for serialisation. '''
+
+        return {
+            'ID' : self.ID,
+            'x1' : self.x1,
+            'y1' : self.y1,
+            'x2' : self.x2,
+            'y2' : self.y2,
+            'center_point_trajectory' : self.trajectory.to_list(),
+            'first_seen' : self.first_seen,
+            'last_seen' : self.last_seen,
+            'threat_level' : self.threat_level,
+            'velocity' : (self.velocity_x, self.velocity_y)
+        }
+
+
+    def __repr__(self) -> str:
+        return f'TrackRecord(ID={self.ID}, bbox=({self.x1}, {self.y1}, {self.x2}, {self.y2}), threat_level={self.threat_level})'
 
 
 class ObjectTracking(object):
@@ -10,7 +156,8 @@ class ObjectTracking(object):
     '''
 
 
-    def __init__(self, EUCLIDEAN_DISTANCE_THRESHOLD : int = 125, MAXIMUM_THREAT_LEVEL : int = 3, DEREGISTRATION_TIME : int = 10, ESCALATION_TIME : int = 10) -> None:
+    def __init__(self, EUCLIDEAN_DISTANCE_THRESHOLD : int = 125, MAXIMUM_THREAT_LEVEL : int = 3, DEREGISTRATION_TIME : int = 10, ESCALATION_TIME : int = 10, TRAJECTORY_LENGTH : int = 64,
+                 PREDICTION : bool = False, GATE_GROWTH_RATE : float = 250, MAXIMUM_GATE : float = 500, VELOCITY_SMOOTHING : float = 0.5) -> None:
         
         '''
             Instantiate Object tracking module.
@@ -20,10 +167,18 @@ class ObjectTracking(object):
                 * MAXIMUM_THREAT_LEVEL (int) : Maximum threshold before a detection is considered a threat.
                 * DEREGISTRATION_TIME (int) : Time taken in seconds before a detection is pruned to free up resources. 
                 * ESCALATION_TIME (int) : Time taken in seconds for a detection to be present before its threat level is escalated.  
+                * TRAJECTORY_LENGTH (int) : Number of most recent center points retained per track.
+                * PREDICTION (bool) : Match detections against each tracks constant velocity predicted position rather than its last position.
+                * GATE_GROWTH_RATE (float) : Pixels per second the matching radius grows by whilst a track goes unobserved, prediction only.
+                * MAXIMUM_GATE (float) : Upper bound on the matching radius in pixels, prediction only.
+                * VELOCITY_SMOOTHING (float) : Weight given to the newest velocity measurement, prediction only.
         '''
         
-        # dictionary to hold detections data which can be used for IDs, bounding boxes and center points. 
-        self.detections = {}
+        # Track records keyed by ID holding bounding boxes, timings, threat levels and bounded center point trajectories.
+        self.detections : dict[int, TrackRecord] = {}
+
+        # Capacity of each tracks trajectory ring buffer.
+        self.TRAJECTORY_LENGTH = TRAJECTORY_LENGTH
 
         # Assign unique ID values to each detection.
         self.ID_increment_counter : int = 0
@@ -40,44 +195,75 @@ class ObjectTracking(object):
         # Time taken to escalate a detections threat level. 
         self.ESCALATION_TIME = ESCALATION_TIME
 
+        ''' Motion prediction. '''
+
+        # Whether matching is gated against predicted rather than last observed positions.
+        self.PREDICTION = PREDICTION
+
+        # Base matching radius in pixels, widened with time since a track was last observed.
+        self.GATE_RADIUS = EUCLIDEAN_DISTANCE_THRESHOLD
+        self.GATE_GROWTH_RATE = GATE_GROWTH_RATE
+        self.MAXIMUM_GATE = max(MAXIMUM_GATE, EUCLIDEAN_DISTANCE_THRESHOLD)
+
+        # Exponential smoothing applied to velocity estimates.
+        self.VELOCITY_SMOOTHING = VELOCITY_SMOOTHING
+
+
+    def configure(self, MAXIMUM_THREAT_LEVEL : int | None = None, ESCALATION_TIME : int | None = None, PREDICTION : bool | None = None) -> None:
+
+        ''' Apply new thresholds in place, active tracks keep their IDs, trajectories and threat levels. '''
+
+        if MAXIMUM_THREAT_LEVEL is not None:
+            self.MAXIMUM_THREAT_LEVEL = MAXIMUM_THREAT_LEVEL
+
+        if ESCALATION_TIME is not None:
+            self.ESCALATION_TIME = ESCALATION_TIME
+
+        if PREDICTION is not None:
+            self.PREDICTION = PREDICTION
+
     
-    def update_tracker(self, detections : list[dict]) -> list[dict]:
+    def update_tracker(self, detections : list[dict]) -> list[TrackRecord]:
         
         '''
-            Update the tracking module by iterating over each detection, comparing center points with prior detections,
-                determining whether to treat is as either new or pre-existing.
+            Update the tracking module by matching every detection in the frame against every active track at once, assigning
+                each detection to at most one track and each track to at most one detection. Unmatched detections are
+                registered as new tracks.
 
             Paramaters:
                 * detections (list[dict]) : list of detection metadata dicitonaries.
             Returns:
-                * detections (list[dict]) : list of parsed detection metadata dictionaries. 
+                * detections (list[TrackRecord]) : list of active track records, accessible like detection dictionaries.
         '''
 
         # Initial time detection was registered. 
         processed_at : float = time.time()
 
-        # If none present, return early. 
+        # If none present, prune outdated tracks and return early. 
         if len(detections) == 0:
-            return self.detections
-
-        # Iterate over detections parameterised. 
-        for detection in detections:
-            
-            # Check if detection center point matches prior, return ID if so.
-            matched_detection_ID = self.match_center_points(detection)
-
-            if matched_detection_ID:
-                # If ID returned matches, update current detection.
-                self.update_detections(matched_detection_ID, detection, processed_at)
-            else :
-                # Otherwise, register new one.
-                self.register_detection(detection, processed_at)
+            self.prune_old_detections(processed_at)
+            return list(self.detections.values())
+
+        # Bounding boxes and center points of every detection in the frame, shape (M, 4) and (M, 2).
+        bboxes = np.array([[detection['x1'], detection['y1'], detection['x2'], detection['y2']] for detection in detections], dtype=np.int64)
+        center_points = (bboxes[:, :2] + bboxes[:, 2:]) // 2
+
+        # Match against active tracks, yielding (detection index, track ID) pairs.
+        matches, unmatched = self.match_center_points(center_points, processed_at)
+
+        # Apply every matched update together.
+        if matches:
+            self.update_detections(matches, bboxes, center_points, processed_at)
+
+        # Otherwise, register new ones.
+        for index in unmatched:
+            self.register_detection(detections[index], processed_at)
         
         # Check detections list, prune outdated.
         self.prune_old_detections(processed_at) 
 
         # Return parsed detections.
-        return self.detections
+        return list(self.detections.values())
        
 
     def register_detection(self, detection : dict, intial_time : float) -> None:
@@ -94,78 +280,135 @@ class ObjectTracking(object):
         center_point = self.calculate_center_point(detection)
 
         # Append entry to detections. 
-        self.detections[self.ID_increment_counter] = {
-            'ID' : self.ID_increment_counter,
-            'center_point_trajectory' : [center_point],
-            'first_seen' : intial_time,
-            'last_seen' : intial_time,
-            'threat_level' : 0
-        }
+        self.detections[self.ID_increment_counter] = TrackRecord(
+            ID=self.ID_increment_counter,
+            bbox=(int(detection['x1']), int(detection['y1']), int(detection['x2']), int(detection['y2'])),
+            center_point=center_point,
+            initial_time=intial_time,
+            trajectory_length=self.TRAJECTORY_LENGTH
+        )
         
         # Increment ID counter for next detection.
         self.ID_increment_counter += 1
 
     
-    def match_center_points(self, detection : dict) -> int | None:
+    def match_center_points(self, center_points : np.ndarray, processed_at : float) -> tuple[list[tuple[int, int]], list[int]]:
 
         '''
-            Compare previous and current center point values, if distance between is within the 
-                threshold paramaters, return ID proving they are the same.
-                Otherwise, return None as they are separate detections, handle accordingly.
+            Compute the squared distance between every new center point and every tracks most recent center point in a single
+                NumPy operation, then assign pairs one to one in order of increasing distance. Pairs further apart than the
+                threshold are never matched.
+
+            With prediction enabled, distances are measured to where each track is expected to be by now given its velocity,
+                and the threshold widens the longer a track has gone unobserved so skipped frames do not break identity.
 
             Paramaters:
-                * detection (dict) : Detection encapsulating its data as key value pairs.
+                * center_points (np.ndarray) : Center points of the frames detections, shape (M, 2).
+                * processed_at (float) : Time the detections were captured.
             Returns:
-                * ID (int) | None : Return ID integer value if within threshold parameters. Return None otherwise. 
+                * matches (list[tuple[int, int]]) : (detection index, track ID) pairs that are the SAME object.
+                * unmatched (list[int]) : Indexes of detections that match no track.
         ''' 
 
-        # Calculate detections current center point. 
-        current_center_point = self.calculate_center_point(detection)
+        # Nothing to match against, every detection is new.
+        if not self.detections:
+            return [], list(range(len(center_points)))
+
+        track_IDs = list(self.detections.keys())
+
+        records = list(self.detections.values())
+
+        if self.PREDICTION:
+
+            # Predicted center point of every track, shape (N, 2).
+            previous_center_points = np.array([record.predict(processed_at) for record in records], dtype=np.float64)
+
+            # Per track squared gate widening with time since last observed, shape (N,).
+            elapsed = processed_at - np.array([record.last_seen for record in records], dtype=np.float64)
+            gates = np.minimum(self.GATE_RADIUS + self.GATE_GROWTH_RATE * elapsed, self.MAXIMUM_GATE) ** 2
+
+        else:
+
+            # Most recent center point of every track, shape (N, 2).
+            previous_center_points = np.array([record.trajectory.last() for record in records], dtype=np.float64)
+            gates = np.full(len(records), self.EUCLIDEAN_DISTANCE_THRESHOLD, dtype=np.float64)
+
+        # Full (M, N) squared distance matrix.
+        differences = center_points[:, None, :] - previous_center_points[None, :, :]
+        euclidean_distances_squared = np.einsum('mnk,mnk->mn', differences, differences)
 
-        # Iterate over detection entries.
-        for ID, previous_detection in self.detections.items():
+        # Candidate pairs within each tracks gate, ordered closest first.
+        rows, columns = np.nonzero(euclidean_distances_squared < gates[None, :])
+        order = np.argsort(euclidean_distances_squared[rows, columns], kind='stable')
 
-            # Fetch previous center point (most recent within the list.)
-            previous_center_point = previous_detection['center_point_trajectory'][-1]
+        matches = []
+        assigned_detections, assigned_tracks = set(), set()
 
-            # Calculate distance between the pair.
-            euclidean_distance_squared = self.measure_euclidean_distance(current_center_point, previous_center_point)
+        # Greedily accept the closest remaining pair, never letting a detection or track be claimed twice.
+        for row, column in zip(rows[order].tolist(), columns[order].tolist()):
 
-            # If that distance falls within the set threshold.
-            if euclidean_distance_squared < self.EUCLIDEAN_DISTANCE_THRESHOLD:
-                # Return detections ID value, they are the SAME!
-                return ID
-            
-        # Return nothing, detection DO NOT match!
-        return None
+            if row in assigned_detections or column in assigned_tracks:
+                continue
 
+            assigned_detections.add(row)
+            assigned_tracks.add(column)
+            matches.append((row, track_IDs[column]))
 
-    def update_detections(self, detection_ID : int, detection : dict, processed_at : float) -> None:
+        unmatched = [index for index in range(len(center_points)) if index not in assigned_detections]
+
+        return matches, unmatched
+
+
+    def update_detections(self, matches : list[tuple[int, int]], bboxes : np.ndarray, center_points : np.ndarray, processed_at : float) -> None:
         
         '''
-            Update detections values if ID values are matched prior meaning that it is now of interest and
-                is being monitored.
+            Update every matched track in one pass, refreshing its bounding box, trajectory and last seen time and escalating
+                the threat level of those present for longer than the escalation timer.
 
             Paramaters:
-                * detection_ID (int) : Concerned detections ID value to fetch particular detection data for updates.
-                * detection (dict) : Detection data dictionary to access key value pairs. 
+                * matches (list[tuple[int, int]]) : (detection index, track ID) pairs.
+                * bboxes (np.ndarray) : Bounding boxes of the frames detections, shape (M, 4).
+                * center_points (np.ndarray) : Center points of the frames detections, shape (M, 2).
                 * processed_at (float) : Time that detection was being processed at.
             Returns:
                 * None
         '''
 
-        # Calculate detections current center point.
-        center_point = self.calculate_center_point(detection)
-        
-        # Append new center point entry to the center points trajectory list.
-        self.detections[detection_ID]['center_point_trajectory'].append(center_point)
+        indexes = [index for index, _ in matches]
+        track_IDs = [ID for _, ID in matches]
+
+        # Determine which tracks have exceeded the threat escalation timer in a single comparison.
+        first_seen = np.array([self.detections[ID].first_seen for ID in track_IDs])
+        escalate = ((processed_at - first_seen) > self.ESCALATION_TIME).tolist()
+
+        matched_bboxes = bboxes[indexes].tolist()
+        matched_center_points = center_points[indexes].tolist()
+
+        for ID, (x1, y1, x2, y2), center_point, escalated in zip(track_IDs, matched_bboxes, matched_center_points, escalate):
+
+            record = self.detections[ID]
+
+            # Refresh the tracks bounding box.
+            record.x1, record.y1, record.x2, record.y2 = x1, y1, x2, y2
+
+            # Fold the observed displacement into the tracks smoothed velocity estimate.
+            elapsed = processed_at - record.last_seen
+
+            if self.PREDICTION and elapsed > 0:
+                previous_x, previous_y = record.trajectory.last()
+                smoothing = self.VELOCITY_SMOOTHING if len(record.trajectory) > 1 else 1.0
+                record.velocity_x += smoothing * ((center_point[0] - previous_x) / elapsed - record.velocity_x)
+                record.velocity_y += smoothing * ((center_point[1] - previous_y) / elapsed - record.velocity_y)
+
+            # Append new center point to the bounded trajectory.
+            record.trajectory.append(center_point)
 
-        # Update last time detection was seen.
-        self.detections[detection_ID]['last_seen'] = processed_at
+            # Update last time detection was seen.
+            record.last_seen = processed_at
 
-        # Check detections current time exceeds the threat escalation timer before its level can be raised.
-        if processed_at - self.detections[detection_ID]['first_seen'] > self.ESCALATION_TIME:
-            self.detections[detection_ID]['threat_level'] += 1
+            # Raise threat level once the escalation timer has been exceeded.
+            if escalated:
+                record.threat_level += 1
 
 
     def prune_old_detections(self, processed_at : float) -> None:
@@ -180,13 +423,12 @@ class ObjectTracking(object):
         '''
         
         # Filter detections that exceed deregistration time.
-        stale_detections = [ID for ID, detection in self.detections.items() if (processed_at - detection['last_seen']) > self.DEREGISTRATION_TIME]
+        stale_detections = [ID for ID, record in self.detections.items() if (processed_at - record.last_seen) > self.DEREGISTRATION_TIME]
 
         # Iterate over ID values within the stale_detections list.
         for ID in stale_detections:
-            # Use ID values to delete detection entries.
+            # Use ID values to delete detection entries, IDs are never reused so live tracks cannot be overwritten.
             del self.detections[ID]
-            self.ID_increment_counter -= 1
 
     
     def calculate_center_point(self, detection):
@@ -0,0 +1,389 @@
+from collections import deque, OrderedDict
+import threading
+import itertools
+import time
+import numpy as np
+import cv2
+import os
+
+
+class CaptureJob(object):
+
+    '''
+        A single unit of work for the capture writer along with its completion status.
+    '''
+
+    __slots__ = ('ID', 'kind', 'path', 'payload', 'options', 'status', 'error', 'submitted_at', 'completed_at')
+
+    def __init__(self, ID : int, kind : str, path : str, payload=None, options : dict | None = None) -> None:
+
+        '''
+            Paramaters:
+                * ID (int) : Unique job ID.
+                * kind (str) : One of CaptureWriter.JOB_KINDS.
+                * path (str) : File the job writes to.
+                * payload : Job data, e.g. JPEG bytes, a frame or a list of encoded frames.
+                * options (dict | None) : Job specific settings.
+        '''
+
+        self.ID = ID
+        self.kind = kind
+        self.path = path
+        self.payload = payload
+        self.options = options or {}
+        self.status = 'queued'
+        self.error : str | None = None
+        self.submitted_at = time.time()
+        self.completed_at : float | None = None
+
+
+    def __repr__(self) -> str:
+        return f'CaptureJob(ID={self.ID}, kind={self.kind}, path={self.path}, status={self.status})'
+
+
+class CaptureWriter(object):
+
+    '''
+        Dedicated worker thread performing every capture related disk write, stills and incrementally recorded clips, so
+            encoding and SD card I/O never run on the stream loop. Jobs are queued on a bounded queue, once full further data
+            jobs are rejected and counted as backpressure rather than blocking the caller. Clip open and close messages are
+            always accepted so a clip can never be left half written. Gallery thumbnails are generated by the ThumbnailCache
+            on its own worker, so reading captures back never competes with clip frames for this queue.
+    '''
+
+    # Kinds of job the writer accepts.
+    JOB_KINDS = ('still', 'clip_open', 'clip_frames', 'clip_close')
+
+    # Kinds that are always accepted regardless of backlog.
+    CONTROL_KINDS = ('clip_open', 'clip_close')
+
+    def __init__(self, max_queue : int = 64, history : int = 256) -> None:
+
+        '''
+            Initialise the capture writer.
+
+            Paramaters:
+                * max_queue (int) : Maximum number of data jobs awaiting the worker before further submissions are rejected.
+                * history (int) : Number of finished jobs whose status is retained for lookups.
+        '''
+
+        self.max_queue = max(int(max_queue), 1)
+        self.history = max(int(history), 1)
+
+        # Pending jobs in submission order.
+        self.jobs : deque[CaptureJob] = deque()
+
+        # Number of pending data (non control) jobs.
+        self.pending_data_jobs : int = 0
+
+        # Recently submitted jobs by ID for status lookups, oldest first.
+        self.recent_jobs : OrderedDict[int, CaptureJob] = OrderedDict()
+
+        # Video writers of clips currently being recorded alongside their open job, keyed by that jobs ID.
+        self.open_clips : dict[int, tuple[cv2.VideoWriter, CaptureJob]] = {}
+
+        # Callbacks invoked with each job once it completes.
+        self.listeners : list = []
+
+        # Guards the queue and job history, wakes the worker when jobs arrive.
+        self.condition = threading.Condition()
+
+        self.job_IDs = itertools.count()
+        self.running = False
+        self.worker = None
+
+        # Submissions rejected due to a full queue.
+        self.rejected : int = 0
+
+
+    def start(self) -> None:
+
+        ''' Start the worker thread if it is not already running. '''
+
+        if self.worker is not None and self.worker.is_alive():
+            return
+
+        self.running = True
+        self.worker = threading.Thread(target=self.process_jobs, name='capture-writer', daemon=True)
+        self.worker.start()
+
+
+    def stop(self, timeout : float = 10.0) -> None:
+
+        ''' Finish outstanding jobs and stop the worker thread. '''
+
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+
+        if self.worker is not None:
+            self.worker.join(timeout=timeout)
+            self.worker = None
+
+
+    def add_listener(self, callback) -> None:
+
+        ''' Register a callback invoked with every completed job, called on the writer thread. '''
+
+        self.listeners.append(callback)
+
+
+    def submit(self, kind : str, path : str, payload=None, **options) -> CaptureJob | None:
+
+        '''
+            Queue a job for the worker.
+
+            Paramaters:
+                * kind (str) : One of JOB_KINDS.
+                * path (str) : File the job writes to.
+                * payload : Job data.
+                * options : Job specific settings.
+
+            Returns:
+                * (CaptureJob | None) : The queued job, None if rejected because the queue is full.
+        '''
+
+        if kind not in self.JOB_KINDS:
+            raise ValueError(f'Unknown capture job kind {kind}!')
+
+        control = kind in self.CONTROL_KINDS
+
+        with self.condition:
+
+            # Apply backpressure to data jobs once the queue is full.
+            if not control and self.pending_data_jobs >= self.max_queue:
+                self.rejected += 1
+                return None
+
+            job = CaptureJob(next(self.job_IDs), kind, path, payload, options)
+
+            self.jobs.append(job)
+            self.pending_data_jobs += 0 if control else 1
+
+            # Track the job for status lookups, forgetting the oldest. Clip frame messages are internal and not tracked.
+            if kind != 'clip_frames':
+                self.recent_jobs[job.ID] = job
+                while len(self.recent_jobs) > self.history:
+                    self.recent_jobs.popitem(last=False)
+
+            self.condition.notify()
+
+        # Lazily start the worker on first use.
+        self.start()
+
+        return job
+
+
+    def write_still(self, path : str, encoded : bytes | None = None, frame : np.ndarray | None = None, metadata : dict | None = None) -> CaptureJob | None:
+
+        ''' Queue a still capture, written as is where already JPEG encoded, otherwise encoded by the worker. Metadata describing the event is carried on the job for listeners. '''
+
+        return self.submit('still', path, encoded if encoded is not None else frame, metadata=metadata or {})
+
+
+    def open_clip(self, path : str, frame_rate : float, frame_size : tuple[int, int], codec : str = 'mp4v', metadata : dict | None = None) -> CaptureJob:
+
+        ''' Queue the opening of a clip, the returned jobs ID identifies the clip in following calls. '''
+
+        return self.submit('clip_open', path, None, frame_rate=frame_rate, frame_size=tuple(frame_size), codec=codec, metadata=metadata or {})
+
+
+    def append_clip_frames(self, clip : CaptureJob, frames : list) -> bool:
+
+        ''' Queue JPEG encoded (or raw) frames to be appended to an open clip, returning False under backpressure. '''
+
+        return self.submit('clip_frames', clip.path, frames, clip_ID=clip.ID) is not None
+
+
+    def close_clip(self, clip : CaptureJob) -> CaptureJob:
+
+        ''' Queue the closing of a clip, its open job is marked done once the file has been finalised. '''
+
+        return self.submit('clip_close', clip.path, None, clip_ID=clip.ID)
+
+
+    def status(self, job_ID : int) -> str:
+
+        '''
+            Fetch a jobs status.
+
+            Returns:
+                * (str) : queued, running, recording, done, failed or unknown should the job have aged out of the history.
+        '''
+
+        with self.condition:
+            job = self.recent_jobs.get(job_ID)
+
+        return job.status if job is not None else 'unknown'
+
+
+    @property
+    def backlog(self) -> int:
+
+        ''' Number of jobs awaiting the worker. '''
+
+        with self.condition:
+            return len(self.jobs)
+
+
+    def statistics(self) -> dict:
+
+        ''' Report the queue depth, backpressure and clips currently open. '''
+
+        with self.condition:
+            return {
+                'backlog' : len(self.jobs),
+                'pending_data_jobs' : self.pending_data_jobs,
+                'max_queue' : self.max_queue,
+                'rejected' : self.rejected,
+                'open_clips' : len(self.open_clips)
+            }
+
+
+    def process_jobs(self) -> None:
+
+        ''' Worker loop, runs each queued job in submission order until stopped and drained. '''
+
+        while True:
+
+            with self.condition:
+
+                self.condition.wait_for(lambda: self.jobs or not self.running)
+
+                if not self.jobs:
+                    break
+
+                job = self.jobs.popleft()
+                self.pending_data_jobs -= 0 if job.kind in self.CONTROL_KINDS else 1
+
+            self.run_job(job)
+
+        # Never leave a clip unfinalised on shutdown.
+        for writer, _ in self.open_clips.values():
+            writer.release()
+
+        self.open_clips.clear()
+
+
+    def run_job(self, job : CaptureJob) -> None:
+
+        ''' Execute a single job, recording its outcome and notifying listeners once complete. '''
+
+        job.status = 'running'
+
+        try:
+            completed = getattr(self, f'run_{job.kind}')(job)
+
+        except Exception as e:
+            job.status, job.error = 'failed', str(e)
+            print(f'Error : Capture job {job.ID} ({job.kind}) failed!\n{e}')
+            completed = job
+
+        # Clip frame messages complete nothing by themselves.
+        if completed is None:
+            return
+
+        if completed.status not in ('failed', 'recording'):
+            completed.status = 'done'
+
+        if completed.status == 'recording':
+            return
+
+        completed.completed_at = time.time()
+
+        for listener in self.listeners:
+            try:
+                listener(completed)
+            except Exception as e:
+                print(f'Error : Capture listener failed for job {completed.ID}!\n{e}')
+
+
+    def ensure_directory(self, path : str) -> None:
+
+        ''' Create the directory a job writes to if it does not exist. '''
+
+        directory = os.path.dirname(path)
+
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+
+
+    def decode(self, payload) -> np.ndarray | None:
+
+        ''' Turn encoded bytes (or an existing frame) into a frame. '''
+
+        if isinstance(payload, np.ndarray):
+            return payload
+
+        return cv2.imdecode(np.frombuffer(payload, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+
+    def run_still(self, job : CaptureJob) -> CaptureJob:
+
+        self.ensure_directory(job.path)
+
+        # Already encoded, write as is.
+        if isinstance(job.payload, (bytes, bytearray, memoryview)):
+            with open(job.path, 'wb') as capture_file:
+                capture_file.write(job.payload)
+
+        elif not cv2.imwrite(job.path, job.payload):
+            raise IOError(f'Failed to write still to {job.path}')
+
+        return job
+
+
+    def run_clip_open(self, job : CaptureJob) -> None:
+
+        self.ensure_directory(job.path)
+
+        writer = cv2.VideoWriter(job.path, cv2.VideoWriter_fourcc(*job.options['codec']), job.options['frame_rate'], job.options['frame_size'])
+
+        if not writer.isOpened():
+            raise IOError(f'Failed to open video writer for {job.path}')
+
+        self.open_clips[job.ID] = (writer, job)
+        job.status = 'recording'
+
+        return None
+
+
+    def run_clip_frames(self, job : CaptureJob) -> None:
+
+        # Clip failed to open, nothing to append to.
+        if job.options['clip_ID'] not in self.open_clips:
+            return None
+
+        writer, clip = self.open_clips[job.options['clip_ID']]
+        frame_size = clip.options['frame_size']
+
+        for payload in job.payload:
+
+            frame = self.decode(payload)
+
+            if frame is None:
+                continue
+
+            if (frame.shape[1], frame.shape[0]) != frame_size:
+                frame = cv2.resize(frame, frame_size, interpolation=cv2.INTER_AREA)
+
+            writer.write(frame)
+
+        return None
+
+
+    def run_clip_close(self, job : CaptureJob) -> CaptureJob | None:
+
+        if job.options['clip_ID'] not in self.open_clips:
+            return None
+
+        writer, clip = self.open_clips.pop(job.options['clip_ID'])
+        writer.release()
+
+        print(f'Clip captured and saved to {job.path}')
+
+        # Complete the clips open job, its ID is the one handed to the recorder.
+        clip.status = 'done'
+
+        return clip
+
@@ -10,6 +10,9 @@ def instantiate_application():
     app.config['DEBUG'] = os.getenv('DEBUG', 'False').lower() == 'true'
     app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'secretkey')
 
+    # Hand capture downloads to the front end server (e.g. nginx, apache) rather than streaming them through Python.
+    app.config['USE_X_SENDFILE'] = os.getenv('USE_X_SENDFILE', 'False').lower() == 'true'
+
     # Import application page routes. 
     from app.Routes import main
 
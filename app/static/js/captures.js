@@ -1,19 +1,191 @@
-
 document.addEventListener('DOMContentLoaded', function () {
 
     const sortButton = document.querySelector('.sort-button')
+    const searchBar = document.querySelector('.search-bar')
 
     sortButton.addEventListener('click', (event) => {
 
         event.preventDefault()
 
-        if (sortButton.textContent.trim() === 'Oldest') {
-            sortButton.textContent = 'Newest'
-        } else {
-            sortButton.textContent = 'Oldest'
+        // Reload the list in the opposite order.
+        updateQuery({ order: sortButton.textContent.trim() === 'Oldest' ? 'newest' : 'oldest' })
+    })
+
+    searchBar.addEventListener('keydown', (event) => {
+
+        if (event.key === 'Enter') {
+            updateQuery({ search: searchBar.value.trim() })
         }
     })
 
-    // Implement searchbar functionality here. 
+    initialiseCaptureList()
+    initialiseEventList()
+
+})
+
+function initialiseCaptureList() {
+
+    /**
+     * Load captures a page at a time from the captures API, fetching the next page whenever the end of the list scrolls
+     * into view so the first paint never depends on how many captures are stored.
+     */
+
+    const list = document.querySelector('.list-container')
+    const sentinel = list.querySelector('.list-sentinel')
+
+    // Filters present on the page URL are passed straight through to the API.
+    const parameters = new URLSearchParams(window.location.search)
+    parameters.delete('capture')
+    parameters.delete('segment')
+    parameters.delete('t')
+
+    let cursor = null
+    let loading = false
+    let exhausted = false
+
+    async function loadPage() {
+
+        if (loading || exhausted) return
+
+        loading = true
+
+        if (cursor) parameters.set('cursor', cursor)
+
+        try {
+
+            const response = await fetch(`${list.dataset.api}?${parameters.toString()}`)
+            const data = await response.json()
+
+            if (data.status !== 'success') throw new Error(data.message)
+
+            data.captures.forEach((capture) => list.insertBefore(createCaptureTile(capture), sentinel))
+
+            cursor = data.next_cursor
+            exhausted = !cursor
+
+            if (exhausted && !list.querySelector('.capture-container')) {
+                list.querySelector('.no-captures').hidden = false
+            }
+
+        } catch (error) {
+
+            console.error('Failed to load captures:', error)
+            exhausted = true
+
+        } finally {
+            loading = false
+        }
+
+        // Keep loading whilst the sentinel remains visible, e.g. on tall screens.
+        if (!exhausted && sentinel.getBoundingClientRect().top < window.innerHeight) loadPage()
+    }
+
+    new IntersectionObserver((entries) => {
+
+        if (entries.some((entry) => entry.isIntersecting)) loadPage()
+
+    }, { root: null, rootMargin: '200px' }).observe(sentinel)
+}
+
+async function initialiseEventList() {
+
+    /**
+     * List the events found within continuous recordings over the last day, each linking to its segment seeked to where
+     * the event begins. Left hidden whilst nothing has been recorded continuously.
+     */
+
+    const container = document.querySelector('.events-container')
+
+    try {
+
+        const response = await fetch(container.dataset.api)
+        const data = await response.json()
+
+        if (data.status !== 'success') throw new Error(data.message)
+
+        data.events.forEach((event) => container.append(createEventTile(event)))
+        container.hidden = data.events.length === 0
+
+    } catch (error) {
+        console.error('Failed to load recorded events:', error)
+    }
+}
+
+function createEventTile(event) {
+
+    /**
+     * Build a tile for an event returned from the segments API.
+     */
+
+    const tile = document.createElement('div')
+    tile.className = 'capture-container'
+    tile.dataset.segment = event.segment
+
+    const title = document.createElement('h5')
+    title.textContent = `${new Date(event.started_at * 1000).toLocaleString()}`
+
+    const details = document.createElement('p')
+    details.textContent = `${event.track_IDs.length} track(s), peak threat ${event.max_threat}${event.complete ? '' : ' (recording)'}`
+
+    tile.append(title, details)
+    tile.addEventListener('click', () => updateQuery({ capture: '', segment: event.segment, t: event.offset }))
+
+    return tile
+}
+
+function createCaptureTile(capture) {
+
+    /**
+     * Build a gallery tile for a capture returned from the captures API.
+     */
+
+    const tile = document.createElement('div')
+    tile.className = 'capture-container'
+    tile.dataset.capture = capture.name
+
+    const thumbnail = document.createElement('img')
+    thumbnail.src = capture.thumbnail
+    thumbnail.alt = capture.filename
+    thumbnail.className = 'capture-thumbnail'
+    thumbnail.loading = 'lazy'
+
+    // Clips play their animated preview whilst hovered, falling back to the poster frame should none exist.
+    if (capture.kind === 'clip') {
+
+        const poster = capture.thumbnail
+        const preview = `${capture.thumbnail}?variant=preview`
+
+        thumbnail.addEventListener('mouseenter', () => { thumbnail.src = preview })
+        thumbnail.addEventListener('mouseleave', () => { thumbnail.src = poster })
+        thumbnail.addEventListener('error', () => { if (thumbnail.src.endsWith(preview)) thumbnail.src = poster })
+    }
+
+    const title = document.createElement('h5')
+    title.textContent = capture.filename
+
+    const date = document.createElement('p')
+    date.textContent = `Date: ${capture.capture_date}`
+
+    const time = document.createElement('p')
+    time.textContent = `Time: ${capture.capture_time}`
+
+    tile.append(thumbnail, title, date, time)
+    tile.addEventListener('click', () => updateQuery({ capture: capture.name, segment: '', t: '' }))
+
+    return tile
+}
+
+function updateQuery(parameters) {
+
+    /**
+     * Reload the captures page with the given query parameters updated, removing any left empty.
+     */
+
+    const url = new URL(window.location.href)
+
+    Object.entries(parameters).forEach(([key, value]) => {
+        value === '' || value === null ? url.searchParams.delete(key) : url.searchParams.set(key, value)
+    })
 
-})
\ No newline at end of file
+    window.location.href = url.toString()
+}
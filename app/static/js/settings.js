@@ -8,9 +8,57 @@ document.addEventListener('DOMContentLoaded', function() {
     dropdownSetup()
     initaliseEventListeners()
     handleFormSubmission()
+    pollStatus()
 
 })
 
+function pollStatus(interval = 5000) {
+
+    /**
+     * Periodically fetch the pipelines measured costs, displaying the motion engines per frame cost beside its selector
+     * so accuracy can be traded against processing cost from measurements rather than guesswork, along with how far
+     * the detection scheduler has backed off.
+     */
+
+    const status = document.querySelector('.status-output')
+    if (!status) return
+
+    const refresh = () => {
+
+        fetch(status.dataset.api)
+            .then((response) => {
+                if (!response.ok) throw new Error('Network response is not okay!')
+                return response.json()
+            })
+            .then((data) => {
+
+                const detection = data.detection
+
+                updateOutputField('engine-cost', detection.frames_processed
+                    ? `${detection.average_cost_ms.toFixed(2)} ms per frame (${detection.engine.replace('_', ' ')}, ${detection.frames_processed} frames)`
+                    : `No frames analysed by ${detection.engine.replace('_', ' ')} yet`)
+
+                // Detection backs off whilst frames take longer than the cameras frame budget.
+                const scheduler = data.scheduler
+                const frameLatency = scheduler.stage_latency_ms.frame
+
+                updateOutputField('frame-latency', frameLatency === undefined
+                    ? 'No frames processed yet'
+                    : `${frameLatency.toFixed(2)} ms of a ${scheduler.frame_budget_ms.toFixed(2)} ms budget`)
+
+                updateOutputField('detection-interval',
+                    `Every ${scheduler.load_interval} frame(s) whilst tracking, every ${Math.max(scheduler.load_interval, scheduler.idle_interval)} whilst idle ` +
+                    `(${scheduler.frames_detected} analysed, ${scheduler.frames_skipped} skipped)`)
+            })
+            .catch((error) => {
+                console.error('There was an error fetching the pipeline status!', error)
+            })
+    }
+
+    refresh()
+    setInterval(refresh, interval)
+}
+
 function dropdownSetup(){
 
     /**
@@ -87,9 +135,9 @@ function handleUserInput(event) {
     } else if (target.matches('.toggle')) {
         updateOutputField(
             `toggle-output${target.id.slice(-1)}`,
-            target.checked ? (target.id === 'toggle2' ? 'Stills' : 'True') : (target.id === 'toggle2' ? 'Clips' : 'False'))
+            target.checked ? 'True' : 'False')
     } else if (target.matches('.select')) {
-        updateOutputField('select-output0', target.value)
+        updateOutputField(target.dataset.output || 'select-output0', target.value)
     }
 }
 
@@ -0,0 +1,223 @@
+'''
+    Delivery tests for the alert dispatcher against a local aiosmtpd server.
+'''
+
+import socket
+import json
+import time
+import os
+import pytest
+
+aiosmtpd_controller = pytest.importorskip('aiosmtpd.controller')
+
+from app.Alerts import AlertDispatcher
+
+
+class RecordingHandler(object):
+
+    ''' aiosmtpd handler keeping every message it receives. '''
+
+    def __init__(self) -> None:
+        self.messages = []
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append(envelope)
+        return '250 Message accepted for delivery'
+
+
+class FailingOptimizer(object):
+
+    ''' Attachment optimizer raising on its first use, as cv2 does on a partly written capture. '''
+
+    def __init__(self) -> None:
+        self.calls = 0
+
+    def prepare(self, paths, metadata=None):
+
+        self.calls += 1
+
+        if self.calls == 1:
+            raise RuntimeError('Unreadable capture')
+
+        return paths
+
+
+def free_port() -> int:
+
+    with socket.socket() as probe:
+        probe.bind(('localhost', 0))
+        return probe.getsockname()[1]
+
+
+def wait_for(condition, timeout : float = 10.0) -> bool:
+
+    deadline = time.time() + timeout
+
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+
+    return False
+
+
+@pytest.fixture
+def smtp_server():
+
+    handler = RecordingHandler()
+    controller = aiosmtpd_controller.Controller(handler, hostname='localhost', port=free_port())
+    controller.start()
+
+    yield controller, handler
+
+    controller.stop()
+
+
+def create_dispatcher(queue_directory, port : int, **kwargs) -> AlertDispatcher:
+
+    return AlertDispatcher(
+        queue_directory=str(queue_directory),
+        app_email='camera@example.com',
+        app_password=None,
+        target_email='owner@example.com',
+        frequency=0,
+        smtp_host='localhost',
+        smtp_port=port,
+        smtp_ssl=False,
+        base_delay=0.1,
+        maximum_delay=0.2,
+        **kwargs
+    )
+
+
+def test_alert_delivered_with_attachment(tmp_path, smtp_server):
+
+    controller, handler = smtp_server
+
+    capture = tmp_path / 'capture.jpg'
+    capture.write_bytes(b'\xff\xd8\xff\xe0 not really a jpeg')
+
+    dispatcher = create_dispatcher(tmp_path / 'queue', controller.port)
+
+    try:
+        alert = dispatcher.send_alert(attachments=[str(capture)], subject='Test alert')
+
+        assert alert is not None
+        assert wait_for(lambda: dispatcher.statistics()['sent'] == 1)
+
+    finally:
+        dispatcher.stop()
+
+    assert len(handler.messages) == 1
+    assert handler.messages[0].rcpt_tos == ['owner@example.com']
+    assert b'Test alert' in handler.messages[0].content
+    assert b'capture.jpg' in handler.messages[0].content
+
+    # Delivered alerts are removed from the on disk queue.
+    assert not os.path.exists(dispatcher.alert_path(alert))
+
+
+def test_unexpected_error_is_retried_rather_than_ending_the_worker(tmp_path, smtp_server):
+
+    controller, handler = smtp_server
+
+    capture = tmp_path / 'capture.jpg'
+    capture.write_bytes(b'capture')
+
+    optimizer = FailingOptimizer()
+    dispatcher = create_dispatcher(tmp_path / 'queue', controller.port, attachment_optimizer=optimizer)
+
+    try:
+        dispatcher.send_alert(attachments=[str(capture)])
+
+        assert wait_for(lambda: dispatcher.statistics()['sent'] == 1)
+        assert dispatcher.worker.is_alive()
+
+    finally:
+        dispatcher.stop()
+
+    assert optimizer.calls == 2
+    assert len(handler.messages) == 1
+
+
+def test_pending_alerts_survive_restart(tmp_path, smtp_server):
+
+    controller, handler = smtp_server
+
+    # Nothing listening, the alert stays queued on disk.
+    dispatcher = create_dispatcher(tmp_path / 'queue', free_port())
+    alert = dispatcher.send_alert(subject='Queued alert')
+
+    assert wait_for(lambda: dispatcher.alerts and dispatcher.alerts[0]['attempts'] >= 1)
+    dispatcher.stop()
+
+    assert os.path.exists(dispatcher.alert_path(alert))
+
+    # A new dispatcher restores and delivers it once the server is reachable.
+    restored = create_dispatcher(tmp_path / 'queue', controller.port)
+
+    try:
+        assert wait_for(lambda: restored.statistics()['sent'] == 1)
+    finally:
+        restored.stop()
+
+    assert b'Queued alert' in handler.messages[0].content
+    assert not os.path.exists(restored.alert_path(alert))
+
+
+def test_alert_is_persisted_before_it_is_queued(tmp_path, smtp_server):
+
+    controller, handler = smtp_server
+
+    dispatcher = create_dispatcher(tmp_path / 'queue', controller.port)
+    persisted = []
+
+    # Record whether the alert was already queued in memory at the moment it was written to disk.
+    persist = dispatcher.persist
+    dispatcher.persist = lambda alert: (persisted.append(alert in dispatcher.alerts), persist(alert))
+
+    try:
+        alert = dispatcher.send_alert(subject='Ordered alert')
+
+        assert wait_for(lambda: dispatcher.statistics()['sent'] == 1)
+
+    finally:
+        dispatcher.stop()
+
+    assert persisted[0] is False
+    assert not os.path.exists(dispatcher.alert_path(alert))
+
+
+def test_pending_file_delivered_once_on_restart(tmp_path, smtp_server):
+
+    controller, handler = smtp_server
+
+    queue = tmp_path / 'queue'
+    queue.mkdir()
+
+    # Left behind by a run which crashed before delivering it.
+    alert = {
+        'ID' : 1,
+        'subject' : 'Left pending',
+        'contents' : 'Pending before the restart',
+        'attachments' : [],
+        'metadata' : {},
+        'created_at' : time.time(),
+        'attempts' : 0,
+        'next_attempt_at' : time.time()
+    }
+    (queue / 'alert_1.json').write_text(json.dumps(alert))
+
+    restored = create_dispatcher(queue, controller.port)
+
+    try:
+        assert wait_for(lambda: restored.statistics()['sent'] == 1)
+    finally:
+        restored.stop()
+
+    assert len(handler.messages) == 1
+    assert b'Left pending' in handler.messages[0].content
+    assert not os.path.exists(restored.alert_path(alert))
+
+    # Nothing remains to be sent a second time.
+    assert create_dispatcher(queue, controller.port).backlog == 0
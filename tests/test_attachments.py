@@ -0,0 +1,36 @@
+'''
+    Tests for the size budgeted alert attachments.
+'''
+
+import numpy as np
+import cv2
+
+from app.Attachments import AttachmentOptimizer
+
+
+def test_still_is_replaced_by_its_keyframe(tmp_path):
+
+    capture = tmp_path / 'capture.jpg'
+    cv2.imwrite(str(capture), np.full((1080, 1920, 3), 127, dtype=np.uint8))
+
+    attachments = AttachmentOptimizer(keyframe_size=(320, 180)).prepare([str(capture)])
+
+    assert len(attachments) == 1 and attachments[0].endswith('capture_keyframe.jpg')
+    assert cv2.imread(attachments[0]).shape[:2] == (180, 320)
+
+
+def test_unreadable_capture_is_attached_unoptimised(tmp_path):
+
+    # Truncated JPEG, cv2.imread returns None rather than raising.
+    capture = tmp_path / 'capture.jpg'
+    capture.write_bytes(b'\xff\xd8\xff\xe0 truncated')
+
+    assert AttachmentOptimizer().prepare([str(capture)]) == [str(capture)]
+
+
+def test_unreadable_capture_respects_the_budget(tmp_path):
+
+    capture = tmp_path / 'capture.mp4'
+    capture.write_bytes(b'\x00' * 2048)
+
+    assert AttachmentOptimizer(max_bytes=1024).prepare([str(capture)]) == []
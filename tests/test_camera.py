@@ -0,0 +1,184 @@
+'''
+    Tests for the camera capture thread, its ring of frame buffers and switching capture profiles, read from a stand in device.
+'''
+
+import queue
+import types
+import pytest
+import numpy as np
+import cv2
+
+from app import Camera as camera_module
+
+
+class FakeDevice(object):
+
+    '''
+        Stand in for cv2.VideoCapture, each read blocks until the test pushes the value of the next frame. Like a V4L2 driver
+            it grants the nearest mode it supports rather than the one requested.
+    '''
+
+    # Supported (width, height) modes and the highest frame rate of each.
+    MODES = {(64, 48) : 30, (128, 96) : 15}
+
+    def __init__(self, index) -> None:
+        self.requested = {cv2.CAP_PROP_FRAME_WIDTH : 64, cv2.CAP_PROP_FRAME_HEIGHT : 48, cv2.CAP_PROP_FPS : 30, cv2.CAP_PROP_FOURCC : 0}
+        self.values = queue.Queue()
+
+        # Whether reads should keep waiting, replaced by the camera fixture so a stopping capture thread is let go.
+        self.running = lambda: True
+
+        # Frames read whilst the camera warms up.
+        for _ in range(2):
+            self.values.put(0)
+
+    def granted_mode(self) -> tuple[int, int]:
+        requested = (self.requested[cv2.CAP_PROP_FRAME_WIDTH], self.requested[cv2.CAP_PROP_FRAME_HEIGHT])
+        return min(self.MODES, key=lambda mode : abs(mode[0] - requested[0]) + abs(mode[1] - requested[1]))
+
+    def isOpened(self) -> bool:
+        return True
+
+    def set(self, prop, value) -> bool:
+        self.requested[prop] = value
+        return True
+
+    def get(self, prop) -> float:
+
+        mode = self.granted_mode()
+
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return mode[0]
+
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return mode[1]
+
+        if prop == cv2.CAP_PROP_FPS:
+            return min(self.requested[prop], self.MODES[mode])
+
+        return self.requested.get(prop, 0)
+
+    def read(self, buffer=None):
+
+        while True:
+            try:
+                value = self.values.get(timeout=0.01)
+                break
+            except queue.Empty:
+                if not self.running():
+                    return False, None
+
+        width, height = self.granted_mode()
+
+        if buffer is None or buffer.shape != (height, width, 3):
+            buffer = np.zeros((height, width, 3), dtype=np.uint8)
+
+        buffer[:] = value
+        return True, buffer
+
+    def release(self) -> None:
+        pass
+
+
+def profile_settings(preferred_quality : str = 'performance') -> dict:
+
+    return {
+        'stream_quality' : {
+            'preferred_quality' : preferred_quality,
+            'performance' : {'framerate' : 15, 'resolution' : [64, 48]},
+            'quality' : {'framerate' : 30, 'resolution' : [128, 96]}
+        }
+    }
+
+
+def settings_manager():
+
+    ''' Configuration manager stand in, holding only the stream_quality profiles the camera selects from. '''
+
+    settings = profile_settings()
+
+    return types.SimpleNamespace(load_settings=lambda: settings)
+
+
+@pytest.fixture
+def camera(monkeypatch):
+
+    monkeypatch.setattr(camera_module.cv2, 'VideoCapture', FakeDevice)
+
+    camera = camera_module.Camera(0, settings_manager(), ring_size=2)
+    camera.capture.running = lambda: camera.capturing
+
+    yield camera
+
+    camera.stop_capture()
+
+
+def test_ring_allocated_at_the_granted_resolution(camera):
+
+    assert camera.frame_size == (64, 48)
+    assert [buffer.shape for buffer in camera.frame_buffers] == [(48, 64, 3)] * 2
+
+
+def test_next_frame_waited_for_and_copied_out(camera):
+
+    assert camera.read_latest() == (-1, None)
+
+    camera.capture.values.put(7)
+    sequence, frame = camera.read_next(-1, timeout=2)
+
+    assert sequence == 0 and (frame == 7).all()
+
+    # The caller owns its copy, the slot it came from is untouched.
+    frame[:] = 0
+    assert (camera.frame_buffers[0] == 7).all()
+
+    # Nothing newer has been captured, the wait times out.
+    assert camera.read_next(0, timeout=0.05) == (0, None)
+
+
+def test_stale_frames_skipped_and_counted_as_dropped(camera):
+
+    for value in range(1, 6):
+        camera.capture.values.put(value)
+
+    sequence, frame = camera.read_next(3, timeout=2)
+
+    # Consumers jump straight to the newest frame, the three overwritten before ever being read are dropped.
+    assert sequence == 4 and (frame == 5).all()
+    assert camera.frames_dropped == 3
+
+
+def test_selected_profile_looked_up_by_name(camera):
+
+    assert camera.select_profile(profile_settings('quality')) == ('quality', {'framerate' : 30, 'resolution' : [128, 96]})
+    assert camera.select_profile(profile_settings('missing')) == ('missing', {})
+    assert camera.select_profile({}) == ('performance', {})
+
+
+def test_granted_mode_adopted_over_the_requested_one(camera):
+
+    assert camera.granted_profile == {'width' : 64, 'height' : 48, 'fps' : 15, 'fourcc' : 'MJPG'}
+
+    # No 100x100 mode, the nearest the device supports is what everything is sized from.
+    granted = camera.configure_device({'resolution' : [100, 100], 'framerate' : 60})
+
+    assert granted['width'] == 128 and granted['height'] == 96 and granted['fps'] == 15
+    assert camera.frame_size == (128, 96)
+
+
+def test_profile_switched_whilst_capturing(camera):
+
+    camera.capture.values.put(1)
+    sequence, frame = camera.read_next(-1, timeout=2)
+
+    assert camera.apply_profile(profile_settings('quality'))['width'] == 128
+    assert camera.profile_name == 'quality' and camera.capturing
+
+    # The ring is reallocated at the granted resolution, sequence numbers carry on where they were.
+    assert [buffer.shape for buffer in camera.frame_buffers] == [(96, 128, 3)] * 2
+
+    camera.capture.values.put(2)
+    next_sequence, next_frame = camera.read_next(sequence, timeout=2)
+
+    assert next_sequence == sequence + 1
+    assert next_frame.shape == (96, 128, 3) and (next_frame == 2).all()
@@ -0,0 +1,110 @@
+'''
+    Tests for the SQLite capture index.
+'''
+
+import sqlite3
+import time
+import os
+import pytest
+
+from app.CaptureIndex import CaptureIndex
+from app.AppConfig import FORMATTED_FILENAME_DATE
+
+
+@pytest.fixture
+def capture_index(tmp_path):
+
+    capture_index = CaptureIndex(str(tmp_path / 'captures.db'))
+
+    yield capture_index
+
+    capture_index.close()
+
+
+def store(tmp_path, name : str) -> str:
+
+    path = str(tmp_path / name)
+
+    with open(path, 'wb') as capture_file:
+        capture_file.write(b'\x00' * 10)
+
+    return path
+
+
+def test_pages_resume_after_the_previous_page(tmp_path, capture_index):
+
+    # Captures sharing a capture time are ordered by path, so none are skipped or repeated between pages.
+    for index in range(7):
+        capture_index.add(store(tmp_path, f'{index}.jpg'), captured_at=1000 + index // 2)
+
+    names, cursor = [], None
+
+    while True:
+        records, cursor = capture_index.page(cursor=cursor, limit=3)
+        names += [record['name'] for record in records]
+
+        if cursor is None:
+            break
+
+    assert names == ['6.jpg', '5.jpg', '4.jpg', '3.jpg', '2.jpg', '1.jpg', '0.jpg']
+
+    oldest, _ = capture_index.page(limit=2, descending=False)
+    assert [record['name'] for record in oldest] == ['0.jpg', '1.jpg']
+
+
+def test_malformed_cursor_rejected(capture_index):
+
+    with pytest.raises(ValueError):
+        capture_index.page(cursor='not a cursor')
+
+
+def test_still_and_clip_of_the_same_second_told_apart(tmp_path, capture_index):
+
+    capture_index.add(store(tmp_path, 'capture.jpg'))
+    capture_index.add(store(tmp_path, 'capture.mp4'))
+
+    assert capture_index.get('capture.jpg')['kind'] == 'still'
+    assert capture_index.get('capture.mp4')['kind'] == 'clip'
+    assert capture_index.get('capture') is None
+
+
+def test_name_lookup_served_by_its_unique_index(capture_index):
+
+    plan = ' '.join(row[-1] for row in capture_index.connection.execute('EXPLAIN QUERY PLAN SELECT * FROM captures WHERE name = ?', ('capture.jpg',)))
+
+    assert 'captures_name' in plan
+
+
+def test_older_index_migrated_and_redated(tmp_path):
+
+    captured_at = time.mktime(time.strptime('2024-03-17 09-30-00', '%Y-%m-%d %H-%M-%S'))
+    path = store(tmp_path, time.strftime(FORMATTED_FILENAME_DATE, time.localtime(captured_at)) + '.jpg')
+
+    # An index written before stored names were kept, its capture dated to the first of the month.
+    database_path = str(tmp_path / 'captures.db')
+    connection = sqlite3.connect(database_path)
+    connection.execute(
+        '''
+        CREATE TABLE captures (
+            path TEXT PRIMARY KEY, filename TEXT NOT NULL, file_ext TEXT NOT NULL, kind TEXT NOT NULL, captured_at REAL NOT NULL,
+            size INTEGER NOT NULL DEFAULT 0, incident_ID INTEGER, max_threat INTEGER NOT NULL DEFAULT 0
+        )
+        '''
+    )
+    connection.execute(
+        'INSERT INTO captures VALUES (?, ?, ?, ?, ?, ?, NULL, 0)',
+        (path, os.path.splitext(os.path.basename(path))[0], '.jpg', 'still', captured_at - 16 * 24 * 3600, 10)
+    )
+    connection.commit()
+    connection.close()
+
+    capture_index = CaptureIndex(database_path)
+
+    try:
+        assert capture_index.get(os.path.basename(path))['path'] == path
+
+        assert capture_index.reconcile(str(tmp_path)) == (0, 0)
+        assert capture_index.get(os.path.basename(path))['captured_at'] == captured_at
+
+    finally:
+        capture_index.close()
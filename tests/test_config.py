@@ -0,0 +1,149 @@
+'''
+    Tests for the settings file manager and publishing changed settings to its subscribers.
+'''
+
+import json
+import os
+import pytest
+
+from app.ConfigManager import ConfigManager
+
+
+DEFAULTS = {'motion_detection' : {'sensitivity' : 50, 'engine' : 'frame_difference'}, 'alerts' : {'enabled' : False}}
+
+
+@pytest.fixture
+def manager(tmp_path):
+    return ConfigManager(str(tmp_path / 'settings.json'), DEFAULTS)
+
+
+def rewrite(manager : ConfigManager, settings : dict) -> None:
+
+    ''' Edit the settings file by hand, as a user (or another process) would. '''
+
+    with open(manager.config_file, 'w') as config_file:
+        json.dump(settings, config_file)
+
+
+def saved(manager : ConfigManager) -> dict:
+
+    with open(manager.config_file) as config_file:
+        return json.load(config_file)
+
+
+def test_defaults_saved_when_no_file_exists(manager):
+
+    settings = manager.load_settings()
+
+    assert settings['motion_detection']['sensitivity'] == 50
+    assert saved(manager) == DEFAULTS
+
+
+def test_settings_only_read_again_once_the_file_changes(manager):
+
+    rewrite(manager, {'motion_detection' : {'sensitivity' : 70}})
+
+    snapshot = manager.snapshot()
+
+    # Unchanged on disk, the same snapshot is served without parsing the file.
+    assert manager.snapshot() is snapshot
+    assert snapshot['motion_detection'] == {'sensitivity' : 70, 'engine' : 'frame_difference'}
+
+    rewrite(manager, {'motion_detection' : {'sensitivity' : 100}})
+
+    reloaded = manager.snapshot()
+
+    assert reloaded is not snapshot and reloaded.version > snapshot.version
+    assert reloaded['motion_detection']['sensitivity'] == 100
+
+
+def test_malformed_file_keeps_the_last_good_settings(manager):
+
+    rewrite(manager, {'alerts' : {'enabled' : True}})
+    snapshot = manager.snapshot()
+
+    with open(manager.config_file, 'w') as config_file:
+        config_file.write('{"alerts" : ')
+
+    assert manager.snapshot() is snapshot
+
+
+def test_snapshots_cannot_be_modified(manager):
+
+    settings = manager.load_settings()
+
+    with pytest.raises(TypeError):
+        settings['alerts']['enabled'] = True
+
+    with pytest.raises(AttributeError):
+        manager.snapshot().version = 0
+
+    # Editable copies are detached from the snapshot.
+    editable = manager.snapshot().to_dict()
+    editable['alerts']['enabled'] = True
+
+    assert not manager.load_settings()['alerts']['enabled']
+
+
+def test_updates_saved_atomically(tmp_path, manager):
+
+    assert manager.update_settings({'motion_detection' : {'sensitivity' : 80}}) is None
+
+    # Served straight from the saved values, with no temporary files left behind.
+    assert manager.load_settings()['motion_detection']['sensitivity'] == 80
+    assert saved(manager)['motion_detection'] == {'sensitivity' : 80, 'engine' : 'frame_difference'}
+    assert os.listdir(tmp_path) == ['settings.json']
+
+
+def test_failed_save_leaves_the_previous_file_intact(tmp_path, manager, monkeypatch):
+
+    manager.update_settings({'motion_detection' : {'sensitivity' : 80}})
+
+    def failing_replace(source, destination):
+        raise OSError('disk full')
+
+    monkeypatch.setattr(os, 'replace', failing_replace)
+
+    assert 'disk full' in manager.update_settings({'motion_detection' : {'sensitivity' : 20}})
+    assert saved(manager)['motion_detection']['sensitivity'] == 80
+    assert manager.load_settings()['motion_detection']['sensitivity'] == 80
+    assert os.listdir(tmp_path) == ['settings.json']
+
+
+def test_subscribers_told_which_settings_changed(manager):
+
+    published = []
+    manager.load_settings()
+    manager.subscribe(lambda previous, current: published.append(current.changes(previous)))
+
+    manager.update_settings({'motion_detection' : {'sensitivity' : 80}})
+
+    # Files edited by hand are picked up on the next read.
+    rewrite(manager, {'motion_detection' : {'sensitivity' : 80, 'engine' : 'mog2'}, 'alerts' : {'enabled' : True, 'recipient' : 'a@b.c'}})
+    manager.load_settings()
+
+    assert published == [{'motion_detection.sensitivity'}, {'motion_detection.engine', 'alerts.enabled', 'alerts.recipient'}]
+
+
+def test_every_setting_changed_against_no_snapshot(manager):
+
+    assert manager.snapshot().changes(None) == {'motion_detection.sensitivity', 'motion_detection.engine', 'alerts.enabled'}
+
+
+def test_failing_subscriber_does_not_hold_back_the_others(manager):
+
+    published = []
+
+    def failing(previous, current):
+        raise RuntimeError('listener failed')
+
+    manager.subscribe(failing)
+    manager.subscribe(lambda previous, current: published.append(current.version))
+
+    assert manager.update_settings({'alerts' : {'enabled' : True}}) is None
+    assert len(published) == 2
+
+    manager.unsubscribe(failing)
+    manager.update_settings({'alerts' : {'enabled' : False}})
+
+    assert len(published) == 3
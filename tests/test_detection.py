@@ -0,0 +1,110 @@
+'''
+    Tests for the motion detection engines and the region of interest mask.
+'''
+
+import numpy as np
+import pytest
+
+from app.Detection import MotionDetector, ObjectDetection, create_motion_detector
+
+
+def moving_square(x1 : int, y1 : int, size : int = 80, frame_size : tuple[int, int] = (640, 480)) -> list[np.ndarray]:
+
+    ''' A still frame followed by the same frame with a white square drawn at the given capture coordinates. '''
+
+    still = np.zeros((frame_size[1], frame_size[0], 3), dtype=np.uint8)
+    moved = still.copy()
+    moved[y1:y1 + size, x1:x1 + size] = 255
+
+    return [still, moved]
+
+
+def detect(detection : ObjectDetection, frames : list[np.ndarray]) -> list[dict]:
+
+    bboxes = []
+
+    for frame in frames:
+        _, bboxes = detection.detect_motion(detection.process_frame(frame))
+
+    return bboxes
+
+
+@pytest.mark.parametrize('engine', ['frame_difference', 'running_average', 'mog2'])
+def test_engine_reports_its_per_frame_cost(engine):
+
+    detector = create_motion_detector(engine)
+    frames = [np.full((90, 160), value, dtype=np.uint8) for value in (0, 0, 255)]
+
+    for frame in frames:
+        detector.apply(frame)
+
+    statistics = detector.statistics()
+
+    assert statistics['engine'] == engine
+    assert statistics['frames_processed'] == len(frames)
+    assert statistics['last_cost_ms'] > 0 and statistics['average_cost_ms'] > 0
+
+
+def test_incomplete_engine_fails_at_construction():
+
+    class IncompleteDetector(MotionDetector):
+        name = 'incomplete'
+
+    with pytest.raises(TypeError):
+        IncompleteDetector()
+
+
+@pytest.mark.parametrize('analysis_scale, expected', [
+    (0.25, (160, 120)),
+    ([320, 180], (320, 180)),
+    ([1920, 1080], (640, 480)),
+    (0, (640, 480)),
+    ('quarter', (640, 480))
+])
+def test_analysis_size_resolved_and_never_upscaled(analysis_scale, expected):
+
+    assert ObjectDetection(analysis_scale=analysis_scale).calculate_analysis_size(640, 480) == expected
+
+
+def test_analysed_at_reduced_resolution_and_mapped_back():
+
+    detection = ObjectDetection(analysis_scale=0.25)
+
+    assert detection.process_frame(np.zeros((480, 640, 3), dtype=np.uint8)).shape == (120, 160)
+    assert (detection.scale_x, detection.scale_y) == (4.0, 4.0)
+
+    detection.motion_detector.reset()
+    bbox, = detect(detection, moving_square(320, 240))
+
+    # Capture resolution coordinates, grown only slightly by the blur and dilation.
+    assert 296 <= bbox['x1'] <= 320 and 216 <= bbox['y1'] <= 240
+    assert 400 <= bbox['x2'] <= 424 and 320 <= bbox['y2'] <= 344
+
+
+def test_regions_compiled_to_a_crop_and_mask_once():
+
+    detection = ObjectDetection(analysis_scale=0.25, regions_of_interest=[[[0.5, 0.5], [1, 1]]])
+    detection.process_frame(np.zeros((480, 640, 3), dtype=np.uint8))
+
+    mask = detection.regions_of_interest.mask
+
+    assert detection.regions_of_interest.crop == (320, 240, 640, 480)
+    assert mask.shape == (60, 80) and mask.all()
+
+    # Nothing changed, the same compiled mask is reused.
+    detection.process_frame(np.zeros((480, 640, 3), dtype=np.uint8))
+    assert detection.regions_of_interest.mask is mask
+
+
+def test_motion_outside_the_regions_ignored():
+
+    regions = [[[320, 240], [640, 240], [640, 480]]]
+
+    # Within the crop but outside the triangle, masked out before any contour is found.
+    assert detect(ObjectDetection(analysis_scale=0.25, regions_of_interest=regions), moving_square(340, 380)) == []
+
+    bbox, = detect(ObjectDetection(analysis_scale=0.25, regions_of_interest=regions), moving_square(540, 260))
+
+    # Offset by the crops origin back into capture coordinates.
+    assert 520 <= bbox['x1'] <= 540 and 240 <= bbox['y1'] <= 260
+    assert 620 <= bbox['x2'] <= 640 and 340 <= bbox['y2'] <= 364
@@ -0,0 +1,121 @@
+'''
+    Tests for grouping threats into incidents and alerting once per incident.
+'''
+
+from app.Incidents import IncidentAggregator
+
+
+class RateLimitedDispatcher(object):
+
+    ''' Alert dispatcher stand in, suppressing (returning None for) the first given number of alerts. '''
+
+    def __init__(self, suppress : int = 0) -> None:
+        self.suppress = suppress
+        self.alerts = []
+
+    def send_alert(self, **alert):
+
+        if self.suppress:
+            self.suppress -= 1
+            return None
+
+        self.alerts.append(alert)
+        return alert
+
+
+def threat(ID : int, threat_level : int) -> dict:
+    return {'ID' : ID, 'threat_level' : threat_level}
+
+
+def create_aggregator(tmp_path, dispatcher, threat_step : int = 3) -> IncidentAggregator:
+    return IncidentAggregator(dispatcher, store_path=str(tmp_path / 'incidents.jsonl'), incident_gap=60, threat_step=threat_step)
+
+
+def test_observations_group_into_one_incident(tmp_path):
+
+    aggregator = create_aggregator(tmp_path, RateLimitedDispatcher())
+
+    try:
+        incident, state = aggregator.observe([threat(1, 4)], observed_at=100)
+        assert state == 'new'
+
+        same, state = aggregator.observe([threat(1, 5)], observed_at=101)
+        assert same is incident and state == 'ongoing'
+
+        # A new track joining is an escalation of the same incident.
+        same, state = aggregator.observe([threat(1, 5), threat(2, 4)], observed_at=102)
+        assert same is incident and state == 'escalated'
+
+    finally:
+        aggregator.stop()
+
+
+def test_escalates_only_on_reaching_the_next_threat_band(tmp_path):
+
+    aggregator = create_aggregator(tmp_path, RateLimitedDispatcher(), threat_step=3)
+
+    try:
+        aggregator.observe([threat(1, 4)], observed_at=100)
+
+        states = [aggregator.observe([threat(1, level)], observed_at=100 + level)[1] for level in range(5, 25)]
+        escalated_at = [level for level, state in zip(range(5, 25), states) if state == 'escalated']
+
+        assert escalated_at == [6, 12, 24]
+
+    finally:
+        aggregator.stop()
+
+
+def test_alerts_once_per_incident(tmp_path):
+
+    dispatcher = RateLimitedDispatcher()
+    aggregator = create_aggregator(tmp_path, dispatcher)
+
+    try:
+        incident, _ = aggregator.observe([threat(1, 6)])
+
+        aggregator.add_capture(incident.ID, 'first.jpg')
+        aggregator.add_capture(incident.ID, 'second.jpg')
+
+        assert [alert['attachments'] for alert in dispatcher.alerts] == [['first.jpg']]
+        assert incident.captures == ['first.jpg', 'second.jpg']
+
+    finally:
+        aggregator.stop()
+
+
+def test_suppressed_alert_is_retried_with_the_next_capture(tmp_path):
+
+    dispatcher = RateLimitedDispatcher(suppress=1)
+    aggregator = create_aggregator(tmp_path, dispatcher)
+
+    try:
+        incident, _ = aggregator.observe([threat(1, 6)])
+
+        aggregator.add_capture(incident.ID, 'first.jpg')
+        assert not incident.alerted and dispatcher.alerts == []
+
+        aggregator.add_capture(incident.ID, 'second.jpg')
+        assert incident.alerted
+        assert [alert['attachments'] for alert in dispatcher.alerts] == [['second.jpg']]
+
+    finally:
+        aggregator.stop()
+
+
+def test_suppressed_capture_free_alert_is_retried(tmp_path):
+
+    dispatcher = RateLimitedDispatcher(suppress=1)
+    aggregator = create_aggregator(tmp_path, dispatcher)
+
+    try:
+        incident, _ = aggregator.observe([threat(1, 6)])
+
+        aggregator.alert(incident, contents='Recorded within a segment.')
+        aggregator.alert(incident, contents='Recorded within a segment.')
+        aggregator.alert(incident, contents='Recorded within a segment.')
+
+        assert incident.alerted and len(dispatcher.alerts) == 1
+
+    finally:
+        aggregator.stop()
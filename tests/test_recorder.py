@@ -0,0 +1,178 @@
+'''
+    Tests for the compressed pre-roll, clip recorder and segment index.
+'''
+
+import numpy as np
+import cv2
+
+from app.Recorder import CompressedFrameRing, ClipRecorder, SegmentIndex, SegmentRecorder
+from app.Writer import CaptureWriter
+
+
+class RecordingWriter(object):
+
+    ''' Capture writer stand in, keeping the clips opened and the frames appended to them. '''
+
+    def __init__(self) -> None:
+        self.clips = []
+        self.frames = []
+        self.closed = []
+
+    def open_clip(self, path, frame_rate, frame_size, codec='mp4v', metadata=None):
+        self.clips.append(path)
+        return path
+
+    def append_clip_frames(self, clip, frames):
+        self.frames.extend(frames)
+        return True
+
+    def close_clip(self, clip):
+        self.closed.append(clip)
+
+
+def held(ring : CompressedFrameRing) -> list[tuple[int, bytes]]:
+    return [(sequence, bytes(encoded)) for sequence, encoded in ring.frames()]
+
+
+def test_ring_holds_frames_oldest_first():
+
+    ring = CompressedFrameRing(capacity_bytes=100, max_frames=10)
+
+    for sequence in range(3):
+        assert ring.append(sequence, bytes([sequence]) * 20)
+
+    assert held(ring) == [(sequence, bytes([sequence]) * 20) for sequence in range(3)]
+    assert ring.bytes_used == 60
+
+
+def test_ring_wraps_evicting_the_frames_it_overwrites():
+
+    ring = CompressedFrameRing(capacity_bytes=100, max_frames=10)
+
+    for sequence in range(4):
+        ring.append(sequence, bytes([sequence]) * 30)
+
+    # The fourth frame no longer fits before the end, it wraps to the start overwriting the first.
+    assert [sequence for sequence, _ in held(ring)] == [1, 2, 3]
+    assert ring.write_offset == 30
+
+    ring.append(4, bytes([4]) * 30)
+
+    assert held(ring) == [(sequence, bytes([sequence]) * 30) for sequence in (2, 3, 4)]
+
+
+def test_ring_respects_its_frame_limit_and_rejects_oversized_frames():
+
+    ring = CompressedFrameRing(capacity_bytes=100, max_frames=2)
+
+    for sequence in range(3):
+        ring.append(sequence, b'x' * 10)
+
+    assert [sequence for sequence, _ in held(ring)] == [1, 2]
+
+    assert not ring.append(3, b'x' * 101)
+    assert ring.oversized == 1 and len(ring) == 2
+
+
+def test_ring_drains_decoded_frames():
+
+    ring = CompressedFrameRing(capacity_bytes=64 * 1024, max_frames=4)
+    frame = np.full((48, 64, 3), 200, dtype=np.uint8)
+
+    ring.append(0, cv2.imencode('.jpg', frame)[1].tobytes())
+
+    drained = list(ring.drain())
+
+    assert len(drained) == 1 and drained[0].shape == frame.shape
+    assert len(ring) == 0
+
+
+def test_pre_roll_allocated_on_first_frame_and_sized_by_quality():
+
+    recorder = ClipRecorder(RecordingWriter(), '/captures', frame_rate=10, frame_size=(1280, 720), pre_roll_seconds=2, pre_roll_quality=70)
+
+    # Nothing is held until clips are actually recorded.
+    assert recorder.pre_roll is None
+
+    recorder.add_frame(np.zeros((720, 1280, 3), dtype=np.uint8), encoded=b'jpeg', sequence=0)
+
+    low = recorder.pre_roll.capacity
+    recorder.release()
+
+    # Well short of the previous fixed 10:1 sizing at the stream quality.
+    assert low < 20 * 1280 * 720 * 3 // 10
+
+    assert recorder.pre_roll is None
+
+    recorder.pre_roll_quality = 95
+    recorder.add_frame(np.zeros((720, 1280, 3), dtype=np.uint8), encoded=b'jpeg', sequence=1)
+
+    # Higher qualities encode larger frames, the arena grows with them.
+    assert recorder.pre_roll.capacity > low
+
+
+def test_trigger_hands_the_pre_roll_to_the_clip():
+
+    writer = RecordingWriter()
+    recorder = ClipRecorder(writer, '/captures', frame_rate=10, frame_size=(64, 48), pre_roll_seconds=1, post_roll_seconds=0.2)
+    frame = np.zeros((48, 64, 3), dtype=np.uint8)
+
+    for sequence in range(15):
+        recorder.add_frame(frame, encoded=bytes([sequence]), sequence=sequence)
+
+    recorder.trigger('event')
+
+    # The last second of frames, then the post-roll, after which the clip is closed.
+    assert writer.clips == ['/captures/event.mp4']
+    assert writer.frames == [bytes([sequence]) for sequence in range(5, 15)]
+
+    recorder.add_frame(frame, sequence=15)
+    recorder.add_frame(frame, sequence=16)
+
+    # Frames following the trigger are handed over as is, the writer encodes them once without decoding a JPEG first.
+    assert writer.frames[-2] is frame and writer.frames[-1] is frame
+    assert writer.closed == ['/captures/event.mp4']
+    assert not recorder.recording
+
+
+def test_segments_roll_over_and_complete_once_written(tmp_path):
+
+    writer = CaptureWriter()
+    recorder = SegmentRecorder(writer, str(tmp_path), frame_rate=10, frame_size=(64, 48), segment_seconds=0.5, minimum_free_bytes=0)
+
+    frames = [np.full((48, 64, 3), value, dtype=np.uint8) for value in range(12)]
+
+    for frame in frames:
+        recorder.add_frame(frame)
+
+    recorder.finish()
+    writer.stop()
+
+    segments = sorted(recorder.index.segments.values(), key=lambda segment : segment['started_at'])
+
+    # Five frames per segment, the raw frames are encoded by the writer alone.
+    assert [segment['frames'] for segment in segments] == [5, 5, 2]
+    assert all(segment['complete'] for segment in segments)
+    assert all(cv2.VideoCapture(segment['path']).get(cv2.CAP_PROP_FRAME_COUNT) == segment['frames'] for segment in segments)
+    assert (tmp_path / 'segments_index.json').exists()
+
+
+def test_segments_without_events_evicted_first(tmp_path):
+
+    index = SegmentIndex(str(tmp_path / 'segments_index.json'))
+
+    for path, started_at in (('old_event.mp4', 0), ('old.mp4', 10), ('new.mp4', 20), ('recording.mp4', 30)):
+        index.add_segment(path, started_at)
+
+    for path in ('old_event.mp4', 'old.mp4', 'new.mp4'):
+        index.complete_segment(path, frames=100, frame_rate=10)
+
+    index.mark_event('old_event.mp4', offset=1, observed_at=1, track_IDs=[1], threat_level=6)
+
+    # Segments still being recorded, or just completed, are never offered.
+    assert [segment['path'] for segment in index.eviction_candidates()] == ['old.mp4', 'new.mp4', 'old_event.mp4']
+    assert [segment['path'] for segment in index.eviction_candidates(exclude=('new.mp4',))] == ['old.mp4', 'old_event.mp4']
+
+    assert index.lookup(15) == ('old.mp4', 5)
+    assert index.lookup(35) == ('recording.mp4', 5)
+    assert index.lookup(-1) is None
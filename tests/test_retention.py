@@ -0,0 +1,116 @@
+'''
+    Tests for retaining captures against a byte budget.
+'''
+
+import time
+import os
+import pytest
+import numpy as np
+import cv2
+
+from app.CaptureIndex import CaptureIndex
+from app.Managment import RetentionManager, ThumbnailCache
+
+
+@pytest.fixture
+def capture_index(tmp_path):
+
+    capture_index = CaptureIndex(str(tmp_path / 'captures.db'))
+
+    yield capture_index
+
+    capture_index.close()
+
+
+def store(tmp_path, capture_index : CaptureIndex, name : str, captured_at : float, size : int = 100, max_threat : int = 0, incident_ID : int | None = None) -> str:
+
+    path = str(tmp_path / name)
+
+    with open(path, 'wb') as capture_file:
+        capture_file.write(b'\x00' * size)
+
+    capture_index.add(path, captured_at=captured_at, incident_ID=incident_ID, max_threat=max_threat)
+
+    return path
+
+
+def create_manager(tmp_path, capture_index : CaptureIndex, byte_budget : int, **kwargs) -> RetentionManager:
+    return RetentionManager(capture_index, directory=str(tmp_path), byte_budget=byte_budget, minimum_free_bytes=0, batch_size=2, **kwargs)
+
+
+def remaining(capture_index : CaptureIndex) -> list[str]:
+    return [os.path.basename(capture['path']) for capture in capture_index.query(limit=100, descending=False)]
+
+
+def test_oldest_removed_first_until_within_budget(tmp_path, capture_index):
+
+    now = time.time()
+
+    for hour in range(5):
+        store(tmp_path, capture_index, f'{hour}.jpg', captured_at=now + hour * 3600)
+
+    freed = create_manager(tmp_path, capture_index, byte_budget=300, policies=('oldest_first',)).enforce()
+
+    assert freed == 200
+    assert remaining(capture_index) == ['2.jpg', '3.jpg', '4.jpg']
+    assert not os.path.exists(tmp_path / '0.jpg') and not os.path.exists(tmp_path / '1.jpg')
+
+
+def test_high_threat_captures_spared(tmp_path, capture_index):
+
+    now = time.time()
+
+    store(tmp_path, capture_index, 'threat.jpg', captured_at=now, max_threat=9)
+    store(tmp_path, capture_index, 'old.jpg', captured_at=now + 1)
+    store(tmp_path, capture_index, 'new.jpg', captured_at=now + 2)
+
+    create_manager(tmp_path, capture_index, byte_budget=200, policies=('oldest_first',), protected_threat=6).enforce()
+
+    assert remaining(capture_index) == ['threat.jpg', 'new.jpg']
+
+
+def test_old_stills_thinned_to_one_per_incident_before_anything_else(tmp_path, capture_index):
+
+    old, now = time.time() - 30 * 24 * 3600, time.time()
+
+    store(tmp_path, capture_index, 'incident_first.jpg', captured_at=old, incident_ID=1)
+    store(tmp_path, capture_index, 'incident_second.jpg', captured_at=old + 1, incident_ID=1)
+    store(tmp_path, capture_index, 'incident_third.jpg', captured_at=old + 2, incident_ID=1)
+    store(tmp_path, capture_index, 'recent.jpg', captured_at=now)
+
+    create_manager(tmp_path, capture_index, byte_budget=200).enforce()
+
+    # Thinning reclaims enough on its own, the older incident keeps its first still and the recent capture is untouched.
+    assert remaining(capture_index) == ['incident_first.jpg', 'recent.jpg']
+
+
+def test_cached_attachment_variants_removed_with_their_capture(tmp_path, capture_index):
+
+    path = store(tmp_path, capture_index, 'capture.jpg', captured_at=time.time())
+
+    (tmp_path / '.attachments').mkdir()
+    (tmp_path / '.attachments' / 'capture_keyframe.jpg').write_bytes(b'\x00' * 50)
+    (tmp_path / '.attachments' / 'other_keyframe.jpg').write_bytes(b'\x00' * 50)
+
+    assert create_manager(tmp_path, capture_index, byte_budget=0).delete(capture_index.query()[0]) == 150
+
+    assert not os.path.exists(path)
+    assert os.listdir(tmp_path / '.attachments') == ['other_keyframe.jpg']
+
+
+def test_cached_thumbnails_evicted_with_their_capture(tmp_path, capture_index):
+
+    path = str(tmp_path / 'capture.jpg')
+    cv2.imwrite(path, np.full((360, 640, 3), 90, dtype=np.uint8))
+    capture_index.add(path, captured_at=time.time())
+
+    thumbnail_cache = ThumbnailCache(str(tmp_path / '.thumbnails'), capture_index=capture_index)
+    thumbnail_cache.generate(path)
+
+    assert len(os.listdir(tmp_path / '.thumbnails')) == 1
+
+    create_manager(tmp_path, capture_index, byte_budget=0, thumbnail_cache=thumbnail_cache).enforce()
+
+    assert capture_index.count() == 0
+    assert os.listdir(tmp_path / '.thumbnails') == []
+    assert thumbnail_cache.total_bytes == 0 and not thumbnail_cache.entries
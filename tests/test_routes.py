@@ -0,0 +1,240 @@
+'''
+    Tests for the capture and recording routes, served against a stand in pipeline so no camera is required.
+'''
+
+import importlib
+import types
+import time
+import sys
+import os
+import pytest
+import numpy as np
+from flask import Flask
+
+from app.CaptureIndex import CaptureIndex
+from app.Recorder import SegmentIndex
+from app.Detection import create_motion_detector
+from app.Scheduler import DetectionScheduler
+
+
+@pytest.fixture
+def pipeline(tmp_path):
+
+    ''' Stand in for the pipeline singleton, holding only the indexes the routes read from. '''
+
+    detector = create_motion_detector('running_average')
+    scheduler = DetectionScheduler(target_fps=30)
+
+    pipeline = types.SimpleNamespace(
+        capture_index=CaptureIndex(str(tmp_path / 'captures.db')),
+        segment_recorder=types.SimpleNamespace(index=SegmentIndex(str(tmp_path / 'segments' / 'segments_index.json'))),
+        object_detection=types.SimpleNamespace(motion_detector=detector),
+        scheduler=scheduler,
+        statistics=lambda: {'detection' : detector.statistics(), 'scheduler' : scheduler.statistics()}
+    )
+
+    yield pipeline
+
+    pipeline.capture_index.close()
+
+
+@pytest.fixture
+def client(pipeline, monkeypatch):
+
+    # Importing the real pipeline would open the camera, the routes only need its stand in.
+    monkeypatch.setitem(sys.modules, 'app.Pipeline', types.SimpleNamespace(stream_pipeline=pipeline))
+    monkeypatch.delitem(sys.modules, 'app.Routes', raising=False)
+
+    routes = importlib.import_module('app.Routes')
+
+    app = Flask('app', root_path=os.path.dirname(routes.__file__))
+    app.register_blueprint(routes.main)
+
+    return app.test_client()
+
+
+def record_segment(tmp_path, index : SegmentIndex, started_at : float, name : str = 'segment.mp4', complete : bool = True) -> str:
+
+    path = str(tmp_path / 'segments' / name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    with open(path, 'wb') as segment_file:
+        segment_file.write(bytes(range(256)) * 16)
+
+    index.add_segment(path, started_at)
+
+    if complete:
+        index.complete_segment(path, frames=100, frame_rate=10)
+
+    return path
+
+
+def test_events_located_within_their_segment(tmp_path, pipeline, client):
+
+    index = pipeline.segment_recorder.index
+    started_at = time.time() - 60
+    path = record_segment(tmp_path, index, started_at)
+
+    index.mark_event(path, offset=4.0, observed_at=started_at + 4, track_IDs=[3], threat_level=7)
+    index.mark_event(path, offset=5.0, observed_at=started_at + 5, track_IDs=[4], threat_level=8)
+
+    events = client.get('/api/segments').get_json()['events']
+
+    # Observations within the merge gap form one event, seekable from where it began.
+    assert len(events) == 1
+    assert events[0]['segment'] == 'segment.mp4'
+    assert events[0]['offset'] == 4.0
+    assert events[0]['track_IDs'] == [3, 4] and events[0]['max_threat'] == 8
+    assert events[0]['url'] == '/segments/file/segment.mp4'
+
+    # Events outside the requested window are left out.
+    assert client.get(f'/api/segments?end={started_at - 1}').get_json()['events'] == []
+
+
+def test_moment_looked_up_to_segment_and_offset(tmp_path, pipeline, client):
+
+    started_at = time.time() - 60
+    record_segment(tmp_path, pipeline.segment_recorder.index, started_at)
+
+    located = client.get(f'/api/segments?at={started_at + 2.5}').get_json()
+
+    assert located['segment'] == 'segment.mp4' and located['offset'] == 2.5
+    assert client.get(f'/api/segments?at={started_at + 60}').status_code == 404
+    assert client.get('/api/segments?at=yesterday').status_code == 400
+
+
+def test_segment_served_in_ranges_once_complete(tmp_path, pipeline, client):
+
+    index = pipeline.segment_recorder.index
+    record_segment(tmp_path, index, time.time() - 60)
+    record_segment(tmp_path, index, time.time(), name='recording.mp4', complete=False)
+
+    response = client.get('/segments/file/segment.mp4', headers={'Range' : 'bytes=256-511'})
+
+    assert response.status_code == 206
+    assert response.data == bytes(range(256))
+
+    assert client.get('/segments/file/recording.mp4').status_code == 409
+    assert client.get('/segments/file/missing.mp4').status_code == 404
+
+
+def test_captures_page_plays_selected_segment_from_offset(tmp_path, pipeline, client):
+
+    record_segment(tmp_path, pipeline.segment_recorder.index, time.time() - 60)
+
+    page = client.get('/captures?segment=segment.mp4&t=4.0').get_data(as_text=True)
+
+    assert '/segments/file/segment.mp4#t=4.0' in page
+
+
+def test_status_reports_the_motion_engines_cost(pipeline, client):
+
+    pipeline.object_detection.motion_detector.apply(np.zeros((90, 160), dtype=np.uint8))
+
+    detection = client.get('/api/status').get_json()['detection']
+
+    assert detection['engine'] == 'running_average'
+    assert detection['frames_processed'] == 1 and detection['average_cost_ms'] > 0
+
+
+def test_status_reports_the_detection_schedule(pipeline, client):
+
+    pipeline.scheduler.record('frame', 0.02)
+    pipeline.scheduler.frame_processed()
+
+    scheduler = client.get('/api/status').get_json()['scheduler']
+
+    assert scheduler['stage_latency_ms']['frame'] == 20.0
+    assert scheduler['load_interval'] == 1 and scheduler['frame_budget_ms'] == 33.333
+
+
+def store_capture(tmp_path, pipeline, name : str, captured_at : float, **kwargs) -> str:
+
+    path = str(tmp_path / name)
+
+    with open(path, 'wb') as capture_file:
+        capture_file.write(bytes(range(256)) * 4)
+
+    pipeline.capture_index.add(path, captured_at=captured_at, **kwargs)
+
+    return path
+
+
+def test_capture_revalidated_without_being_sent_again(tmp_path, pipeline, client):
+
+    store_capture(tmp_path, pipeline, 'capture.jpg', captured_at=time.time() - 60)
+
+    response = client.get('/captures/file/capture.jpg')
+
+    assert response.status_code == 200 and len(response.data) == 1024
+    assert response.cache_control.immutable and response.cache_control.max_age == 31536000
+
+    assert client.get('/captures/file/capture.jpg', headers={'If-None-Match' : response.headers['ETag']}).status_code == 304
+    assert client.get('/captures/file/capture.jpg', headers={'If-Modified-Since' : response.headers['Last-Modified']}).status_code == 304
+
+
+def test_capture_served_in_ranges(tmp_path, pipeline, client):
+
+    store_capture(tmp_path, pipeline, 'clip.mp4', captured_at=time.time() - 60)
+
+    response = client.get('/captures/file/clip.mp4', headers={'Range' : 'bytes=1000-'})
+
+    assert response.status_code == 206
+    assert response.headers['Content-Range'] == 'bytes 1000-1023/1024'
+    assert response.data == bytes(range(232, 256))
+
+
+def test_capture_downloaded_under_its_stored_name(tmp_path, pipeline, client):
+
+    store_capture(tmp_path, pipeline, 'capture.jpg', captured_at=time.time() - 60)
+
+    response = client.get('/captures/file/capture.jpg?download=1')
+
+    assert 'attachment' in response.headers['Content-Disposition'] and 'capture.jpg' in response.headers['Content-Disposition']
+    assert client.get('/captures/file/missing.jpg').status_code == 404
+
+
+def test_captures_paged_through_by_cursor(tmp_path, pipeline, client):
+
+    now = time.time() - 3600
+
+    for index in range(5):
+        store_capture(tmp_path, pipeline, f'{index}.jpg', captured_at=now + index)
+
+    pages, cursor = [], ''
+
+    while cursor is not None:
+        page = client.get(f'/api/captures?limit=2&cursor={cursor}').get_json()
+        pages.append([capture['name'] for capture in page['captures']])
+        cursor = page['next_cursor']
+
+    assert pages == [['4.jpg', '3.jpg'], ['2.jpg', '1.jpg'], ['0.jpg']]
+
+    capture = client.get('/api/captures?limit=1&order=oldest').get_json()['captures'][0]
+
+    assert capture['name'] == '0.jpg' and capture['kind'] == 'still'
+    assert capture['url'] == '/captures/file/0.jpg' and capture['thumbnail'] == '/captures/thumbnail/0.jpg'
+
+
+def test_captures_filtered(tmp_path, pipeline, client):
+
+    now = time.time() - 3600
+
+    store_capture(tmp_path, pipeline, 'quiet.jpg', captured_at=now)
+    store_capture(tmp_path, pipeline, 'threat.jpg', captured_at=now + 1, max_threat=7, incident_ID=3)
+    store_capture(tmp_path, pipeline, 'threat.mp4', captured_at=now + 2, max_threat=7, incident_ID=3)
+
+    def names(query : str) -> list[str]:
+        return [capture['name'] for capture in client.get(f'/api/captures?{query}').get_json()['captures']]
+
+    assert names('kind=clip') == ['threat.mp4']
+    assert names('min_threat=5') == ['threat.mp4', 'threat.jpg']
+    assert names('incident=3&kind=still') == ['threat.jpg']
+    assert names(f'until={now + 0.5}') == ['quiet.jpg']
+    assert names('search=qui') == ['quiet.jpg']
+
+
+def test_malformed_capture_queries_rejected(client):
+
+    assert client.get('/api/captures?cursor=not-a-cursor').status_code == 400
+    assert client.get('/api/captures?since=yesterday').status_code == 400
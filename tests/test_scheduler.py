@@ -0,0 +1,55 @@
+'''
+    Tests for the adaptive detection scheduler.
+'''
+
+from app.Scheduler import DetectionScheduler
+
+
+def detected_frames(scheduler : DetectionScheduler, frames : range, tracks_active : bool) -> list[int]:
+    return [sequence for sequence in frames if scheduler.should_detect(sequence, tracks_active)]
+
+
+def test_detects_every_frame_whilst_tracking_and_every_nth_whilst_idle():
+
+    scheduler = DetectionScheduler(target_fps=30, idle_interval=5)
+
+    assert detected_frames(scheduler, range(0, 4), tracks_active=True) == [0, 1, 2, 3]
+    assert detected_frames(scheduler, range(4, 20), tracks_active=False) == [8, 13, 18]
+
+
+def test_backs_off_under_load_and_recovers():
+
+    scheduler = DetectionScheduler(target_fps=30, idle_interval=2, maximum_interval=4)
+
+    # Frames taking twice the budget widen the interval, up to its maximum.
+    for _ in range(10):
+        scheduler.record('frame', 2 / 30)
+        scheduler.frame_processed()
+
+    assert scheduler.interval == 4
+    assert detected_frames(scheduler, range(0, 9), tracks_active=True) == [0, 4, 8]
+
+    # Comfortable slack relaxes it again.
+    for _ in range(50):
+        scheduler.record('frame', 0.001)
+        scheduler.frame_processed()
+
+    assert scheduler.interval == 1
+
+
+def test_statistics_report_latency_and_interval():
+
+    scheduler = DetectionScheduler(target_fps=25)
+
+    with scheduler.measure('detection'):
+        pass
+
+    scheduler.record('frame', 0.01)
+    scheduler.should_detect(0, tracks_active=False)
+    scheduler.should_detect(1, tracks_active=False)
+
+    statistics = scheduler.statistics()
+
+    assert statistics['frame_budget_ms'] == 40.0
+    assert statistics['stage_latency_ms']['frame'] == 10.0 and 'detection' in statistics['stage_latency_ms']
+    assert statistics['frames_detected'] == 1 and statistics['frames_skipped'] == 1
@@ -0,0 +1,99 @@
+'''
+    Tests for broadcasting processed frames to stream viewers and encoding them once for every consumer.
+'''
+
+import numpy as np
+import cv2
+
+from app.Streaming import FrameBroadcaster, EncodedFrameCache, resolve_jpeg_quality
+
+
+def test_every_subscriber_receives_each_frame():
+
+    broadcaster = FrameBroadcaster()
+    first, second = broadcaster.subscribe(), broadcaster.subscribe()
+
+    broadcaster.publish(0, b'frame')
+
+    assert first.get(timeout=0) == (0, b'frame')
+    assert second.get(timeout=0) == (0, b'frame')
+
+
+def test_slow_subscriber_drops_its_oldest_frames():
+
+    broadcaster = FrameBroadcaster(max_queue=2)
+    slow, fast = broadcaster.subscribe(), broadcaster.subscribe()
+
+    for sequence in range(5):
+        broadcaster.publish(sequence, sequence)
+        assert fast.get(timeout=0) == (sequence, sequence)
+
+    # Only the newest frames are held, the producer and other viewers never wait on the slow one.
+    assert [slow.get(timeout=0) for _ in range(3)] == [(3, 3), (4, 4), None]
+    assert slow.dropped == 3 and fast.dropped == 0
+
+
+def test_new_subscriber_primed_with_the_latest_frame():
+
+    broadcaster = FrameBroadcaster()
+
+    assert not broadcaster.wait_for_packet(timeout=0)
+
+    broadcaster.publish(0, b'first')
+    broadcaster.publish(1, b'second')
+
+    assert broadcaster.wait_for_packet(timeout=0)
+    assert broadcaster.subscribe().get(timeout=0) == (1, b'second')
+
+
+def test_unsubscribed_viewer_woken_and_forgotten():
+
+    broadcaster = FrameBroadcaster()
+    subscriber = broadcaster.subscribe()
+
+    broadcaster.unsubscribe(subscriber)
+    broadcaster.publish(0, b'frame')
+
+    assert subscriber.closed and subscriber.get(timeout=1) is None
+    assert broadcaster.subscriber_count == 0
+
+
+def test_frame_encoded_once_per_quality_and_resolution():
+
+    cache = EncodedFrameCache()
+    cache.store_frame(0, np.full((48, 64, 3), 120, dtype=np.uint8))
+
+    first = cache.encode(0, quality=80)
+
+    assert cache.encode(0, quality=80) is first
+    assert cache.encode(0, quality=40) is not first
+    assert cv2.imdecode(np.frombuffer(cache.encode(0, quality=80, resolution=(32, 24)), np.uint8), cv2.IMREAD_COLOR).shape == (24, 32, 3)
+
+    assert cache.encodes == 3 and cache.hits == 1
+
+
+def test_evicted_frames_take_their_encodings_with_them():
+
+    cache = EncodedFrameCache(max_frames=2)
+
+    for sequence in range(3):
+        cache.store_frame(sequence, np.zeros((48, 64, 3), dtype=np.uint8))
+        cache.encode(sequence)
+
+    assert list(cache.frames) == [1, 2]
+    assert {key[0] for key in cache.encodings} == {1, 2}
+    assert cache.encode(0) is None
+
+    sequence, encoded = cache.encode_latest()
+
+    assert sequence == 2 and encoded is cache.encodings[(2, 80, None)]
+
+
+def test_named_and_raw_qualities_resolved():
+
+    profiles = {'stream' : 70, 'evidence' : 95}
+
+    assert resolve_jpeg_quality('evidence', profiles) == 95
+    assert resolve_jpeg_quality('unknown', profiles) == 70
+    assert resolve_jpeg_quality('150', profiles) == 100
+    assert resolve_jpeg_quality(None, profiles) == 70
@@ -0,0 +1,100 @@
+'''
+    Tests for the gallery thumbnail cache.
+'''
+
+import time
+import os
+import pytest
+import numpy as np
+import cv2
+
+from app.CaptureIndex import CaptureIndex
+from app.Managment import ThumbnailCache
+
+
+@pytest.fixture
+def capture_index(tmp_path):
+
+    capture_index = CaptureIndex(str(tmp_path / 'captures.db'))
+
+    yield capture_index
+
+    capture_index.close()
+
+
+def write_still(tmp_path, capture_index : CaptureIndex, name : str, value : int = 90) -> dict:
+
+    path = str(tmp_path / name)
+    cv2.imwrite(path, np.random.default_rng(value).integers(0, 255, (720, 1280, 3), dtype=np.uint8))
+    capture_index.add(path, captured_at=time.time())
+
+    return capture_index.get(name)
+
+
+def test_still_thumbnail_generated_once_and_recorded(tmp_path, capture_index):
+
+    thumbnail_cache = ThumbnailCache(str(tmp_path / '.thumbnails'), capture_index=capture_index)
+    capture = write_still(tmp_path, capture_index, 'capture.jpg')
+
+    path = thumbnail_cache.fetch(capture)
+    thumbnail = cv2.imread(path)
+
+    # Fitted within the thumbnail size, keeping the captures aspect ratio.
+    assert thumbnail.shape[:2] == (180, 320)
+    assert capture_index.get('capture.jpg')['thumbnail'] == os.path.basename(path).split('.')[0]
+
+    # Served from the cache, not generated again.
+    assert thumbnail_cache.fetch(capture_index.get('capture.jpg')) == path
+    assert os.listdir(tmp_path / '.thumbnails') == [os.path.basename(path)]
+
+    # Stills have no animated preview.
+    assert thumbnail_cache.fetch(capture, variant='preview') is None
+
+
+def test_least_recently_used_evicted_beyond_the_cap(tmp_path, capture_index):
+
+    thumbnail_cache = ThumbnailCache(str(tmp_path / '.thumbnails'), capture_index=capture_index)
+    captures = [write_still(tmp_path, capture_index, f'{index}.jpg', value=index) for index in range(3)]
+    paths = [thumbnail_cache.fetch(capture) for capture in captures]
+
+    # One byte short of holding all three, with the first used more recently than the second.
+    thumbnail_cache.max_bytes = thumbnail_cache.total_bytes - 1
+    thumbnail_cache.fetch(captures[0])
+
+    # Registering the newest thumbnail again enforces the lowered cap.
+    thumbnail_cache.register(os.path.basename(paths[2]))
+
+    assert os.path.exists(paths[0]) and os.path.exists(paths[2])
+    assert not os.path.exists(paths[1])
+
+    # Evicted thumbnails are generated again on demand.
+    assert thumbnail_cache.fetch(capture_index.get('1.jpg')) == paths[1]
+
+
+def test_cached_thumbnails_registered_on_start_up(tmp_path, capture_index):
+
+    directory = str(tmp_path / '.thumbnails')
+    path = ThumbnailCache(directory, capture_index=capture_index).fetch(write_still(tmp_path, capture_index, 'capture.jpg'))
+
+    thumbnail_cache = ThumbnailCache(directory, capture_index=capture_index)
+
+    assert list(thumbnail_cache.entries) == [os.path.basename(path)]
+    assert thumbnail_cache.total_bytes == os.path.getsize(path)
+
+
+def test_clip_poster_taken_from_its_middle(tmp_path, capture_index):
+
+    path = str(tmp_path / 'clip.mp4')
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), 10, (640, 360))
+
+    for value in range(0, 250, 25):
+        writer.write(np.full((360, 640, 3), value, dtype=np.uint8))
+
+    writer.release()
+    capture_index.add(path, captured_at=time.time())
+
+    thumbnail_cache = ThumbnailCache(str(tmp_path / '.thumbnails'), capture_index=capture_index)
+    poster = cv2.imread(thumbnail_cache.fetch(capture_index.get('clip.mp4')))
+
+    assert poster.shape[:2] == (180, 320)
+    assert 75 <= poster.mean() <= 175
@@ -0,0 +1,128 @@
+'''
+    Tests for matching detections to tracks and the records kept of them.
+'''
+
+import types
+import pytest
+
+from app import Tracking
+from app.Tracking import ObjectTracking, TrajectoryBuffer
+
+
+@pytest.fixture
+def clock(monkeypatch):
+
+    ''' Time the tracker sees, advanced by the test. '''
+
+    clock = types.SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(Tracking, 'time', types.SimpleNamespace(time=lambda: clock.now))
+
+    return clock
+
+
+def box(x : int, y : int, size : int = 20) -> dict:
+
+    ''' Detection centred on the given point. '''
+
+    return {'x1' : x - size // 2, 'y1' : y - size // 2, 'x2' : x + size // 2, 'y2' : y + size // 2}
+
+
+def positions(tracker : ObjectTracking) -> dict[int, tuple[int, int]]:
+    return {ID : record.trajectory.last() for ID, record in tracker.detections.items()}
+
+
+def test_each_detection_claims_its_closest_track(clock):
+
+    tracker = ObjectTracking()
+    tracker.update_tracker([box(100, 100), box(160, 100)])
+
+    # Both detections are within range of both tracks, each goes to the nearer rather than both to the first.
+    clock.now += 0.1
+    tracker.update_tracker([box(150, 100), box(110, 100)])
+
+    assert positions(tracker) == {0 : (110, 100), 1 : (150, 100)}
+
+
+def test_track_never_claimed_twice(clock):
+
+    tracker = ObjectTracking()
+    tracker.update_tracker([box(100, 100)])
+
+    clock.now += 0.1
+    tracker.update_tracker([box(130, 100), box(105, 100)])
+
+    # The closer detection continues the track, the other is registered as a new one.
+    assert positions(tracker) == {0 : (105, 100), 1 : (130, 100)}
+
+
+def test_detections_beyond_the_threshold_start_new_tracks(clock):
+
+    tracker = ObjectTracking(EUCLIDEAN_DISTANCE_THRESHOLD=50)
+    tracker.update_tracker([box(100, 100)])
+
+    clock.now += 0.1
+    tracker.update_tracker([box(200, 100)])
+
+    assert positions(tracker) == {0 : (100, 100), 1 : (200, 100)}
+
+
+def test_trajectory_keeps_only_its_newest_points():
+
+    trajectory = TrajectoryBuffer(capacity=3)
+
+    for x in range(5):
+        trajectory.append((x, x * 10))
+
+    assert len(trajectory) == 3
+    assert trajectory.to_list() == [(2, 20), (3, 30), (4, 40)]
+    assert trajectory.last() == (4, 40)
+
+
+def test_track_record_read_like_a_detection(clock):
+
+    tracker = ObjectTracking(TRAJECTORY_LENGTH=2)
+
+    for x in (100, 110, 120):
+        tracker.update_tracker([box(x, 100)])
+        clock.now += 0.1
+
+    record, = tracker.update_tracker([])
+
+    assert record['x1'] == 110 and record.get('x2') == 130
+    assert record['center_point_trajectory'] == [(110, 100), (120, 100)]
+    assert record.get('unknown', 'default') == 'default'
+    assert record.as_dict()['center_point_trajectory'] == [(110, 100), (120, 100)]
+
+    with pytest.raises(KeyError):
+        record['unknown']
+
+
+@pytest.mark.parametrize('prediction, expected', [(True, {0}), (False, {0, 1})])
+def test_predicted_position_bridges_skipped_frames(clock, prediction, expected):
+
+    tracker = ObjectTracking(PREDICTION=prediction, EUCLIDEAN_DISTANCE_THRESHOLD=60, GATE_GROWTH_RATE=0)
+
+    # Moving right at 100 pixels per second.
+    for x in (100, 110, 120):
+        tracker.update_tracker([box(x, 100)])
+        clock.now += 0.1
+
+    # Unobserved for a second, it has moved well beyond the threshold of its last position but not of its predicted one.
+    clock.now += 0.9
+    tracker.update_tracker([box(220, 100)])
+
+    assert set(tracker.detections) == expected
+
+
+def test_pruned_track_IDs_never_reused(clock):
+
+    tracker = ObjectTracking(DEREGISTRATION_TIME=5)
+    tracker.update_tracker([box(100, 100)])
+
+    clock.now += 6
+    assert tracker.update_tracker([]) == []
+
+    # The same spot again, a new track rather than the pruned one returning.
+    record, = tracker.update_tracker([box(100, 100)])
+
+    assert record.ID == 1
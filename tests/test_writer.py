@@ -0,0 +1,83 @@
+'''
+    Tests for the capture writer worker.
+'''
+
+import threading
+import numpy as np
+import pytest
+import cv2
+
+from app.Writer import CaptureWriter
+
+
+@pytest.fixture
+def writer():
+
+    writer = CaptureWriter(max_queue=2)
+
+    yield writer
+
+    writer.stop()
+
+
+def test_encoded_still_written_as_is(tmp_path, writer):
+
+    completed = []
+    writer.add_listener(completed.append)
+
+    encoded = cv2.imencode('.jpg', np.zeros((48, 64, 3), dtype=np.uint8))[1].tobytes()
+    job = writer.write_still(str(tmp_path / 'still.jpg'), encoded=encoded, metadata={'max_threat' : 7})
+
+    writer.stop()
+
+    assert writer.status(job.ID) == 'done'
+    assert (tmp_path / 'still.jpg').read_bytes() == encoded
+    assert completed == [job] and job.options['metadata'] == {'max_threat' : 7}
+
+
+def test_clip_completed_once_closed(tmp_path, writer):
+
+    completed = []
+    writer.add_listener(completed.append)
+
+    clip = writer.open_clip(str(tmp_path / 'clip.mp4'), 10, (64, 48))
+    writer.append_clip_frames(clip, [np.full((48, 64, 3), value, dtype=np.uint8) for value in range(5)])
+    writer.close_clip(clip)
+
+    writer.stop()
+
+    # The clips open job is the one completed, carrying its metadata through to listeners.
+    assert completed == [clip] and clip.status == 'done'
+    assert cv2.VideoCapture(str(tmp_path / 'clip.mp4')).get(cv2.CAP_PROP_FRAME_COUNT) == 5
+
+
+def test_data_jobs_rejected_once_the_queue_is_full(tmp_path, writer):
+
+    release = threading.Event()
+
+    # Hold the worker on the first job so the queue fills up behind it.
+    writer.add_listener(lambda job: release.wait(timeout=5))
+
+    writer.write_still(str(tmp_path / 'first.jpg'), encoded=b'first')
+
+    for attempt in range(100):
+        if writer.backlog == 0:
+            break
+        threading.Event().wait(0.01)
+
+    accepted = [writer.write_still(str(tmp_path / f'{index}.jpg'), encoded=b'still') for index in range(3)]
+
+    # Control messages are accepted regardless, so clips are never left half written.
+    clip = writer.open_clip(str(tmp_path / 'clip.mp4'), 10, (64, 48))
+
+    release.set()
+
+    assert accepted[2] is None and None not in accepted[:2]
+    assert writer.statistics()['rejected'] == 1
+    assert clip is not None
+
+
+def test_unknown_job_kinds_rejected(writer):
+
+    with pytest.raises(ValueError):
+        writer.submit('thumbnail', 'thumbnail.jpg')